@@ -1,7 +1,6 @@
 import argparse
 from lib.hybrid_search import HybridSearch
 from lib.search_utils import load_movies
-from lib.gemini_integration import GeminiClient
 
 
 def main():
@@ -56,6 +55,9 @@ def main():
     )
 
     args = parser.parse_args()
+    # Imported after parsing, so --help doesn't load the LLM client
+    from lib.gemini_integration import GeminiClient
+
     query = args.query
     movies = load_movies()
     hybrid_search_instance = HybridSearch(movies)
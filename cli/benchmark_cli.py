@@ -0,0 +1,89 @@
+import argparse
+import sys
+
+from lib.benchmark import (
+    DEFAULT_LIMIT,
+    DEFAULT_MAX_REGRESSION,
+    DEFAULT_QUERIES,
+    DEFAULT_SEED,
+    DEFAULT_SIZES,
+    benchmark_command,
+)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the search hot paths on synthetic corpora"
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="Number of synthetic movies of every benchmarked corpus",
+    )
+    parser.add_argument(
+        "--queries",
+        type=int,
+        default=DEFAULT_QUERIES,
+        help="Synthetic queries timed per search benchmark",
+    )
+    parser.add_argument(
+        "--limit", type=int, default=DEFAULT_LIMIT, help="Results per search"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=DEFAULT_SEED, help="Seed of the synthetic data"
+    )
+    parser.add_argument("--output", type=str, help="Path of the JSON report")
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        help="JSON report of an earlier run to check for regressions against",
+    )
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=DEFAULT_MAX_REGRESSION,
+        help="Allowed slowdown over the baseline, as a fraction",
+    )
+    args = parser.parse_args()
+
+    report = benchmark_command(
+        args.sizes,
+        args.queries,
+        args.limit,
+        args.seed,
+        args.output,
+        args.baseline,
+        args.max_regression,
+    )
+
+    for size, benchmarks in report["sizes"].items():
+        print(f"\n{size} movies:")
+        for name, result in benchmarks.items():
+            if result["kind"] == "query":
+                print(
+                    f"  - {name}: p50 {result['seconds'] * 1000:.2f} ms, "
+                    f"p95 {result['p95_seconds'] * 1000:.2f} ms"
+                )
+            else:
+                print(
+                    f"  - {name}: {result['seconds']:.3f}s "
+                    f"({result['items_per_second']:.0f} movies/s)"
+                )
+
+    if args.output:
+        print(f"\nReport written to {args.output}")
+    if report["regressions"]:
+        print(f"\n{len(report['regressions'])} regression(s) over the baseline:")
+        for regression in report["regressions"]:
+            print(
+                f"  - {regression['size']} movies, {regression['benchmark']}: "
+                f"{regression['seconds']:.4f}s vs {regression['baseline_seconds']:.4f}s "
+                f"({regression['ratio']:.2f}x)"
+            )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
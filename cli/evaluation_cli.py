@@ -1,8 +1,15 @@
 import argparse
-from lib.search_utils import load_golden_dataset, load_movies
-from lib.hybrid_search import HybridSearch
 
-K_DEFAULT = 60
+from lib.hybrid_search import DEFAULT_K
+from lib.evaluation import (
+    DEFAULT_ALPHA,
+    DEFAULT_LIMIT,
+    DEFAULT_REPORT_PATH,
+    DEFAULT_WORKERS,
+    ENGINES,
+    LATENCY_PERCENTILES,
+    evaluation_command,
+)
 
 
 def main():
@@ -10,63 +17,94 @@ def main():
     parser.add_argument(
         "--limit",
         type=int,
-        default=5,
-        help="Number of results to evaluate (k for precision@k, recall@k)",
+        default=DEFAULT_LIMIT,
+        help="Number of results to evaluate (k for precision@k, recall@k, nDCG@k)",
+    )
+    parser.add_argument(
+        "--engines",
+        nargs="+",
+        choices=ENGINES,
+        default=ENGINES,
+        help="Search engines evaluated side by side",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=(
+            "Worker processes running the test cases, 1 runs them in process "
+            "and is the only setting timing each search in isolation"
+        ),
+    )
+    parser.add_argument(
+        "--k", type=int, default=DEFAULT_K, help="RRF k constant of the rrf engine"
+    )
+    parser.add_argument(
+        "--alpha",
+        type=float,
+        default=DEFAULT_ALPHA,
+        help="Keyword weight of the weighted engine",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=DEFAULT_REPORT_PATH,
+        help="Path of the JSON report",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Print the results of every query"
     )
 
     args = parser.parse_args()
-    limit = args.limit
-    dataset = load_golden_dataset()
-    movies = load_movies()
-    hybrid_search_instance = HybridSearch(movies)
-    print(f"k={limit}\n")
-    for testcase in dataset:
-        query = testcase["query"]
-        test_results = hybrid_search_instance.rrf_search(query, K_DEFAULT, limit)
-        fetched_movies = [movie["document"]["title"] for _, movie in test_results]
-        relevant_retrieved = get_relevants_for_testcase(
-            fetched_movies, testcase["relevant_docs"]
-        )
-        precision = len(relevant_retrieved) / len(test_results)
-        recall = len(relevant_retrieved) / len(testcase["relevant_docs"])
-        if precision == 0 and recall == 0:
-            f1_score = 0
-        else:
-            f1_score = 2 * (precision * recall) / (precision + recall)
-            
-        log_results(
-            query,
-            limit,
-            precision,
-            recall,
-            f1_score,
-            fetched_movies,
-            testcase["relevant_docs"],
-        )
+    report = evaluation_command(
+        args.engines, args.limit, args.k, args.alpha, args.workers, args.output
+    )
+    limit = report["limit"]
 
+    if args.verbose:
+        for engine, engine_report in report["engines"].items():
+            print(f"== {engine} ==")
+            for query in engine_report["queries"]:
+                log_results(limit, query)
+            print()
 
-def get_relevants_for_testcase(
-    fetched_movies: list[str], relevants: list[str]
-) -> list[str]:
-    relevants = [movie for movie in fetched_movies if movie in relevants]
-    return relevants
+    print(
+        f"{report['testcases']} test cases, k={limit}, {report['workers']} worker(s), "
+        f"{report['wall_seconds']:.2f}s"
+    )
+    if not report["latency_isolated"]:
+        print(
+            f"Latencies measured under concurrent load, {report['workers']} workers "
+            "searching at once (use --workers 1 to time each search alone)"
+        )
+    latency_columns = "".join(f"{f'p{p} ms':>9}" for p in LATENCY_PERCENTILES)
+    print(
+        f"{'engine':<10}{'P@k':>8}{'R@k':>8}{'F1':>8}{'MAP':>8}{'MRR':>8}"
+        f"{'nDCG@k':>8}{latency_columns}"
+    )
+    for engine, engine_report in report["engines"].items():
+        metrics, latency = engine_report["metrics"], engine_report["latency_ms"]
+        latency_values = "".join(
+            f"{latency[f'p{p}']:>9.1f}" for p in LATENCY_PERCENTILES
+        )
+        print(
+            f"{engine:<10}{metrics['precision']:>8.4f}{metrics['recall']:>8.4f}"
+            f"{metrics['f1']:>8.4f}{metrics['average_precision']:>8.4f}"
+            f"{metrics['reciprocal_rank']:>8.4f}{metrics['ndcg']:>8.4f}"
+            f"{latency_values}"
+        )
+    print(f"\nReport written to {args.output}")
 
 
-def log_results(
-    query: str,
-    k: int,
-    precision: float,
-    recall: float,
-    f1_score: float,
-    retrieved: list[str],
-    relevant: list[str],
-) -> None:
-    print(f"- Query: {query}")
-    print(f"  - Precision@{k}: {precision:.4f}")
-    print(f"  - Recall@{k}: {recall:.4f}")
-    print(f"  - F1 Score: {f1_score:.4f}")
-    print(f"  - Retrieved: {', '.join(retrieved)}")
-    print(f"  - Relevant: {', '.join(relevant)}")
+def log_results(k: int, query: dict) -> None:
+    print(f"- Query: {query['query']}")
+    print(f"  - Precision@{k}: {query['precision']:.4f}")
+    print(f"  - Recall@{k}: {query['recall']:.4f}")
+    print(f"  - F1 Score: {query['f1']:.4f}")
+    print(f"  - nDCG@{k}: {query['ndcg']:.4f}")
+    print(f"  - Latency: {query['latency_ms']:.1f}ms")
+    print(f"  - Retrieved: {', '.join(query['retrieved'])}")
+    print(f"  - Relevant: {', '.join(query['relevant'])}")
 
 
 if __name__ == "__main__":
@@ -4,8 +4,11 @@ from lib.hybrid_search import (
     normalize_command,
     weighted_search_command,
     rrf_search_command,
+    CandidateDepth,
+    DEPTH_MODES,
 )
-from lib.gemini_integration import GeminiClient
+from lib.llm_rerank import DEFAULT_CONCURRENCY, DEFAULT_TIMEOUT
+from lib.tracing import enable_tracing, format_trace, trace
 
 
 def main() -> None:
@@ -42,6 +45,12 @@ def main() -> None:
         help="Number of search hits to be returned",
     )
 
+    add_candidate_depth_arguments(
+        weighted_search_parser,
+        [mode for mode in DEPTH_MODES if mode != "adaptive"],
+    )
+    add_trace_argument(weighted_search_parser)
+
     rrf_search_parser = subparsers.add_parser(
         "rrf-search",
         help="Perform a hybrid search, using rrf scores in both types of searches to get the final result",
@@ -79,6 +88,20 @@ def main() -> None:
         help="Results reranking method using LLM",
     )
 
+    rrf_search_parser.add_argument(
+        "--rerank-concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="Maximum concurrent LLM calls of the individual rerank method",
+    )
+
+    rrf_search_parser.add_argument(
+        "--rerank-timeout",
+        type=float,
+        default=DEFAULT_TIMEOUT,
+        help="Seconds before an individual rerank LLM call is retried",
+    )
+
     rrf_search_parser.add_argument(
         "--debug",
         action="store_true",
@@ -91,75 +114,118 @@ def main() -> None:
         help="Print debug statements",
     )
 
+    add_candidate_depth_arguments(rrf_search_parser, DEPTH_MODES)
+    add_trace_argument(rrf_search_parser)
+
     args = parser.parse_args()
 
-    match args.command:
-        case "normalize":
-            normalized_scores = normalize_command(args.scores)
-            for score in normalized_scores:
-                print(f"* {score:.4f}")
-        case "weighted-search":
-            hits = weighted_search_command(args.query, args.alpha, args.limit)
-            for i, hit in enumerate(hits, 1):
-                print(f"{i}. {hit['document']['title']}")
-                print(f"   Hybrid Score: {hit['hybrid_score']:.4f}")
-                print(
-                    f"   BM25: {hit['keyword_score']:.4f}, Semantic: {hit['semantic_score']:.4f}"
-                )
-                print(f"   {hit['document']['description'][:100]}")
-        case "rrf-search":
-            hits = rrf_search_command(
-                args.query,
-                args.k,
-                args.limit,
-                args.enhance,
-                args.rerank_method,
-                args.debug,
-            )
-            formatted_results = []
-            for i, hit in enumerate(hits, 1):
-                formatted_line = f"{i}. {hit['document']['title']}"
-                print(f"{i}. {hit['document']['title']}")
-                if hit.get("rerank_score"):
-                    print(f"   Rerank Score: {hit.get('rerank_score'):.3f}/10")
-                    formatted_line += (
-                        "\n" + f"   Rerank Score: {hit.get('rerank_score'):.3f}/10"
+    if getattr(args, "trace", False):
+        enable_tracing()
+
+    with trace(args.command or "help") as current:
+        match args.command:
+            case "normalize":
+                normalized_scores = normalize_command(args.scores)
+                for score in normalized_scores:
+                    print(f"* {score:.4f}")
+            case "weighted-search":
+                depth = CandidateDepth(args.depth_mode, args.depth)
+                hits = weighted_search_command(args.query, args.alpha, args.limit, depth)
+                for i, hit in enumerate(hits, 1):
+                    print(f"{i}. {hit['document']['title']}")
+                    print(f"   Hybrid Score: {hit['hybrid_score']:.4f}")
+                    print(
+                        f"   BM25: {hit['keyword_score']:.4f}, Semantic: {hit['semantic_score']:.4f}"
                     )
-                if hit.get("rerank_rank"):
-                    print(f"   Rerank Rank: {hit.get('rerank_rank')}")
-                    formatted_line += "\n" + f"   Rerank Rank: {hit.get('rerank_rank')}"
-                if hit.get("cross_encoder_score"):
+                    print(f"   {hit['document']['description'][:100]}")
+            case "rrf-search":
+                depth = CandidateDepth(args.depth_mode, args.depth)
+                hits = rrf_search_command(
+                    args.query,
+                    args.k,
+                    args.limit,
+                    args.enhance,
+                    args.rerank_method,
+                    args.debug,
+                    depth,
+                    args.rerank_concurrency,
+                    args.rerank_timeout,
+                )
+                formatted_results = []
+                for i, hit in enumerate(hits, 1):
+                    formatted_line = f"{i}. {hit['document']['title']}"
+                    print(f"{i}. {hit['document']['title']}")
+                    if hit.get("rerank_score"):
+                        print(f"   Rerank Score: {hit.get('rerank_score'):.3f}/10")
+                        formatted_line += (
+                            "\n" + f"   Rerank Score: {hit.get('rerank_score'):.3f}/10"
+                        )
+                    if hit.get("rerank_rank"):
+                        print(f"   Rerank Rank: {hit.get('rerank_rank')}")
+                        formatted_line += "\n" + f"   Rerank Rank: {hit.get('rerank_rank')}"
+                    if hit.get("cross_encoder_score"):
+                        print(
+                            f"   Corss Encoder Score: {hit.get('cross_encoder_score'):.3f}"
+                        )
+                        formatted_line += (
+                            "\n"
+                            + f"   Corss Encoder Score: {hit.get('cross_encoder_score'):.3f}"
+                        )
+                    print(f"   RRF Score: {hit['rrf_score']:.4f}")
+                    formatted_line += "\n" + f"   RRF Score: {hit['rrf_score']:.4f}"
                     print(
-                        f"   Corss Encoder Score: {hit.get('cross_encoder_score'):.3f}"
+                        f"   BM25 Rank: {hit['bm25_rank']}, Semantic Rank: {hit['semantic_rank']}"
                     )
                     formatted_line += (
                         "\n"
-                        + f"   Corss Encoder Score: {hit.get('cross_encoder_score'):.3f}"
+                        + f"   BM25 Rank: {hit['bm25_rank']}, Semantic Rank: {hit['semantic_rank']}"
                     )
-                print(f"   RRF Score: {hit['rrf_score']:.4f}")
-                formatted_line += "\n" + f"   RRF Score: {hit['rrf_score']:.4f}"
-                print(
-                    f"   BM25 Rank: {hit['bm25_rank']}, Semantic Rank: {hit['semantic_rank']}"
-                )
-                formatted_line += (
-                    "\n"
-                    + f"   BM25 Rank: {hit['bm25_rank']}, Semantic Rank: {hit['semantic_rank']}"
-                )
-                print(f"   {hit['document']['description'][:100]}")
-                formatted_line += "\n" + f"   {hit['document']['description'][:100]}"
-                formatted_results.append(formatted_line)
-            if args.evaluate:
-                gemini_client = GeminiClient()  # TODO: args.query shouldn't be used here, since the query could have been enhanced by LLM inside rrf_search
-                evaluation = gemini_client.evaluate_results(
-                    args.query, formatted_results
-                )
-                print("LLM Evaluation of search results:")
-                for rank, score in enumerate(evaluation, 1):
-                    title = hits[rank-1]['document']['title']
-                    print(f"{rank}. {title}: {score}/3")
+                    print(f"   {hit['document']['description'][:100]}")
+                    formatted_line += "\n" + f"   {hit['document']['description'][:100]}"
+                    formatted_results.append(formatted_line)
+                if args.evaluate:
+                    from lib.gemini_integration import GeminiClient
+
+                    gemini_client = GeminiClient()  # TODO: args.query shouldn't be used here, since the query could have been enhanced by LLM inside rrf_search
+                    evaluation = gemini_client.evaluate_results(
+                        args.query, formatted_results
+                    )
+                    print("LLM Evaluation of search results:")
+                    for rank, score in enumerate(evaluation, 1):
+                        title = hits[rank-1]['document']['title']
+                        print(f"{rank}. {title}: {score}/3")
 
-        case _:
-            parser.print_help()
+            case _:
+                parser.print_help()
+
+    if current is not None:
+        print()
+        print(format_trace(current))
+
+
+def add_candidate_depth_arguments(
+    parser: argparse.ArgumentParser, modes: list[str]
+) -> None:
+    parser.add_argument(
+        "--depth-mode",
+        type=str,
+        choices=modes,
+        default="proportional",
+        help="How many candidates each retriever returns before fusion. fixed = --depth candidates, proportional = --depth * limit, adaptive = start at --depth * limit and double until the fused top results can't change",
+    )
+    parser.add_argument(
+        "--depth",
+        type=int,
+        help="Candidate depth value for --depth-mode. Defaults: fixed 100, proportional 500, adaptive 2",
+    )
+
+
+def add_trace_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Print the time spent in every pipeline stage and the stage counters",
+    )
 
 
 if __name__ == "__main__":
@@ -2,6 +2,7 @@
 from lib.keyword_search import (
     search_command,
     build_command,
+    update_command,
     tf_command,
     idf_command,
     tfidf_command,
@@ -10,7 +11,7 @@ from lib.keyword_search import (
     bm25_search_command
 )
 
-from lib.inverted_index import BM25_K1, BM25_B
+from lib.inverted_index import BM25_K1, BM25_B, DEFAULT_BUILD_WORKERS
 
 import argparse
 
@@ -19,7 +20,20 @@ def main() -> None:
     parser = argparse.ArgumentParser(description="Keyword Search CLI")
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
 
-    subparsers.add_parser("build", help="Build inverted index cache for keyword search")
+    build_parser = subparsers.add_parser(
+        "build", help="Build inverted index cache for keyword search"
+    )
+    build_parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_BUILD_WORKERS,
+        help="Processes tokenizing the movies (1 builds serially)",
+    )
+
+    subparsers.add_parser(
+        "update",
+        help="Apply the added, changed and deleted movies to the inverted index cache",
+    )
 
     search_parser = subparsers.add_parser("search", help="Search movies using BM25")
     search_parser.add_argument("query", type=str, help="Search query")
@@ -83,9 +97,16 @@ def main() -> None:
     match args.command:
         case "build":
             print("Building inverted index...")
-            build_command()
+            build_command(args.workers)
             print("Inverted index built successfully.")
 
+        case "update":
+            print("Updating inverted index...")
+            stats = update_command()
+            print(
+                f"Added {stats['added']}, updated {stats['updated']} and deleted {stats['deleted']} movies."
+            )
+
         case "search":
             print(f"Searching for: {args.query}")
             result = search_command(args.query)
@@ -0,0 +1,111 @@
+import os
+
+import numpy as np
+
+from .search_utils import atomic_write
+
+DEFAULT_PROBES = 8
+KMEANS_ITERATIONS = 10
+# k-means is trained on a sample of at most this many vectors per list
+TRAIN_POINTS_PER_LIST = 256
+BLOCK_ROWS = 16384
+
+
+class IVFIndex:
+    # Inverted file index: the vectors are clustered with spherical k-means
+    # and a query is only compared with the vectors of the n_probe clusters
+    # whose centroids are closest to it. list_rows holds the row numbers of
+    # every cluster contiguously, delimited by list_offsets.
+    def __init__(self, n_probe: int = DEFAULT_PROBES, seed: int = 0) -> None:
+        if n_probe < 1:
+            raise ValueError("n_probe must be at least 1")
+        self.n_probe = n_probe
+        self.seed = seed
+        self.centroids = None
+        self.list_offsets = None
+        self.list_rows = None
+
+    def _path(self, embeddings_path: str) -> str:
+        base, _ = os.path.splitext(embeddings_path)
+        return f"{base}.ivf.npz"
+
+    def build(self, embeddings: np.ndarray, n_lists: int | None = None) -> None:
+        total_rows = len(embeddings)
+        if n_lists is None:
+            n_lists = int(np.sqrt(total_rows))
+        n_lists = max(1, min(n_lists, total_rows))
+        rng = np.random.default_rng(self.seed)
+        self.centroids = self._train_centroids(embeddings, n_lists, rng)
+
+        assignment = np.empty(total_rows, dtype=np.int32)
+        for start in range(0, total_rows, BLOCK_ROWS):
+            block = np.asarray(embeddings[start : start + BLOCK_ROWS], np.float32)
+            assignment[start : start + BLOCK_ROWS] = np.argmax(
+                block @ self.centroids.T, axis=1
+            )
+        self.list_rows = np.argsort(assignment, kind="stable").astype(np.int32)
+        self.list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        self.list_offsets[1:] = np.cumsum(np.bincount(assignment, minlength=n_lists))
+
+    def _train_centroids(
+        self, embeddings: np.ndarray, n_lists: int, rng: np.random.Generator
+    ) -> np.ndarray:
+        sample_size = min(len(embeddings), n_lists * TRAIN_POINTS_PER_LIST)
+        sample_rows = np.sort(rng.choice(len(embeddings), sample_size, replace=False))
+        sample = np.asarray(embeddings[sample_rows], dtype=np.float32)
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            norms = np.linalg.norm(sums, axis=1)
+            empty = norms == 0
+            centroids[~empty] = sums[~empty] / norms[~empty, None]
+            # Clusters that lost all their points are re-seeded at random
+            if np.any(empty):
+                centroids[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+        return centroids
+
+    def save(self, embeddings_path: str) -> None:
+        with atomic_write(self._path(embeddings_path)) as file:
+            np.savez(
+                file,
+                centroids=self.centroids,
+                list_offsets=self.list_offsets,
+                list_rows=self.list_rows,
+            )
+
+    def load(self, embeddings_path: str) -> None:
+        path = self._path(embeddings_path)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} not found")
+        with np.load(path) as data:
+            self.centroids = data["centroids"]
+            self.list_offsets = data["list_offsets"]
+            self.list_rows = data["list_rows"]
+
+    def load_or_build(self, embeddings_path: str, embeddings: np.ndarray) -> None:
+        path = self._path(embeddings_path)
+        if (
+            os.path.exists(path)
+            and os.path.exists(embeddings_path)
+            and os.path.getmtime(path) >= os.path.getmtime(embeddings_path)
+        ):
+            self.load(embeddings_path)
+            if len(self.list_rows) == len(embeddings):
+                return
+        self.build(embeddings)
+        self.save(embeddings_path)
+
+    def candidate_rows(self, query: np.ndarray) -> np.ndarray:
+        centroid_scores = self.centroids @ query
+        n_probe = min(self.n_probe, len(centroid_scores))
+        lists = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+        rows = [
+            self.list_rows[self.list_offsets[i] : self.list_offsets[i + 1]]
+            for i in lists
+        ]
+        return np.sort(np.concatenate(rows))
+
+
+ANN_BACKENDS = {"ivf": IVFIndex}
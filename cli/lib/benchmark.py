@@ -0,0 +1,299 @@
+import json
+import os
+import tempfile
+import time
+import zlib
+
+import numpy as np
+
+from . import search_utils
+from .chunked_semantic_search import ChunkedSemanticSearch, semantic_chunk_text
+from .compact_index import CompactIndex
+from .hybrid_search import DEFAULT_K, HybridSearch
+from .inverted_index import DEFAULT_BUILD_WORKERS, InvertedIndex
+from .search_utils import atomic_write, cache_path, iter_movies, set_cache_dir
+from .semantic_search import SemanticSearch
+from .text_processing import preprocess_text
+
+DEFAULT_SIZES = [1000, 10000]
+DEFAULT_QUERIES = 50
+DEFAULT_LIMIT = 10
+DEFAULT_SEED = 0
+# A benchmark regresses when it is this much slower than the baseline...
+DEFAULT_MAX_REGRESSION = 0.25
+# ...and at least this many seconds slower, so sub-millisecond timer noise
+# doesn't count
+MIN_REGRESSION_SECONDS = 0.002
+STUB_MODEL_NAME = "benchmark-stub"
+STUB_DIMENSIONS = 384
+VOCABULARY_SIZE = 20000
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "qua", "bel", "dor"]
+
+
+class HashingEmbeddingModel:
+    # Stand-in for a SentenceTransformer: a text embeds as the signed,
+    # hashed bag of its words. Deterministic, CPU only and nothing to
+    # download, yet texts sharing words still score as similar.
+    def __init__(self, dimensions: int = STUB_DIMENSIONS) -> None:
+        self.dimensions = dimensions
+        self._buckets = {}
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimensions
+
+    def _bucket(self, word: str) -> int:
+        bucket = self._buckets.get(word)
+        if bucket is None:
+            # Signed bucket: the lowest bit picks the sign
+            bucket = self._buckets[word] = zlib.crc32(word.encode("utf-8")) % (
+                2 * self.dimensions
+            )
+        return bucket
+
+    def encode(self, texts: list[str], **kwargs) -> np.ndarray:
+        embeddings = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            buckets = np.array(
+                [self._bucket(word) for word in text.lower().split()], dtype=np.int64
+            )
+            signs = np.where(buckets % 2 == 0, 1.0, -1.0)
+            np.add.at(embeddings[row], buckets // 2, signs)
+        return embeddings
+
+
+def synthetic_vocabulary(size: int = VOCABULARY_SIZE) -> list[str]:
+    words, n = [], 0
+    while len(words) < size:
+        n += 1
+        word, rest = "", n
+        while rest:
+            rest, syllable = divmod(rest, len(SYLLABLES))
+            word += SYLLABLES[syllable]
+        words.append(word)
+    return words
+
+
+def synthetic_movies(size: int, seed: int = DEFAULT_SEED) -> list[dict]:
+    # Words follow a Zipf distribution like natural text does, so posting
+    # list lengths (and the BM25 cost of a term) vary the way they do on
+    # real descriptions
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array(synthetic_vocabulary())
+    movies = []
+    for movie_id in range(1, size + 1):
+        sentences = [
+            " ".join(_sample_words(rng, vocabulary, rng.integers(5, 15))) + "."
+            for _ in range(rng.integers(3, 8))
+        ]
+        movies.append(
+            {
+                "id": movie_id,
+                "title": " ".join(_sample_words(rng, vocabulary, rng.integers(2, 5))),
+                "description": " ".join(sentences),
+            }
+        )
+    return movies
+
+
+def synthetic_queries(count: int, seed: int = DEFAULT_SEED) -> list[str]:
+    rng = np.random.default_rng(seed + 1)
+    vocabulary = np.array(synthetic_vocabulary())
+    return [
+        " ".join(_sample_words(rng, vocabulary, rng.integers(2, 4)))
+        for _ in range(count)
+    ]
+
+
+def _sample_words(
+    rng: np.random.Generator, vocabulary: np.ndarray, count: int
+) -> list[str]:
+    ranks = np.minimum(rng.zipf(1.2, count), len(vocabulary)) - 1
+    return vocabulary[ranks].tolist()
+
+
+def _timed(function, *args) -> tuple[object, float]:
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def _build_result(seconds: float, items: int) -> dict:
+    return {"kind": "build", "seconds": seconds, "items_per_second": items / seconds}
+
+
+def _query_result(function, queries: list[str], limit: int) -> dict:
+    # One untimed call loads anything lazily initialized
+    function(queries[0], limit)
+    latencies = []
+    for query in queries:
+        _, seconds = _timed(function, query, limit)
+        latencies.append(seconds)
+    p50, p95 = np.percentile(latencies, [50, 95])
+    # seconds, the number compared against the baseline, is the median
+    return {
+        "kind": "query",
+        "seconds": float(p50),
+        "p95_seconds": float(p95),
+        "mean_seconds": float(np.mean(latencies)),
+    }
+
+
+def run_benchmarks(
+    size: int,
+    query_count: int = DEFAULT_QUERIES,
+    limit: int = DEFAULT_LIMIT,
+    seed: int = DEFAULT_SEED,
+) -> dict[str, dict]:
+    movies = synthetic_movies(size, seed)
+    queries = synthetic_queries(query_count, seed)
+    texts = [f"{movie['title']} {movie['description']}" for movie in movies]
+    model = HashingEmbeddingModel()
+    results = {}
+
+    # Loads the stopwords and stemmer outside of the timed loop
+    preprocess_text(queries[0])
+    _, seconds = _timed(lambda: [preprocess_text(text) for text in texts])
+    results["preprocess_text"] = _build_result(seconds, size)
+    _, seconds = _timed(
+        lambda: [semantic_chunk_text(movie["description"], 4, 1) for movie in movies]
+    )
+    results["semantic_chunk_text"] = _build_result(seconds, size)
+
+    catalog_path = cache_path("movies.json")
+    with open(catalog_path, "w") as file:
+        json.dump({"movies": movies}, file)
+    _, seconds = _timed(lambda: sum(1 for _ in iter_movies(catalog_path)))
+    results["iter_movies"] = _build_result(seconds, size)
+
+    inverted_index = InvertedIndex()
+    _, seconds = _timed(inverted_index.build, movies)
+    results["inverted_index.build"] = _build_result(seconds, size)
+    _, seconds = _timed(InvertedIndex().build, movies, DEFAULT_BUILD_WORKERS)
+    results["inverted_index.build_sharded"] = _build_result(seconds, size)
+    _, seconds = _timed(inverted_index.save)
+    results["inverted_index.save"] = _build_result(seconds, size)
+    _, seconds = _timed(InvertedIndex().load)
+    results["inverted_index.load"] = _build_result(seconds, size)
+    results["inverted_index.bm25_search"] = _query_result(
+        inverted_index.bm25_search, queries, limit
+    )
+
+    compact_index = CompactIndex()
+    _, seconds = _timed(compact_index.build, inverted_index)
+    results["compact_index.build"] = _build_result(seconds, size)
+    compact_index.save()
+    compact_index = CompactIndex()
+    _, seconds = _timed(compact_index.load)
+    results["compact_index.load"] = _build_result(seconds, size)
+    results["compact_index.bm25_search"] = _query_result(
+        compact_index.bm25_search, queries, limit
+    )
+    del inverted_index
+
+    # No query cache: every search call encodes its query
+    semantic_search = SemanticSearch(
+        STUB_MODEL_NAME, mmap_mode="r", query_cache_size=0, model=model
+    )
+    _, seconds = _timed(semantic_search.build_embeddings, movies)
+    results["semantic_search.build_embeddings"] = _build_result(seconds, size)
+    results["semantic_search.search"] = _query_result(
+        semantic_search.search, queries, limit
+    )
+    del semantic_search
+
+    chunked_search = ChunkedSemanticSearch(
+        STUB_MODEL_NAME, mmap_mode="r", query_cache_size=0, model=model
+    )
+    _, seconds = _timed(chunked_search.build_chunk_embeddings, movies)
+    results["chunked_semantic_search.build_chunk_embeddings"] = _build_result(
+        seconds, size
+    )
+    results["chunked_semantic_search.search_chunks"] = _query_result(
+        chunked_search.search_chunks, queries, limit
+    )
+
+    # Loads the compact index and chunk embeddings built above
+    hybrid_search, seconds = _timed(
+        HybridSearch, movies, "r", chunked_search
+    )
+    results["hybrid_search.load"] = _build_result(seconds, size)
+    results["hybrid_search.rrf_search"] = _query_result(
+        lambda query, limit: hybrid_search.rrf_search(query, DEFAULT_K, limit),
+        queries,
+        limit,
+    )
+    results["hybrid_search.weighted_search"] = _query_result(
+        lambda query, limit: hybrid_search.weighted_search(query, 0.5, limit),
+        queries,
+        limit,
+    )
+    return results
+
+
+def find_regressions(
+    report: dict, baseline: dict, max_regression: float = DEFAULT_MAX_REGRESSION
+) -> list[dict]:
+    regressions = []
+    for size, benchmarks in report["sizes"].items():
+        baseline_benchmarks = baseline.get("sizes", {}).get(size, {})
+        for name, result in benchmarks.items():
+            if name not in baseline_benchmarks:
+                continue
+            seconds = result["seconds"]
+            baseline_seconds = baseline_benchmarks[name]["seconds"]
+            if (
+                seconds > baseline_seconds * (1 + max_regression)
+                and seconds - baseline_seconds > MIN_REGRESSION_SECONDS
+            ):
+                regressions.append(
+                    {
+                        "size": int(size),
+                        "benchmark": name,
+                        "seconds": seconds,
+                        "baseline_seconds": baseline_seconds,
+                        "ratio": seconds / baseline_seconds,
+                    }
+                )
+    return regressions
+
+
+def benchmark_command(
+    sizes: list[int] = DEFAULT_SIZES,
+    query_count: int = DEFAULT_QUERIES,
+    limit: int = DEFAULT_LIMIT,
+    seed: int = DEFAULT_SEED,
+    output: str | None = None,
+    baseline_path: str | None = None,
+    max_regression: float = DEFAULT_MAX_REGRESSION,
+) -> dict:
+    report = {
+        "queries": query_count,
+        "limit": limit,
+        "seed": seed,
+        "max_regression": max_regression,
+        "sizes": {},
+    }
+    cache_dir = search_utils.CACHE_DIR
+    for size in sizes:
+        print(f"Benchmarking {size} synthetic movies...")
+        # Every index and embedding cache of the run lives in a throwaway
+        # directory, the real caches are never touched
+        with tempfile.TemporaryDirectory(prefix="benchmark-") as directory:
+            set_cache_dir(directory)
+            try:
+                report["sizes"][str(size)] = run_benchmarks(
+                    size, query_count, limit, seed
+                )
+            finally:
+                set_cache_dir(cache_dir)
+
+    report["regressions"] = []
+    if baseline_path is not None:
+        with open(baseline_path, "r") as file:
+            baseline = json.load(file)
+        report["baseline"] = os.path.abspath(baseline_path)
+        report["regressions"] = find_regressions(report, baseline, max_regression)
+    if output is not None:
+        with atomic_write(os.path.abspath(output), "w") as file:
+            json.dump(report, file, indent=2)
+    return report
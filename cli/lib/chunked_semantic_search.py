@@ -2,125 +2,460 @@ import numpy as np
 import re
 import os
 import json
+import time
+from collections.abc import Iterable, Iterator, Sequence
+from itertools import batched
 
-from .semantic_search import SemanticSearch, cosine_similarity
-from .search_utils import load_movies
+from .semantic_search import (
+    BUILD_BATCH_SIZE,
+    COMPACTION_THRESHOLD,
+    QUERY_BLOCK_ROWS,
+    RESCORE_FACTOR,
+    SemanticSearch,
+    l2_normalize,
+    load_normalized_embeddings,
+)
+from .quantization import QUANTIZATION_MODES
+from .tracing import count, span
+from .embedding_store import QUERY_CACHE_SIZE
+from .ann_index import ANN_BACKENDS, DEFAULT_PROBES, IVFIndex
+from .search_utils import (
+    atomic_write,
+    build_row_metadata,
+    content_hash,
+    diff_documents,
+    iter_movies,
+    load_golden_dataset,
+    load_movies,
+    top_k_indices,
+)
 
 SCORE_PRECISION = 10
 
 
 class ChunkedSemanticSearch(SemanticSearch):
-    def __init__(self, model_name="all-MiniLM-L6-v2") -> None:
-        super().__init__(model_name)
+    def __init__(
+        self,
+        model_name="all-MiniLM-L6-v2",
+        mmap_mode: str | None = None,
+        quantization: str | None = None,
+        rescore_factor: int = RESCORE_FACTOR,
+        ann: str | None = None,
+        ann_probes: int = DEFAULT_PROBES,
+        query_cache_size: int = QUERY_CACHE_SIZE,
+        persist_query_cache: bool = False,
+        model=None,
+    ) -> None:
+        super().__init__(
+            model_name,
+            mmap_mode,
+            quantization,
+            rescore_factor,
+            query_cache_size,
+            persist_query_cache,
+            model,
+        )
+        # Approximate nearest neighbor backend for the chunk search, the exact
+        # exhaustive scan is used when None
+        self.ann = ann
+        self.ann_probes = ann_probes
+        self.ann_index = None
         self.chunk_embeddings = None
-        self.chunk_metadata = None
+        self.quantized_chunk_embeddings = None
+        self.chunk_movie_idx = None
+        self.chunk_idx = None
+        self.deleted_chunk_rows = None
+        self.movie_group_starts = None
+        # Id and description hash of every chunked movie, see ROW_METADATA_DTYPE
+        self.chunk_documents = None
         self.CACHE_CHUNK_EMBEDDINGS = os.path.join(
             self.CACHE_DIR, "chunk_embeddings.npy"
         )
-        self.CACHE_CHUNK_METADATA = os.path.join(
+        # Rows: movie_idx and chunk_idx of every chunk, as int32. A chunk_idx of
+        # -1 marks a tombstone.
+        self.CACHE_CHUNK_METADATA = os.path.join(self.CACHE_DIR, "chunk_metadata.npy")
+        self.CACHE_CHUNK_DOCUMENTS = os.path.join(
+            self.CACHE_DIR, "chunk_documents.npy"
+        )
+        # Written by older versions, only read to migrate existing caches
+        self.CACHE_LEGACY_CHUNK_METADATA = os.path.join(
             self.CACHE_DIR, "chunk_metadata.json"
         )
 
-    def _save_chunk(self, total_chunks) -> None:
+    def _save_chunk(self) -> None:
         os.makedirs(self.CACHE_DIR, exist_ok=True)
 
-        with open(self.CACHE_CHUNK_EMBEDDINGS, "wb") as file:
+        with atomic_write(self.CACHE_CHUNK_DOCUMENTS) as file:
+            np.save(file, self.chunk_documents)
+        with atomic_write(self.CACHE_CHUNK_EMBEDDINGS) as file:
             np.save(file, self.chunk_embeddings)
-        with open(self.CACHE_CHUNK_METADATA, "w") as file:
-            json.dump(
-                {"chunks": self.chunk_metadata, "total_chunks": total_chunks},
-                file,
-                indent=2,
-            )
+        with atomic_write(self.CACHE_CHUNK_METADATA) as file:
+            np.save(file, np.stack((self.chunk_movie_idx, self.chunk_idx)))
 
     def _load_chunk(self) -> None:
         if not os.path.exists(self.CACHE_CHUNK_EMBEDDINGS):
             raise FileNotFoundError(f"{self.CACHE_CHUNK_EMBEDDINGS} not found")
 
-        with open(self.CACHE_CHUNK_EMBEDDINGS, "rb") as file:
-            self.chunk_embeddings = np.load(file)
+        self.chunk_embeddings = load_normalized_embeddings(
+            self.CACHE_CHUNK_EMBEDDINGS, self._embeddings_mmap_mode()
+        )
 
-        if not os.path.exists(self.CACHE_CHUNK_METADATA):
+        if os.path.exists(self.CACHE_CHUNK_METADATA):
+            chunk_metadata = np.load(
+                self.CACHE_CHUNK_METADATA, mmap_mode=self.mmap_mode
+            )
+            self._initialize_chunk_arrays(chunk_metadata[0], chunk_metadata[1])
+        elif os.path.exists(self.CACHE_LEGACY_CHUNK_METADATA):
+            with open(self.CACHE_LEGACY_CHUNK_METADATA, "r") as file:
+                chunks = json.load(file)["chunks"]
+            self._initialize_chunk_arrays(
+                np.array([m["movie_idx"] for m in chunks], dtype=np.int32),
+                np.array([m["chunk_idx"] for m in chunks], dtype=np.int32),
+            )
+        else:
             raise FileNotFoundError(f"{self.CACHE_CHUNK_METADATA} not found")
 
-        with open(self.CACHE_CHUNK_METADATA, "r") as file:
-            data = json.load(file)
-            self.chunk_metadata = data["chunks"]
+        self.chunk_documents = None
+        if os.path.exists(self.CACHE_CHUNK_DOCUMENTS):
+            self.chunk_documents = np.load(self.CACHE_CHUNK_DOCUMENTS)
 
-    def build_chunk_embeddings(self, documents: list[dict]) -> np.ndarray:
-        self._initialize_docs(documents)
+        self.quantized_chunk_embeddings = self._load_or_quantize(
+            self.CACHE_CHUNK_EMBEDDINGS, self.chunk_embeddings
+        )
+        self.ann_index = self._load_or_build_ann()
+
+    def _initialize_chunk_arrays(
+        self, chunk_movie_idx: np.ndarray, chunk_idx: np.ndarray
+    ) -> None:
+        self.chunk_movie_idx = chunk_movie_idx
+        self.chunk_idx = chunk_idx
+        # The per-movie reduction needs the chunks of a movie to be contiguous
+        if np.any(self.chunk_movie_idx[1:] < self.chunk_movie_idx[:-1]):
+            order = np.argsort(self.chunk_movie_idx, kind="stable")
+            self.chunk_embeddings = self.chunk_embeddings[order]
+            self.chunk_movie_idx = self.chunk_movie_idx[order]
+            self.chunk_idx = self.chunk_idx[order]
+        is_group_start = np.ones(len(self.chunk_movie_idx), dtype=bool)
+        is_group_start[1:] = self.chunk_movie_idx[1:] != self.chunk_movie_idx[:-1]
+        self.movie_group_starts = np.flatnonzero(is_group_start)
+        self.deleted_chunk_rows = np.flatnonzero(self.chunk_idx < 0)
+
+    def _chunk_documents(
+        self, documents: Sequence[dict]
+    ) -> tuple[list[str], np.ndarray, np.ndarray]:
         all_chunks = []
-        chunk_metadata = []
-        for movie_idx, doc in enumerate(documents, 1):
+        chunk_movie_idx = []
+        chunk_idx = []
+        for doc in documents:
             if not doc.get("description"):
                 continue
             doc_chunks = semantic_chunk_text(doc.get("description"), 4, 1)
-            for chunk_idx, chunk in enumerate(doc_chunks):
-                chunk_metadata.append(
-                    {
-                        "movie_idx": movie_idx,
-                        "chunk_idx": chunk_idx,
-                        "total_chunks": len(doc_chunks),
-                    }
-                )
+            for i, chunk in enumerate(doc_chunks):
+                chunk_movie_idx.append(doc["id"])
+                chunk_idx.append(i)
                 all_chunks.append(chunk)
-        self.chunk_embeddings = self.model.encode(all_chunks, show_progress_bar=True)
-        self.chunk_metadata = chunk_metadata
-        self._save_chunk(len(all_chunks))
+        return (
+            all_chunks,
+            np.array(chunk_movie_idx, dtype=np.int32),
+            np.array(chunk_idx, dtype=np.int32),
+        )
+
+    def _chunk_references(
+        self, chunk_movie_idx: np.ndarray, chunks: list[str]
+    ) -> np.ndarray:
+        return build_row_metadata(chunk_movie_idx, [content_hash(c) for c in chunks])
+
+    def _hash_chunk_documents(self, documents: Sequence[dict]) -> dict[int, bytes]:
+        return {
+            doc["id"]: content_hash(doc.get("description") or "") for doc in documents
+        }
+
+    def build_chunk_embeddings(self, documents: Iterable[dict]) -> np.ndarray:
+        # documents may be a stream (see iter_movies), chunked and embedded
+        # BUILD_BATCH_SIZE at a time; only the documents themselves are kept
+        self._initialize_docs([])
+        chunk_movie_idx = [np.array([], dtype=np.int32)]
+        chunk_idx = [np.array([], dtype=np.int32)]
+        # Movie id and content hash of every chunk, for the embedding store
+        references = [build_row_metadata([], [])]
+        hashes = {}
+
+        def chunk_batches() -> Iterator[list[str]]:
+            for batch in batched(documents, BUILD_BATCH_SIZE):
+                self._add_docs(batch)
+                chunks, batch_movie_idx, batch_chunk_idx = self._chunk_documents(
+                    batch
+                )
+                chunk_movie_idx.append(batch_movie_idx)
+                chunk_idx.append(batch_chunk_idx)
+                references.append(self._chunk_references(batch_movie_idx, chunks))
+                hashes.update(self._hash_chunk_documents(batch))
+                yield chunks
+
+        self.chunk_embeddings = self._encode_text_batches(chunk_batches())
+        self._initialize_chunk_arrays(
+            np.concatenate(chunk_movie_idx), np.concatenate(chunk_idx)
+        )
+        self.chunk_documents = build_row_metadata(
+            list(hashes), list(hashes.values())
+        )
+        self._save_chunk()
+        self.embedding_store.retain("chunks", np.concatenate(references))
+        self.quantized_chunk_embeddings = self._load_or_quantize(
+            self.CACHE_CHUNK_EMBEDDINGS, self.chunk_embeddings
+        )
+        self.ann_index = self._load_or_build_ann()
         return self.chunk_embeddings
 
-    def load_or_create_chunk_embeddings(self, documents: list[dict]) -> np.ndarray:
+    def load_or_create_chunk_embeddings(self, documents: Iterable[dict]) -> np.ndarray:
         if os.path.exists(self.CACHE_CHUNK_EMBEDDINGS):
+            # Diffed against the cache, a stream is read whole
+            documents = list(documents)
             self._initialize_docs(documents)
             self._load_chunk()
+            if self.chunk_documents is not None:
+                self.update_chunk_embeddings(documents)
             return self.chunk_embeddings
 
         return self.build_chunk_embeddings(documents)
 
+    def update_chunk_embeddings(
+        self, documents: list[dict], compact: bool = False
+    ) -> dict[str, int]:
+        if self.chunk_embeddings is None and os.path.exists(
+            self.CACHE_CHUNK_EMBEDDINGS
+        ):
+            self._load_chunk()
+        if self.chunk_documents is None:
+            # Nothing to diff against: no cache, or one without movie hashes
+            self.build_chunk_embeddings(documents)
+            return {"added": len(documents), "updated": 0, "deleted": 0, "compacted": 0}
+
+        self._initialize_docs(documents)
+        incoming = self._hash_chunk_documents(documents)
+        indexed = {
+            int(doc_id): bytes(doc_hash)
+            for doc_id, doc_hash in zip(
+                self.chunk_documents["id"], self.chunk_documents["hash"]
+            )
+        }
+        added, changed, deleted = diff_documents(indexed, incoming)
+        stats = {
+            "added": len(added),
+            "updated": len(changed),
+            "deleted": len(deleted),
+            "compacted": 0,
+        }
+        if not (added or changed or deleted or compact):
+            return stats
+
+        # The old chunks of changed and deleted movies are tombstoned, only the
+        # new and changed descriptions are chunked and embedded
+        chunk_idx = np.array(self.chunk_idx, dtype=np.int32)
+        chunk_idx[np.isin(self.chunk_movie_idx, changed + deleted)] = -1
+        reembedded = set(changed + added)
+        new_chunks, new_movie_idx, new_chunk_idx = self._chunk_documents(
+            [doc for doc in documents if doc["id"] in reembedded]
+        )
+        embeddings = np.concatenate(
+            (
+                np.asarray(self.chunk_embeddings, dtype=np.float32),
+                self._encode_texts(new_chunks),
+            )
+        )
+        chunk_movie_idx = np.concatenate((self.chunk_movie_idx, new_movie_idx))
+        chunk_idx = np.concatenate((chunk_idx, new_chunk_idx))
+
+        live = chunk_idx >= 0
+        if compact or np.count_nonzero(~live) > COMPACTION_THRESHOLD * len(live):
+            stats["compacted"] = int(np.sum(~live))
+            embeddings = embeddings[live]
+            chunk_movie_idx, chunk_idx = chunk_movie_idx[live], chunk_idx[live]
+
+        # Appended chunks are sorted into their movie's group before saving, so
+        # loading never has to reorder the cache
+        order = np.argsort(chunk_movie_idx, kind="stable")
+        self.chunk_embeddings = embeddings[order]
+        self._initialize_chunk_arrays(chunk_movie_idx[order], chunk_idx[order])
+        self.chunk_documents = build_row_metadata(
+            list(incoming), list(incoming.values())
+        )
+        self._save_chunk()
+        # The chunks of changed and deleted movies are no longer held
+        self.embedding_store.retain(
+            "chunks",
+            self._chunk_references(new_movie_idx, new_chunks),
+            released_ids=changed + deleted,
+            compact=compact,
+        )
+        self.quantized_chunk_embeddings = self._load_or_quantize(
+            self.CACHE_CHUNK_EMBEDDINGS, self.chunk_embeddings
+        )
+        self.ann_index = self._load_or_build_ann()
+        return stats
+
     def search_chunks(self, query: str, limit: int = 10) -> list[dict]:
         query_embedding = super().generate_embedding(query)
-        all_chunk_scores = self._compare_query_with_chunks(query_embedding)
-        all_movies_scores = self._find_best_chunk_for_each_movie(all_chunk_scores)
-        result = list(all_movies_scores.values())
-        result.sort(key=lambda r: r["score"], reverse=True)
-        return result[:limit]
-
-    def _find_best_chunk_for_each_movie(self, all_chunk_scores) -> list[dict]:
-        all_movies_scores = {}
-        for chunk_score in all_chunk_scores:
-            movie_idx = chunk_score["movie_idx"]
-            score = chunk_score["score"]
+        return self.search_chunks_by_embedding(query_embedding, limit)
+
+    def search_chunks_many(
+        self, queries: list[str], limit: int = 10
+    ) -> list[list[dict]]:
+        query_embeddings = self.generate_embeddings(queries)
+        return self.search_chunks_by_embeddings(query_embeddings, limit)
+
+    def search_chunks_by_embedding(
+        self, query_embedding: np.ndarray, limit: int = 10
+    ) -> list[dict]:
+        if self.chunk_embeddings is None or len(self.chunk_embeddings) == 0:
+            return []
+        query_embedding = l2_normalize(query_embedding)
+        if self.ann_index is not None:
+            with span("chunks.ann_score"):
+                movie_scores, best_chunks = self._score_ann_candidates(
+                    query_embedding, limit
+                )
+            if movie_scores is not None:
+                with span("chunks.rank"):
+                    return self._movie_results(movie_scores, best_chunks, limit)
+        with span("chunks.score"):
+            chunk_scores = self._compare_query_with_chunks(query_embedding)
+        count("chunks.scored", len(chunk_scores))
+        with span("chunks.rank"):
+            return self._search_chunk_scores(query_embedding, chunk_scores, limit)
+
+    def search_chunks_by_embeddings(
+        self, query_embeddings: np.ndarray, limit: int = 10
+    ) -> list[list[dict]]:
+        if self.chunk_embeddings is None or len(self.chunk_embeddings) == 0:
+            return [[] for _ in query_embeddings]
+        query_embeddings = l2_normalize(query_embeddings)
+        if self.ann_index is not None:
+            # Every query probes its own lists, there is no product to share
+            return [
+                self.search_chunks_by_embedding(query_embedding, limit)
+                for query_embedding in query_embeddings
+            ]
+        results = []
+        for start in range(0, len(query_embeddings), QUERY_BLOCK_ROWS):
+            block = query_embeddings[start : start + QUERY_BLOCK_ROWS]
+            block_scores = self._compare_query_with_chunks(block)
+            for query_embedding, chunk_scores in zip(block, block_scores):
+                results.append(
+                    self._search_chunk_scores(query_embedding, chunk_scores, limit)
+                )
+        return results
+
+    def _search_chunk_scores(
+        self, query_embedding: np.ndarray, chunk_scores: np.ndarray, limit: int
+    ) -> list[dict]:
+        movie_scores, best_chunks = self._find_best_chunk_for_each_movie(chunk_scores)
+        if self.quantized_chunk_embeddings is not None:
+            movie_scores, best_chunks = self._rescore_movies(
+                query_embedding, movie_scores, limit
+            )
+        return self._movie_results(movie_scores, best_chunks, limit)
+
+    def _movie_results(
+        self, movie_scores: np.ndarray, best_chunks: np.ndarray, limit: int
+    ) -> list[dict]:
+        result = []
+        for group in top_k_indices(movie_scores, limit):
+            if movie_scores[group] == -np.inf:
+                # Every chunk of the movie is a tombstone
+                break
+            best_chunk = best_chunks[group]
+            movie_idx = int(self.chunk_movie_idx[best_chunk])
             movie = self.document_map[movie_idx]
-            if (
-                movie_idx not in all_movies_scores
-                or score > all_movies_scores[movie_idx]["score"]
-            ):
-                all_movies_scores[movie_idx] = {
-                    "id": chunk_score["movie_idx"],
+            result.append(
+                {
+                    "id": movie_idx,
                     "title": movie["title"],
                     "document": movie["description"][:100],
-                    "score": round(chunk_score["score"], SCORE_PRECISION),
+                    "score": round(float(movie_scores[group]), SCORE_PRECISION),
                     "metadata": {
                         "movie_idx": movie_idx,
-                        "chunk_idx": chunk_score["chunk_idx"],
+                        "chunk_idx": int(self.chunk_idx[best_chunk]),
                     },
                 }
-        return all_movies_scores
-
-    def _compare_query_with_chunks(self, query_embedding) -> list[dict]:
-        all_chunk_scores = []
-        for i, chunk_embedding in enumerate(self.chunk_embeddings):
-            similarity_score = cosine_similarity(query_embedding, chunk_embedding)
-            metadata = self.chunk_metadata[i]
-            all_chunk_scores.append(
-                {
-                    "chunk_idx": metadata["chunk_idx"],
-                    "movie_idx": metadata["movie_idx"],
-                    "score": similarity_score,
-                }
             )
+        return result
+
+    def _find_best_chunk_for_each_movie(
+        self, chunk_scores: np.ndarray, rows: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # rows: sorted chunk rows chunk_scores belongs to, None for every chunk
+        if rows is None:
+            starts = self.movie_group_starts
+        else:
+            movie_idx = self.chunk_movie_idx[rows]
+            is_group_start = np.ones(len(rows), dtype=bool)
+            is_group_start[1:] = movie_idx[1:] != movie_idx[:-1]
+            starts = np.flatnonzero(is_group_start)
+        if len(chunk_scores) == 0:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.intp)
+        movie_scores = np.maximum.reduceat(chunk_scores, starts)
+        # Row of the first chunk reaching the movie's max score
+        group_sizes = np.diff(np.append(starts, len(chunk_scores)))
+        is_best = chunk_scores == np.repeat(movie_scores, group_sizes)
+        positions = np.where(
+            is_best, np.arange(len(chunk_scores)), len(chunk_scores)
+        )
+        best_chunks = np.minimum.reduceat(positions, starts)
+        if rows is not None:
+            best_chunks = rows[best_chunks]
+        return movie_scores, best_chunks
+
+    def _rescore_movies(
+        self, query_embedding: np.ndarray, movie_scores: np.ndarray, limit: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # Every chunk of the shortlisted movies is re-scored against the float32
+        # embeddings, the other movies drop out of the ranking
+        starts = self.movie_group_starts
+        ends = np.append(starts[1:], len(self.chunk_embeddings))
+        groups = np.sort(top_k_indices(movie_scores, limit * self.rescore_factor))
+        rows = np.concatenate(
+            [np.arange(starts[g], ends[g]) for g in groups] or [np.empty(0, np.intp)]
+        )
+        rows = rows[self.chunk_idx[rows] >= 0]
+        chunk_scores = self.chunk_embeddings[rows] @ query_embedding
+        return self._find_best_chunk_for_each_movie(chunk_scores, rows)
+
+    def _score_ann_candidates(
+        self, query_embedding: np.ndarray, limit: int
+    ) -> tuple[np.ndarray | None, np.ndarray | None]:
+        # Only the chunks of the probed lists are scored, exactly. When they
+        # cover fewer than limit movies the exhaustive scan is used instead.
+        rows = self.ann_index.candidate_rows(query_embedding)
+        rows = rows[self.chunk_idx[rows] >= 0]
+        chunk_scores = self.chunk_embeddings[rows] @ query_embedding
+        movie_scores, best_chunks = self._find_best_chunk_for_each_movie(
+            chunk_scores, rows
+        )
+        if len(movie_scores) < min(limit, len(self.movie_group_starts)):
+            return None, None
+        return movie_scores, best_chunks
+
+    def _compare_query_with_chunks(self, query_embedding: np.ndarray) -> np.ndarray:
+        # One query, or a (n_queries, dim) block scored as (n_queries, chunks)
+        if self.quantized_chunk_embeddings is not None:
+            scores = self.quantized_chunk_embeddings.scores(query_embedding).T
+        elif query_embedding.ndim == 1:
+            # Both sides are unit length, so this is the cosine similarity
+            scores = self.chunk_embeddings @ query_embedding
+        else:
+            scores = query_embedding @ self.chunk_embeddings.T
+        scores[..., self.deleted_chunk_rows] = -np.inf
+        return scores
 
-        return all_chunk_scores
+    def _load_or_build_ann(self) -> IVFIndex | None:
+        if not self.ann or len(self.chunk_embeddings) == 0:
+            return None
+        if self.ann not in ANN_BACKENDS:
+            raise ValueError(f"unknown ANN backend '{self.ann}'")
+        ann_index = ANN_BACKENDS[self.ann](self.ann_probes)
+        ann_index.load_or_build(self.CACHE_CHUNK_EMBEDDINGS, self.chunk_embeddings)
+        return ann_index
 
 
 def chunk_text(text: str, chunk_size: int, overlap: int) -> list[str]:
@@ -151,17 +486,121 @@ def join_blocks_in_chunks(
 
 
 def embed_command() -> None:
-    movies = load_movies()
     chunked_search_instance = ChunkedSemanticSearch()
-    embeddings = chunked_search_instance.load_or_create_chunk_embeddings(movies)
+    # Streamed: without a cache to diff against, the chunks are embedded as
+    # the catalog is read
+    embeddings = chunked_search_instance.load_or_create_chunk_embeddings(
+        iter_movies()
+    )
     print(f"Generated {len(embeddings)} chunked embeddings")
 
 
-def search_chunked_command(query: str, limit: int) -> None:
+def update_command(compact: bool = False) -> dict[str, dict[str, int]]:
     movies = load_movies()
-    chunked_search_instance = ChunkedSemanticSearch()
+    search_instance = ChunkedSemanticSearch()
+    return {
+        "movie embeddings": search_instance.update_embeddings(movies, compact),
+        "chunk embeddings": search_instance.update_chunk_embeddings(movies, compact),
+    }
+
+
+def search_chunked_command(
+    query: str,
+    limit: int,
+    quantization: str | None = None,
+    ann: str | None = None,
+    ann_probes: int = DEFAULT_PROBES,
+) -> None:
+    movies = load_movies()
+    chunked_search_instance = ChunkedSemanticSearch(
+        quantization=quantization, ann=ann, ann_probes=ann_probes
+    )
     chunked_search_instance.load_or_create_chunk_embeddings(movies)
     hits = chunked_search_instance.search_chunks(query, limit)
     for i, hit in enumerate(hits, 1):
         print(f"\n{i}. {hit['title']} (score: {hit['score']:.4f})")
         print(f"   {hit['document']}...")
+
+
+def quantization_benchmark_command(limit: int) -> None:
+    movies = load_movies()
+    dataset = load_golden_dataset()
+    search_instance = ChunkedSemanticSearch()
+    search_instance.load_or_create_chunk_embeddings(movies)
+    query_embeddings = search_instance.model.encode(
+        [testcase["query"] for testcase in dataset]
+    )
+
+    baseline = None
+    float32_bytes = search_instance.chunk_embeddings.nbytes
+    print(f"Benchmarking {len(dataset)} golden dataset queries, k={limit}\n")
+    for mode in [None] + QUANTIZATION_MODES:
+        search_instance.quantization = mode
+        search_instance.load_or_create_chunk_embeddings(movies)
+        start = time.perf_counter()
+        results = [
+            search_instance.search_chunks_by_embedding(query_embedding, limit)
+            for query_embedding in query_embeddings
+        ]
+        latency_ms = (time.perf_counter() - start) * 1000 / max(len(dataset), 1)
+        retrieved = [[hit["title"] for hit in hits] for hits in results]
+        if baseline is None:
+            baseline = retrieved
+        overlap = [
+            len(set(titles) & set(expected)) / max(len(expected), 1)
+            for titles, expected in zip(retrieved, baseline)
+        ]
+        golden_recall = [
+            len(set(titles) & set(testcase["relevant_docs"]))
+            / len(testcase["relevant_docs"])
+            for titles, testcase in zip(retrieved, dataset)
+        ]
+        if mode is None:
+            matrix_bytes = float32_bytes
+        else:
+            matrix_bytes = search_instance.quantized_chunk_embeddings.nbytes()
+        print(f"- {mode or 'float32'}:")
+        print(
+            f"  - Matrix size: {matrix_bytes / 2**20:.2f} MiB "
+            f"({matrix_bytes / float32_bytes:.0%} of float32)"
+        )
+        print(f"  - Recall@{limit} vs float32: {np.mean(overlap):.4f}")
+        print(f"  - Golden Recall@{limit}: {np.mean(golden_recall):.4f}")
+        print(f"  - Latency: {latency_ms:.2f} ms/query")
+
+
+def ann_benchmark_command(limit: int, probes: list[int]) -> None:
+    movies = load_movies()
+    queries = [testcase["query"] for testcase in load_golden_dataset()]
+    search_instance = ChunkedSemanticSearch()
+    search_instance.load_or_create_chunk_embeddings(movies)
+    query_embeddings = search_instance.model.encode(queries)
+
+    print(f"Benchmarking {len(queries)} golden dataset queries, k={limit}\n")
+    baseline = None
+    for n_probe in [None] + probes:
+        search_instance.ann = None if n_probe is None else "ivf"
+        search_instance.ann_probes = n_probe or DEFAULT_PROBES
+        search_instance.load_or_create_chunk_embeddings(movies)
+        start = time.perf_counter()
+        results = [
+            search_instance.search_chunks_by_embedding(query_embedding, limit)
+            for query_embedding in query_embeddings
+        ]
+        latency_ms = (time.perf_counter() - start) * 1000 / max(len(queries), 1)
+        retrieved = [{hit["id"] for hit in hits} for hits in results]
+        if baseline is None:
+            baseline = retrieved
+        recall = [
+            len(ids & expected) / max(len(expected), 1)
+            for ids, expected in zip(retrieved, baseline)
+        ]
+        if n_probe is None:
+            print(f"- exhaustive: {latency_ms:.2f} ms/query")
+            continue
+        total_lists = len(search_instance.ann_index.centroids)
+        print(
+            f"- ivf n_probe={n_probe}/{total_lists}: "
+            f"Recall@{limit} vs exhaustive {np.mean(recall):.4f}, "
+            f"{latency_ms:.2f} ms/query"
+        )
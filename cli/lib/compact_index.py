@@ -0,0 +1,398 @@
+import json
+import math
+import os
+from collections.abc import Iterator, Mapping
+
+import numpy as np
+
+from .inverted_index import InvertedIndex, BM25_K1, BM25_B
+from .search_utils import atomic_write, cache_path, top_k_indices
+from .text_processing import preprocess_text
+from .tracing import count, span
+
+COMPACT_INDEX_VERSION = 1
+
+
+class CompactDocMap(Mapping):
+    # Read-only doc_id -> movie mapping over the serialized documents blob.
+    # Documents are only decoded when accessed, iteration follows index order.
+    def __init__(self, index: "CompactIndex") -> None:
+        self._index = index
+
+    def __getitem__(self, doc_id: int) -> dict:
+        return self._index.get_document(self._index.get_doc_position(doc_id))
+
+    def __contains__(self, doc_id: object) -> bool:
+        try:
+            self._index.get_doc_position(doc_id)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self) -> Iterator[int]:
+        return (int(doc_id) for doc_id in self._index.doc_ids)
+
+    def __len__(self) -> int:
+        return len(self._index.doc_ids)
+
+
+class CompactIndex:
+    # Columnar BM25 index. Documents are addressed by their position in the
+    # index (the docmap order of the InvertedIndex it was built from), and the
+    # postings of every term are a contiguous, position-sorted slice of the
+    # posting arrays, delimited by term_offsets.
+    def __init__(self) -> None:
+        self.terms = np.array([], dtype=np.str_)
+        self.term_offsets = np.zeros(1, dtype=np.int64)
+        self.posting_docs = np.array([], dtype=np.int32)
+        self.posting_tfs = np.array([], dtype=np.int32)
+        self.bm25_idf = np.array([], dtype=np.float64)
+        self.doc_ids = np.array([], dtype=np.int32)
+        self.doc_lengths = np.array([], dtype=np.int32)
+        self.sorted_doc_ids = np.array([], dtype=np.int32)
+        self.sorted_doc_positions = np.array([], dtype=np.int32)
+        self.documents = np.array([], dtype=np.uint8)
+        self.document_offsets = np.zeros(1, dtype=np.int64)
+        self.avg_doc_length = 0.0
+        self.docmap = CompactDocMap(self)
+        self.CACHE_DIR = cache_path("compact_index")
+        self.CACHE_META_PATH = os.path.join(self.CACHE_DIR, "meta.json")
+        self._loaded_generation = None
+
+    def _array_path(self, name: str) -> str:
+        return os.path.join(self.CACHE_DIR, f"{name}.npy")
+
+    def _array_names(self) -> list[str]:
+        return [
+            "terms",
+            "term_offsets",
+            "posting_docs",
+            "posting_tfs",
+            "bm25_idf",
+            "doc_ids",
+            "doc_lengths",
+            "sorted_doc_ids",
+            "sorted_doc_positions",
+            "documents",
+            "document_offsets",
+        ]
+
+    def build(self, inverted_index: InvertedIndex) -> None:
+        doc_ids = list(inverted_index.docmap)
+        doc_positions = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+        terms = sorted(inverted_index.index)
+
+        term_offsets = [0]
+        posting_docs = []
+        posting_tfs = []
+        for term in terms:
+            positions = sorted(
+                doc_positions[doc_id] for doc_id in inverted_index.index[term]
+            )
+            posting_docs.extend(positions)
+            posting_tfs.extend(
+                inverted_index.term_frequency[doc_ids[position]][term]
+                for position in positions
+            )
+            term_offsets.append(len(posting_docs))
+
+        documents = [
+            json.dumps(inverted_index.docmap[doc_id]).encode("utf-8")
+            for doc_id in doc_ids
+        ]
+
+        self.terms = np.array(terms, dtype=np.str_)
+        self.term_offsets = np.array(term_offsets, dtype=np.int64)
+        self.posting_docs = np.array(posting_docs, dtype=np.int32)
+        self.posting_tfs = np.array(posting_tfs, dtype=np.int32)
+        self.doc_ids = np.array(doc_ids, dtype=np.int32)
+        self.doc_lengths = np.array(
+            [inverted_index.doc_lengths[doc_id] for doc_id in doc_ids], dtype=np.int32
+        )
+        self.sorted_doc_positions = np.argsort(self.doc_ids, kind="stable").astype(
+            np.int32
+        )
+        self.sorted_doc_ids = self.doc_ids[self.sorted_doc_positions]
+        self.documents = np.frombuffer(b"".join(documents), dtype=np.uint8)
+        self.document_offsets = np.zeros(len(documents) + 1, dtype=np.int64)
+        self.document_offsets[1:] = np.cumsum([len(doc) for doc in documents])
+        if len(doc_ids) > 0:
+            self.avg_doc_length = sum(inverted_index.doc_lengths.values()) / len(
+                inverted_index.doc_lengths
+            )
+        else:
+            self.avg_doc_length = 0.0
+        # Same formula as InvertedIndex.get_bm25_idf, computed once per term
+        total_doc_count = len(doc_ids)
+        self.bm25_idf = np.array(
+            [
+                math.log(
+                    (total_doc_count - doc_count + 0.5) / (doc_count + 0.5) + 1
+                )
+                for doc_count in np.diff(self.term_offsets).tolist()
+            ],
+            dtype=np.float64,
+        )
+
+    def exists(self) -> bool:
+        return os.path.exists(self.CACHE_META_PATH)
+
+    def matches(self, documents: list[dict]) -> bool:
+        # Whether the index holds exactly these documents, in this order
+        if len(documents) != len(self.doc_ids):
+            return False
+        if any(doc["id"] != doc_id for doc, doc_id in zip(documents, self.doc_ids)):
+            return False
+        serialized = b"".join(json.dumps(doc).encode("utf-8") for doc in documents)
+        return serialized == self.documents.tobytes()
+
+    def save(self) -> None:
+        for name in self._array_names():
+            with atomic_write(self._array_path(name)) as file:
+                np.save(file, getattr(self, name))
+
+        # Written last: a complete meta file marks a complete index
+        with atomic_write(self.CACHE_META_PATH, "w") as file:
+            json.dump(
+                {
+                    "version": COMPACT_INDEX_VERSION,
+                    "avg_doc_length": self.avg_doc_length,
+                    "total_docs": len(self.doc_ids),
+                    "total_terms": len(self.terms),
+                },
+                file,
+            )
+
+        self._loaded_generation = self.get_cache_generation()
+
+    def load(self) -> None:
+        if not os.path.exists(self.CACHE_META_PATH):
+            raise FileNotFoundError(f"{self.CACHE_META_PATH} not found")
+
+        generation = self.get_cache_generation()
+
+        with open(self.CACHE_META_PATH, "r") as file:
+            meta = json.load(file)
+        if meta["version"] != COMPACT_INDEX_VERSION:
+            raise ValueError(
+                f"unsupported compact index version {meta['version']}, rebuild the index"
+            )
+
+        # Memory mapped: pages are read on demand and shared between processes
+        for name in self._array_names():
+            path = self._array_path(name)
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"{path} not found")
+            setattr(self, name, np.load(path, mmap_mode="r"))
+        self.avg_doc_length = meta["avg_doc_length"]
+
+        self._loaded_generation = generation
+
+    def get_cache_generation(self) -> tuple | None:
+        # Identified by the meta file alone: save writes it last (and always
+        # as a new file), so array files changing before it are an index
+        # still being written, not one to reload
+        for path in [self.CACHE_META_PATH] + [
+            self._array_path(name) for name in self._array_names()
+        ]:
+            if not os.path.exists(path):
+                return None
+        stat = os.stat(self.CACHE_META_PATH)
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def has_changed(self) -> bool:
+        # Whether a complete cache other than the loaded one is on disk
+        generation = self.get_cache_generation()
+        return generation is not None and generation != self._loaded_generation
+
+    def reload_if_changed(self) -> bool:
+        # Replaces the arrays one by one: not for an instance other threads
+        # are searching, see HybridSearch._current_index
+        if not self.has_changed():
+            return False
+        self.load()
+        return True
+
+    def get_document(self, position: int) -> dict:
+        start, end = self.document_offsets[position], self.document_offsets[position + 1]
+        return json.loads(self.documents[start:end].tobytes())
+
+    def get_doc_position(self, doc_id: int) -> int:
+        i = np.searchsorted(self.sorted_doc_ids, doc_id)
+        if i >= len(self.sorted_doc_ids) or self.sorted_doc_ids[i] != doc_id:
+            raise KeyError(doc_id)
+        return int(self.sorted_doc_positions[i])
+
+    def _get_term_id(self, token: str) -> int | None:
+        i = np.searchsorted(self.terms, token)
+        if i >= len(self.terms) or self.terms[i] != token:
+            return None
+        return int(i)
+
+    def _get_postings(self, token: str) -> tuple[np.ndarray, np.ndarray]:
+        term_id = self._get_term_id(token)
+        if term_id is None:
+            return self.posting_docs[:0], self.posting_tfs[:0]
+        start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+        return self.posting_docs[start:end], self.posting_tfs[start:end]
+
+    def get_documents(self, term: str) -> list[int]:
+        docs, _ = self._get_postings(term.lower())
+        return sorted(self.doc_ids[docs].tolist())
+
+    def get_tf(self, doc_id: int, term: str) -> int:
+        token = preprocess_text(term)
+        if len(token) != 1:
+            raise ValueError("term must be a single token")
+        return self._get_token_tf(self.get_doc_position(doc_id), token[0])
+
+    def _get_token_tf(self, position: int, token: str) -> int:
+        docs, tfs = self._get_postings(token)
+        i = np.searchsorted(docs, position)
+        if i >= len(docs) or docs[i] != position:
+            return 0
+        return int(tfs[i])
+
+    def get_idf(self, term: str) -> float:
+        token = preprocess_text(term)
+        if len(token) != 1:
+            raise ValueError("term must be a single token")
+        total_doc_count = len(self.doc_ids)
+        term_match_doc_count = len(self._get_postings(token[0])[0])
+        return math.log((total_doc_count + 1) / (term_match_doc_count + 1))
+
+    def get_tfidf(self, doc_id: int, term: str) -> float:
+        token = preprocess_text(term)
+        if len(token) != 1:
+            raise ValueError("term must be a single token")
+        tf = self.get_tf(doc_id, term)
+        idf = self.get_idf(term)
+        return tf * idf
+
+    def get_bm25_idf(self, term: str) -> float:
+        token = preprocess_text(term)
+        if len(token) != 1:
+            raise ValueError("term must be a single token")
+        term_id = self._get_term_id(token[0])
+        if term_id is None:
+            total_doc_count = len(self.doc_ids)
+            return math.log((total_doc_count + 0.5) / 0.5 + 1)
+        return float(self.bm25_idf[term_id])
+
+    def get_bm25_tf(
+        self, doc_id: int, term: str, k1: float = BM25_K1, b: float = BM25_B
+    ) -> float:
+        token = preprocess_text(term)
+        if len(token) != 1:
+            raise ValueError("term must be a single token")
+        position = self.get_doc_position(doc_id)
+        raw_tf = self._get_token_tf(position, token[0])
+        if self.avg_doc_length > 0:
+            length_normalization = (
+                1 - b + b * (int(self.doc_lengths[position]) / self.avg_doc_length)
+            )
+        else:
+            length_normalization = 1
+        return (raw_tf * (k1 + 1)) / (raw_tf + k1 * length_normalization)
+
+    def bm25(self, doc_id: int, term: str) -> float:
+        return self.get_bm25_idf(term) * self.get_bm25_tf(doc_id, term)
+
+    def bm25_search(
+        self,
+        query: str,
+        limit: int,
+        debug: bool = False,
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+    ) -> list[(dict, float)]:
+        with span("bm25.tokenize"):
+            tokenized_query = preprocess_text(query)
+        if debug:
+            print(tokenized_query)
+        if not tokenized_query:
+            return []
+        with span("bm25.score"):
+            scores = self._score_postings(tokenized_query, k1, b)
+        # Positions follow docmap order, so ties (including documents without
+        # any match, scored 0.0) rank exactly like InvertedIndex.bm25_search
+        with span("bm25.rank"):
+            return [
+                (self.get_document(position), float(scores[position]))
+                for position in top_k_indices(scores, limit)
+            ]
+
+    def bm25_search_many(
+        self,
+        queries: list[str],
+        limit: int,
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+    ) -> list[list[(dict, float)]]:
+        tokenized_queries = [preprocess_text(query) for query in queries]
+        # The postings of a token are scored once for the whole batch, every
+        # query then only adds up the contributions of its tokens
+        contributions = {}
+        for token in set().union(*tokenized_queries):
+            term_id = self._get_term_id(token)
+            if term_id is not None:
+                contributions[token] = self._term_contributions(term_id, k1, b)
+        # Documents ranked by several queries are only decoded once
+        documents = {}
+        results = []
+        for tokens in tokenized_queries:
+            if not tokens:
+                results.append([])
+                continue
+            scores = np.zeros(len(self.doc_ids), dtype=np.float64)
+            for token in tokens:
+                if token in contributions:
+                    docs, contribution = contributions[token]
+                    scores[docs] += contribution
+            ranked = []
+            for position in top_k_indices(scores, limit).tolist():
+                if position not in documents:
+                    documents[position] = self.get_document(position)
+                ranked.append((documents[position], float(scores[position])))
+            results.append(ranked)
+        return results
+
+    def _score_postings(
+        self, tokens: list[str], k1: float = BM25_K1, b: float = BM25_B
+    ) -> np.ndarray:
+        scores = np.zeros(len(self.doc_ids), dtype=np.float64)
+        for token in tokens:
+            term_id = self._get_term_id(token)
+            if term_id is None:
+                continue
+            docs, contribution = self._term_contributions(term_id, k1, b)
+            scores[docs] += contribution
+            count("bm25.postings_scored", len(docs))
+        return scores
+
+    def _term_contributions(
+        self, term_id: int, k1: float = BM25_K1, b: float = BM25_B
+    ) -> tuple[np.ndarray, np.ndarray]:
+        start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+        docs = self.posting_docs[start:end]
+        raw_tf = self.posting_tfs[start:end].astype(np.float64)
+        if self.avg_doc_length > 0:
+            length_normalization = (
+                1 - b + b * (self.doc_lengths[docs] / self.avg_doc_length)
+            )
+        else:
+            length_normalization = 1
+        saturated_tf = (raw_tf * (k1 + 1)) / (raw_tf + k1 * length_normalization)
+        return docs, self.bm25_idf[term_id] * saturated_tf
+
+
+def load_compact_index() -> CompactIndex:
+    compact_index = CompactIndex()
+    if not compact_index.exists():
+        # Migrate an index cached in the legacy pickle format
+        inverted_index = InvertedIndex()
+        inverted_index.load()
+        compact_index.build(inverted_index)
+        compact_index.save()
+    compact_index.load()
+    return compact_index
@@ -0,0 +1,106 @@
+import threading
+from collections import OrderedDict
+
+from .search_utils import content_hash
+from .tracing import count, span
+
+CROSS_ENCODER_MODEL = "cross-encoder/ms-marco-TinyBERT-L2-v2"
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_MAX_LENGTH = 512
+SCORE_CACHE_SIZE = 4096
+
+
+def pair_text(movie: dict) -> str:
+    return f"{movie.get('title', '')} - {movie.get('description', '')}"
+
+
+class CrossEncoderReranker:
+    # Loads the cross-encoder once, reranking then only runs inference on the
+    # (query, movie) pairs not scored before. Scores are kept in a bounded
+    # LRU keyed by query and movie id, an entry only counts while the movie
+    # text it was computed from is unchanged.
+    def __init__(
+        self,
+        model_name: str = CROSS_ENCODER_MODEL,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_length: int = DEFAULT_MAX_LENGTH,
+        cache_size: int = SCORE_CACHE_SIZE,
+    ) -> None:
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_name, max_length=max_length)
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._scores = OrderedDict()
+        # Shared by the request threads of the search server
+        self._lock = threading.Lock()
+
+    def _key(self, query: str, movie: dict) -> tuple[str, int]:
+        return " ".join(query.split()), movie["id"]
+
+    def score(self, query: str, movies: list[dict]) -> list[float]:
+        texts = [pair_text(movie) for movie in movies]
+        hashes = [content_hash(text) for text in texts]
+        scores = [None] * len(movies)
+        with self._lock:
+            for i, movie in enumerate(movies):
+                entry = self._scores.get(self._key(query, movie))
+                if entry is not None and entry[0] == hashes[i]:
+                    self._scores.move_to_end(self._key(query, movie))
+                    scores[i] = entry[1]
+            missing = [i for i, score in enumerate(scores) if score is None]
+            self.hits += len(movies) - len(missing)
+            self.misses += len(missing)
+        count("cross_encoder.cache_hits", len(movies) - len(missing))
+        count("cross_encoder.pairs_scored", len(missing))
+        if not missing:
+            return scores
+
+        with span("cross_encoder.predict"):
+            predicted = self.model.predict(
+                [(query, texts[i]) for i in missing], batch_size=self.batch_size
+            )
+        with self._lock:
+            for i, score in zip(missing, predicted):
+                scores[i] = float(score)
+                key = self._key(query, movies[i])
+                self._scores[key] = (hashes[i], scores[i])
+                self._scores.move_to_end(key)
+            while len(self._scores) > self.cache_size:
+                self._scores.popitem(last=False)
+        return scores
+
+    def rerank(self, query: str, results: list[tuple[int, dict]]) -> list:
+        # results are (doc_id, hit) pairs, returned best first with the score
+        # added to every hit. Ties keep the incoming order.
+        scores = self.score(query, [hit["document"] for _, hit in results])
+        reranked = [
+            (doc_id, hit | {"cross_encoder_score": score})
+            for (doc_id, hit), score in zip(results, scores)
+        ]
+        order = sorted(
+            range(len(reranked)), key=lambda i: scores[i], reverse=True
+        )
+        return [reranked[i] for i in order]
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._scores),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+_default_reranker = None
+_default_reranker_lock = threading.Lock()
+
+
+def get_cross_encoder_reranker() -> CrossEncoderReranker:
+    global _default_reranker
+    with _default_reranker_lock:
+        if _default_reranker is None:
+            _default_reranker = CrossEncoderReranker()
+        return _default_reranker
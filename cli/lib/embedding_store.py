@@ -0,0 +1,309 @@
+import atexit
+import json
+import os
+import pickle
+import re
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Iterable
+
+import numpy as np
+
+from .search_utils import ROW_METADATA_DTYPE, atomic_write, cache_path, content_hash
+
+HASH_DTYPE = ROW_METADATA_DTYPE["hash"]
+QUERY_CACHE_SIZE = 1024
+# compact rewrites the store once more than this fraction of its entries is
+# held by no cache
+UNREFERENCED_THRESHOLD = 0.2
+
+
+def _cache_file_name(model_name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+
+
+class EmbeddingStore:
+    # Persistent content_hash(text) -> embedding map of one model, shared by
+    # the movie and chunk embedding caches so a rebuild only encodes texts it
+    # has never seen. New entries are appended to the store file, and their
+    # keys are kept sorted in memory, so a whole batch of texts is looked up
+    # with a single searchsorted. Each cache declares the texts it holds with
+    # retain; entries no cache holds any more are dropped by compact.
+    def __init__(self, model_name: str) -> None:
+        self.model_name = model_name
+        # Keys and vectors in file order, and the order sorting the keys
+        self.keys = np.array([], dtype=HASH_DTYPE)
+        self.vectors = None
+        self._order = np.array([], dtype=np.intp)
+        self._sorted_keys = self.keys
+        self._loaded = False
+        self.hits = 0
+        self.misses = 0
+        file_name = _cache_file_name(model_name)
+        self.CACHE_DIR = cache_path("embedding_store")
+        # Records of a key and its float32 vector, see _record_dtype
+        self.CACHE_PATH = os.path.join(self.CACHE_DIR, f"{file_name}.bin")
+        self.CACHE_META_PATH = os.path.join(self.CACHE_DIR, f"{file_name}.json")
+        # One file of (id, hash) rows per cache, see retain
+        self.CACHE_REFERENCES_DIR = os.path.join(self.CACHE_DIR, f"{file_name}.refs")
+
+    def _record_dtype(self, dimensions: int) -> np.dtype:
+        return np.dtype([("key", HASH_DTYPE), ("vector", np.float32, (dimensions,))])
+
+    def _dimensions(self) -> int | None:
+        if not os.path.exists(self.CACHE_META_PATH):
+            return None
+        with open(self.CACHE_META_PATH, "r") as file:
+            return json.load(file)["dimensions"]
+
+    def load(self) -> None:
+        self._loaded = True
+        self.keys = np.array([], dtype=HASH_DTYPE)
+        self.vectors = None
+        dimensions = self._dimensions()
+        if dimensions is not None and os.path.exists(self.CACHE_PATH):
+            dtype = self._record_dtype(dimensions)
+            # A record cut short by an interrupted append is ignored
+            rows = os.path.getsize(self.CACHE_PATH) // dtype.itemsize
+            if rows:
+                records = np.memmap(self.CACHE_PATH, dtype, "r", shape=(rows,))
+                self.keys = np.array(records["key"])
+                self.vectors = records["vector"]
+        self._order = np.argsort(self.keys, kind="stable")
+        self._sorted_keys = self.keys[self._order]
+
+    def lookup(self, hashes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # Row in self.vectors of every hash, and whether it is stored at all
+        if not self._loaded:
+            self.load()
+        if len(self.keys) == 0:
+            return np.zeros(len(hashes), dtype=np.intp), np.zeros(len(hashes), bool)
+        positions = np.minimum(
+            np.searchsorted(self._sorted_keys, hashes), len(self.keys) - 1
+        )
+        return self._order[positions], self._sorted_keys[positions] == hashes
+
+    def add(self, hashes: np.ndarray, vectors: np.ndarray) -> None:
+        # Appends the entries not stored yet, the existing ones are not rewritten
+        _, found = self.lookup(hashes)
+        hashes, first = np.unique(hashes[~found], return_index=True)
+        if len(hashes) == 0:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)[~found][first]
+        dimensions = self._dimensions()
+        if dimensions is None:
+            dimensions = vectors.shape[1]
+            with atomic_write(self.CACHE_META_PATH, "w") as file:
+                json.dump({"dimensions": dimensions}, file)
+        elif dimensions != vectors.shape[1]:
+            raise ValueError(
+                f"{self.model_name} store holds {dimensions}-dimensional embeddings,"
+                f" not {vectors.shape[1]}"
+            )
+        records = np.empty(len(hashes), dtype=self._record_dtype(dimensions))
+        records["key"] = hashes
+        records["vector"] = vectors
+        with open(self.CACHE_PATH, "ab") as file:
+            # Written after a record cut short by an interrupted append
+            size = file.seek(0, os.SEEK_END)
+            file.truncate(size - size % records.dtype.itemsize)
+            file.write(records.tobytes())
+        # Read back from disk, with whatever another process appended meanwhile
+        self.load()
+
+    def retain(
+        self,
+        owner: str,
+        references: np.ndarray,
+        released_ids: Iterable[int] | None = None,
+        compact: bool = False,
+    ) -> int:
+        # references: ROW_METADATA_DTYPE rows (document id, content hash) of the
+        # texts the owner's cache holds. They replace the owner's previous
+        # references, or with released_ids are added to them once those of the
+        # released documents are dropped. Returns the entries compact dropped.
+        path = os.path.join(self.CACHE_REFERENCES_DIR, f"{owner}.npy")
+        if released_ids is not None and os.path.exists(path):
+            previous = np.load(path)
+            kept = ~np.isin(previous["id"], list(released_ids))
+            references = np.concatenate((previous[kept], references))
+        with atomic_write(path) as file:
+            np.save(file, references)
+        return self.compact(force=compact)
+
+    def compact(self, force: bool = False) -> int:
+        # Rewrites the store without the entries held by no cache, once they
+        # are more than UNREFERENCED_THRESHOLD of it (or any, with force)
+        self.load()
+        if len(self.keys) == 0 or not os.path.isdir(self.CACHE_REFERENCES_DIR):
+            return 0
+        referenced = [
+            np.load(os.path.join(self.CACHE_REFERENCES_DIR, name))["hash"]
+            for name in sorted(os.listdir(self.CACHE_REFERENCES_DIR))
+            if name.endswith(".npy")
+        ]
+        if not referenced:
+            return 0
+        live = np.isin(self.keys, np.concatenate(referenced))
+        dropped = int(np.count_nonzero(~live))
+        if not dropped or (
+            not force and dropped <= UNREFERENCED_THRESHOLD * len(self.keys)
+        ):
+            return 0
+        records = np.empty(
+            len(self.keys) - dropped, self._record_dtype(self.vectors.shape[1])
+        )
+        records["key"] = self.keys[live]
+        records["vector"] = self.vectors[live]
+        with atomic_write(self.CACHE_PATH) as file:
+            file.write(records.tobytes())
+        self.load()
+        return dropped
+
+    def get_or_encode(
+        self, texts: list[str], encode: Callable[[list[str]], np.ndarray]
+    ) -> np.ndarray:
+        # encode is only called with the texts missing from the store, each
+        # distinct text once, and its vectors are stored for the next call
+        return self.get_or_encode_batches([texts], encode)[0]
+
+    def get_or_encode_batches(
+        self,
+        batches: Iterable[list[str]],
+        encode: Callable[[list[str]], np.ndarray],
+    ) -> list[np.ndarray]:
+        # get_or_encode for texts coming in batches, e.g. from a streamed
+        # catalog: one batch of texts is held at a time, while new vectors
+        # are appended to the store once, after the last batch.
+        # Returns the vectors of every non-empty batch.
+        results = []
+        # Every vector encoded by this call, by content hash
+        encoded = {}
+        for texts in batches:
+            if not texts:
+                continue
+            hashes = np.array([content_hash(text) for text in texts], HASH_DTYPE)
+            rows, found = self.lookup(hashes)
+            missing = np.flatnonzero(~found)
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+            if len(missing) == 0:
+                results.append(np.asarray(self.vectors[rows], dtype=np.float32))
+                continue
+
+            to_encode = {}
+            for i in missing:
+                if hashes[i] not in encoded:
+                    to_encode.setdefault(hashes[i], texts[i])
+            if to_encode:
+                vectors = np.asarray(encode(list(to_encode.values())), np.float32)
+                encoded.update(zip(to_encode, vectors))
+            missing_vectors = np.stack([encoded[hashes[i]] for i in missing])
+            result = np.empty((len(texts), missing_vectors.shape[1]), np.float32)
+            result[missing] = missing_vectors
+            if len(missing) < len(texts):
+                result[found] = self.vectors[rows[found]]
+            results.append(result)
+        if encoded:
+            self.add(
+                np.array(list(encoded), dtype=HASH_DTYPE),
+                np.stack(list(encoded.values())),
+            )
+        return results
+
+
+class QueryEmbeddingCache:
+    # Bounded LRU of query embeddings of one model, keyed by the query text
+    # with its whitespace normalized. With persist=True it is loaded from and,
+    # at exit, saved to cache/query_embeddings/.
+    def __init__(
+        self, model_name: str, max_size: int = QUERY_CACHE_SIZE, persist: bool = False
+    ) -> None:
+        self.model_name = model_name
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # Searches may share one instance across threads
+        self._lock = threading.Lock()
+        self.CACHE_PATH = cache_path(
+            "query_embeddings", f"{_cache_file_name(model_name)}.pkl"
+        )
+        if persist:
+            self.load()
+            atexit.register(self.save)
+
+    def _key(self, text: str) -> str:
+        return " ".join(text.split())
+
+    def get(self, text: str) -> np.ndarray | None:
+        key = self._key(text)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, text: str, embedding: np.ndarray) -> np.ndarray:
+        # Stored read-only, every caller gets the same array
+        embedding = np.array(embedding, dtype=np.float32)
+        embedding.setflags(write=False)
+        with self._lock:
+            self._entries[self._key(text)] = embedding
+            self._entries.move_to_end(self._key(text))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return embedding
+
+    def get_or_encode(
+        self, texts: list[str], encode: Callable[[list[str]], np.ndarray]
+    ) -> list[np.ndarray]:
+        # encode is only called with the distinct texts not cached yet
+        embeddings = [self.get(text) for text in texts]
+        missing = list(
+            dict.fromkeys(
+                self._key(text)
+                for text, embedding in zip(texts, embeddings)
+                if embedding is None
+            )
+        )
+        if missing:
+            encoded = {
+                key: self.put(key, embedding)
+                for key, embedding in zip(missing, encode(missing))
+            }
+            embeddings = [
+                encoded[self._key(text)] if embedding is None else embedding
+                for text, embedding in zip(texts, embeddings)
+            ]
+        return embeddings
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def load(self) -> None:
+        if not os.path.exists(self.CACHE_PATH):
+            return
+        with open(self.CACHE_PATH, "rb") as file:
+            entries = pickle.load(file)
+        with self._lock:
+            # Most recently used last, only the newest max_size entries fit
+            for key, embedding in list(entries.items())[
+                max(len(entries) - self.max_size, 0) :
+            ]:
+                embedding.setflags(write=False)
+                self._entries[key] = embedding
+
+    def save(self) -> None:
+        with self._lock:
+            entries = OrderedDict(self._entries)
+        with atomic_write(self.CACHE_PATH) as file:
+            pickle.dump(entries, file)
@@ -0,0 +1,224 @@
+import json
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .embedding_store import QueryEmbeddingCache
+from .hybrid_search import DEFAULT_K, HybridSearch
+from .search_utils import PROJECT_ROOT, atomic_write, load_golden_dataset, load_movies
+
+ENGINES = ["bm25", "semantic", "chunked", "weighted", "rrf"]
+DEFAULT_LIMIT = 5
+DEFAULT_ALPHA = 0.5
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+DEFAULT_REPORT_PATH = os.path.join(PROJECT_ROOT, "cache", "evaluation_report.json")
+LATENCY_PERCENTILES = [50, 95, 99]
+WARM_UP_QUERY = "warm up"
+METRICS = ["precision", "recall", "f1", "average_precision", "reciprocal_rank", "ndcg"]
+
+# One search instance per worker process, created by _init_worker
+_worker_search = None
+
+
+def _create_search(movies: list[dict]) -> HybridSearch:
+    search = HybridSearch(movies)
+    # Movie level embeddings for the "semantic" engine
+    search.semantic_search.load_or_create_embeddings(movies)
+    # Every engine embeds the same query: without a query cache each one is
+    # timed with its own encode, not with the embedding an earlier engine
+    # left behind
+    query_cache = search.semantic_search.query_cache
+    search.semantic_search.query_cache = QueryEmbeddingCache(
+        query_cache.model_name, max_size=0
+    )
+    # Lazily loaded indexes and tokenizer state would otherwise be timed as
+    # part of the first test case of every worker
+    for engine in ENGINES:
+        _search_titles(
+            search, engine, WARM_UP_QUERY, DEFAULT_LIMIT, DEFAULT_K, DEFAULT_ALPHA
+        )
+    return search
+
+
+def _init_worker() -> None:
+    global _worker_search
+    _worker_search = _create_search(load_movies())
+
+
+def _search_titles(
+    search: HybridSearch, engine: str, query: str, limit: int, k: int, alpha: float
+) -> list[str]:
+    match engine:
+        case "bm25":
+            return [movie["title"] for movie, _ in search.bm25_search(query, limit)]
+        case "semantic":
+            return [hit["title"] for hit in search.semantic_search.search(query, limit)]
+        case "chunked":
+            return [
+                hit["title"]
+                for hit in search.semantic_search.search_chunks(query, limit)
+            ]
+        case "weighted":
+            return [
+                hit["document"]["title"]
+                for hit in search.weighted_search(query, alpha, limit)
+            ]
+        case "rrf":
+            return [
+                hit["document"]["title"]
+                for _, hit in search.rrf_search(query, k, limit)
+            ]
+    raise ValueError(f"unknown engine '{engine}'")
+
+
+def _run_testcase(
+    search: HybridSearch,
+    testcase: dict,
+    engines: list[str],
+    limit: int,
+    k: int,
+    alpha: float,
+) -> dict[str, dict]:
+    runs = {}
+    for engine in engines:
+        start = time.perf_counter()
+        retrieved = _search_titles(search, engine, testcase["query"], limit, k, alpha)
+        latency_ms = (time.perf_counter() - start) * 1000
+        runs[engine] = {"retrieved": retrieved, "latency_ms": latency_ms}
+    return runs
+
+
+def _run_worker_testcase(args: tuple) -> dict[str, dict]:
+    return _run_testcase(_worker_search, *args)
+
+
+def retrieval_metrics(retrieved: list[str], relevant: list[str], k: int) -> dict:
+    # Binary relevance by title. AP and nDCG are normalized by the best
+    # ranking possible within k results.
+    relevant = set(relevant)
+    retrieved = retrieved[:k]
+    hits = [title in relevant for title in retrieved]
+    relevant_retrieved = sum(hits)
+    precision = relevant_retrieved / len(retrieved) if retrieved else 0.0
+    recall = relevant_retrieved / len(relevant) if relevant else 0.0
+    f1 = (
+        2 * precision * recall / (precision + recall)
+        if precision + recall > 0
+        else 0.0
+    )
+    ideal_hits = min(len(relevant), k)
+    precisions_at_hits, seen = [], 0
+    for rank, hit in enumerate(hits, 1):
+        if hit:
+            seen += 1
+            precisions_at_hits.append(seen / rank)
+    average_precision = sum(precisions_at_hits) / ideal_hits if ideal_hits else 0.0
+    reciprocal_rank = next(
+        (1 / rank for rank, hit in enumerate(hits, 1) if hit), 0.0
+    )
+    dcg = sum(1 / math.log2(rank + 1) for rank, hit in enumerate(hits, 1) if hit)
+    idcg = sum(1 / math.log2(rank + 1) for rank in range(1, ideal_hits + 1))
+    return {
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "average_precision": average_precision,
+        "reciprocal_rank": reciprocal_rank,
+        "ndcg": dcg / idcg if idcg else 0.0,
+    }
+
+
+def latency_summary(latencies_ms: list[float]) -> dict[str, float]:
+    summary = {
+        f"p{percentile}": float(value)
+        for percentile, value in zip(
+            LATENCY_PERCENTILES, np.percentile(latencies_ms, LATENCY_PERCENTILES)
+        )
+    }
+    summary["mean"] = float(np.mean(latencies_ms))
+    return summary
+
+
+def evaluate(
+    engines: list[str] = ENGINES,
+    limit: int = DEFAULT_LIMIT,
+    k: int = DEFAULT_K,
+    alpha: float = DEFAULT_ALPHA,
+    workers: int = DEFAULT_WORKERS,
+) -> dict:
+    for engine in engines:
+        if engine not in ENGINES:
+            raise ValueError(f"unknown engine '{engine}'")
+    dataset = load_golden_dataset()
+    movies = load_movies()
+    # Builds any missing cache once, before workers would race to build it
+    search = _create_search(movies)
+    start = time.perf_counter()
+    testcase_args = [(testcase, engines, limit, k, alpha) for testcase in dataset]
+    if workers <= 1:
+        runs = [_run_testcase(search, *args) for args in testcase_args]
+    else:
+        del search
+        # Spawned, a fork would copy the parent's model threads mid-state
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        ) as executor:
+            runs = list(executor.map(_run_worker_testcase, testcase_args))
+    wall_seconds = time.perf_counter() - start
+
+    report = {
+        "limit": limit,
+        "k": k,
+        "alpha": alpha,
+        "workers": workers,
+        # With several workers the test cases run side by side, so every
+        # latency also includes contention with the other workers' searches.
+        # Only a single worker times each search alone.
+        "latency_isolated": workers <= 1,
+        "testcases": len(dataset),
+        "wall_seconds": wall_seconds,
+        "engines": {},
+    }
+    for engine in engines:
+        queries = []
+        for testcase, run in zip(dataset, runs):
+            retrieved = run[engine]["retrieved"]
+            queries.append(
+                {
+                    "query": testcase["query"],
+                    "retrieved": retrieved,
+                    "relevant": testcase["relevant_docs"],
+                    "latency_ms": run[engine]["latency_ms"],
+                    **retrieval_metrics(retrieved, testcase["relevant_docs"], limit),
+                }
+            )
+        report["engines"][engine] = {
+            # Means over the test cases, i.e. MAP and MRR for AP and RR
+            "metrics": {
+                metric: float(np.mean([query[metric] for query in queries]))
+                for metric in METRICS
+            },
+            "latency_ms": latency_summary([query["latency_ms"] for query in queries]),
+            "queries": queries,
+        }
+    return report
+
+
+def evaluation_command(
+    engines: list[str] = ENGINES,
+    limit: int = DEFAULT_LIMIT,
+    k: int = DEFAULT_K,
+    alpha: float = DEFAULT_ALPHA,
+    workers: int = DEFAULT_WORKERS,
+    output: str = DEFAULT_REPORT_PATH,
+) -> dict:
+    report = evaluate(engines, limit, k, alpha, workers)
+    with atomic_write(os.path.abspath(output), "w") as file:
+        json.dump(report, file, indent=2)
+    return report
@@ -1,18 +1,100 @@
 import os
 import json
+from collections.abc import Callable
+from typing import Any
 
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
 
+from .llm_cache import LLMResponseCache
+from .tracing import count, span
+
 
 class GeminiClient:
-    def __init__(self, model: str = "gemini-2.5-flash"):
-        load_dotenv()
-        api_key = os.environ.get("GEMINI_API_KEY")
-        self.client = genai.Client(api_key=api_key)
+    # client is a genai.Client, or anything with the same models and
+    # aio.models generate_content API (e.g. a local fake). Text responses are
+    # served from and stored in response_cache, None disables caching.
+    def __init__(
+        self,
+        model: str = "gemini-2.5-flash",
+        client=None,
+        response_cache: LLMResponseCache | None = None,
+        use_cache: bool = True,
+    ):
+        if client is None:
+            load_dotenv()
+            api_key = os.environ.get("GEMINI_API_KEY")
+            client = genai.Client(api_key=api_key)
+        self.client = client
         self.model = model
         self.rerank_precision = 3
+        if response_cache is None and use_cache:
+            response_cache = LLMResponseCache()
+        self.response_cache = response_cache
+
+    def _request(self, prompt: str, response_mime_type: str | None) -> dict:
+        request = {"model": self.model, "contents": prompt}
+        if response_mime_type is not None:
+            request["config"] = genai.types.GenerateContentConfig(
+                response_mime_type=response_mime_type
+            )
+        return request
+
+    def _cached(self, method: str, prompt: str) -> str | None:
+        if self.response_cache is None:
+            return None
+        text = self.response_cache.get(self.model, method, prompt)
+        count("llm_cache.misses" if text is None else "llm_cache.hits")
+        return text
+
+    def _store(
+        self, method: str, prompt: str, text: str | None, parse: Callable
+    ) -> Any:
+        # A blocked or empty response has no text: nothing is cached, text
+        # methods return None like the client does and parsed ones fail
+        if text is None:
+            if parse is str:
+                return None
+            raise ValueError(f"{self.model} returned no text for {method}")
+        # Parsed before it is stored, a malformed response is asked for again
+        # instead of being replayed from the cache
+        value = parse(text)
+        if self.response_cache is not None:
+            self.response_cache.put(self.model, method, prompt, text)
+        return value
+
+    def _generate(
+        self,
+        method: str,
+        prompt: str,
+        parse: Callable = str,
+        response_mime_type: str | None = None,
+    ) -> Any:
+        text = self._cached(method, prompt)
+        if text is not None:
+            return parse(text)
+        with span(f"llm.{method}"):
+            response = self.client.models.generate_content(
+                **self._request(prompt, response_mime_type)
+            )
+        return self._store(method, prompt, response.text, parse)
+
+    async def _generate_async(
+        self,
+        method: str,
+        prompt: str,
+        parse: Callable = str,
+        response_mime_type: str | None = None,
+    ) -> Any:
+        text = self._cached(method, prompt)
+        if text is not None:
+            return parse(text)
+        with span(f"llm.{method}"):
+            response = await self.client.aio.models.generate_content(
+                **self._request(prompt, response_mime_type)
+            )
+        return self._store(method, prompt, response.text, parse)
 
     def fix_spelling(self, query: str) -> str:
         prompt = f"""Fix any spelling errors in this movie search query.
@@ -24,10 +106,7 @@ Query: "{query}"
 If no errors, return the original query.
 If you correct something, return just the corrected query.
 Corrected:"""
-        response = self.client.models.generate_content(
-            model=self.model, contents=prompt
-        )
-        return response.text
+        return self._generate("fix_spelling", prompt)
 
     def rewrite_query(self, query: str) -> str:
         prompt = f"""Rewrite this movie search query to be more specific and searchable.
@@ -50,10 +129,7 @@ Examples:
 Return only the rewritten query, don't add anything before or after the query
 Rewritten query:"""
 
-        response = self.client.models.generate_content(
-            model=self.model, contents=prompt
-        )
-        return response.text
+        return self._generate("rewrite_query", prompt)
 
     def expand_query(self, query: str) -> str:
         prompt = f"""Expand this movie search query with related terms.
@@ -72,16 +148,13 @@ Query: "{query}"
 Return only the expanded query, don't add anything before or after the query
 """
 
-        response = self.client.models.generate_content(
-            model=self.model, contents=prompt
-        )
-        return response.text
+        return self._generate("expand_query", prompt)
 
-    def individual_rerank(self, query: str, movie: dict) -> str:
-        prompt = f"""Rate how well this movie matches the search query.
+    def _individual_rerank_prompt(self, query: str, movie: dict) -> str:
+        return f"""Rate how well this movie matches the search query.
 
 Query: "{query}"
-Movie: {movie.get("title", "")} - {movie.get("document", "")}
+Movie: {movie["title"]} - {movie["description"]}
 
 Consider:
 - Direct relevance to query
@@ -93,10 +166,14 @@ Give me ONLY the number in your response, no other text or explanation.
 The score should be a float with up to {self.rerank_precision} decimal points of precision
 
 Score:"""
-        response = self.client.models.generate_content(
-            model=self.model, contents=prompt
-        )
-        return float(response.text)
+
+    def individual_rerank(self, query: str, movie: dict) -> float:
+        prompt = self._individual_rerank_prompt(query, movie)
+        return self._generate("individual_rerank", prompt, float)
+
+    async def individual_rerank_async(self, query: str, movie: dict) -> float:
+        prompt = self._individual_rerank_prompt(query, movie)
+        return await self._generate_async("individual_rerank", prompt, float)
 
     def batch_rerank(self, query: str, doc_list: list[str]) -> any:
         prompt = f"""Rank these movies by relevance to the search query.
@@ -110,16 +187,10 @@ Return ONLY the IDs in order of relevance (best match first). Return a valid JSO
 
 [75, 12, 34, 2, 1]
 """
-        response = self.client.models.generate_content(
-            model=self.model,
-            contents=prompt,
-            config=genai.types.GenerateContentConfig(
-                response_mime_type="application/json"
-            ),
+        return self._generate(
+            "batch_rerank", prompt, json.loads, response_mime_type="application/json"
         )
 
-        return json.loads(response.text)
-
     def evaluate_results(self, query: str, formatted_results: list[str]) -> any:
         prompt = f"""Rate how relevant each result is to this query on a 0-3 scale:
 
@@ -139,16 +210,10 @@ Do NOT give any numbers out than 0, 1, 2, or 3.
 Return ONLY the scores in the same order you were given the documents. Return a valid JSON list, nothing else. For example:
 
 [2, 0, 3, 2, 0, 1]"""
-        response = self.client.models.generate_content(
-            model=self.model,
-            contents=prompt,
-            config=genai.types.GenerateContentConfig(
-                response_mime_type="application/json"
-            ),
+        return self._generate(
+            "evaluate_results", prompt, json.loads, response_mime_type="application/json"
         )
 
-        return json.loads(response.text)
-
     def rag(self, query: str, docs: list[str]) -> str:
         prompt = f"""Answer the question or provide information based on the provided documents. This should be tailored to Hoopla users. Hoopla is a movie streaming service.
 
@@ -159,10 +224,7 @@ Documents:
 
 Provide a comprehensive answer that addresses the query:"""
 
-        response = self.client.models.generate_content(
-            model=self.model, contents=prompt
-        )
-        return response.text
+        return self._generate("rag", prompt)
 
     def summarize(self, query: str, docs: list[str]) -> str:
         prompt = f"""
@@ -176,10 +238,7 @@ Search Results:
 Provide a comprehensive 3-4 sentence answer that combines information from multiple sources:
 """
 
-        response = self.client.models.generate_content(
-            model=self.model, contents=prompt
-        )
-        return response.text
+        return self._generate("summarize", prompt)
 
     def citations(self, query: str, docs: list[str]) -> str:
         prompt = f"""Answer the question or provide information based on the provided documents.
@@ -206,10 +265,7 @@ Instructions:
 
 Answer:"""
 
-        response = self.client.models.generate_content(
-            model=self.model, contents=prompt
-        )
-        return response.text
+        return self._generate("citations", prompt)
 
     def question(self, query: str, docs: list[str]) -> str:
         prompt = f"""Answer the user's question based on the provided movies that are available on Hoopla.
@@ -237,10 +293,7 @@ Answer:"""
 
     Answer:"""
 
-        response = self.client.models.generate_content(
-            model=self.model, contents=prompt
-        )
-        return response.text
+        return self._generate("question", prompt)
 
     def rewrite_from_image(self, query: str, image: bytes, mime: str) -> types.GenerateContentResponse:
         system_prompt = """Given the included image and text query, rewrite the text query to improve search results from a movie database. Make sure to:
@@ -1,40 +1,159 @@
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 
 from .search_utils import load_movies
-from .keyword_search import InvertedIndex
+from .keyword_search import InvertedIndex, update_index
+from .compact_index import CompactIndex, load_compact_index
 from .chunked_semantic_search import ChunkedSemanticSearch
-from .gemini_integration import GeminiClient
-from sentence_transformers import CrossEncoder
+from .cross_encoder_rerank import get_cross_encoder_reranker
+from .llm_rerank import DEFAULT_CONCURRENCY, DEFAULT_TIMEOUT, IndividualReranker
+from .tracing import count, span
 
-CROSS_ENCODER_MODEL = "cross-encoder/ms-marco-TinyBERT-L2-v2"
 DEFAULT_K = 60
+# Default value per candidate depth mode: an absolute number of candidates
+# for "fixed", a multiple of limit for "proportional", and the multiple of
+# limit the first "adaptive" round starts from (doubled every round)
+DEFAULT_CANDIDATE_DEPTHS = {"fixed": 100, "proportional": 500, "adaptive": 2}
+DEPTH_MODES = list(DEFAULT_CANDIDATE_DEPTHS)
+
+
+class CandidateDepth:
+    def __init__(self, mode: str = "proportional", value: int | None = None):
+        if mode not in DEFAULT_CANDIDATE_DEPTHS:
+            raise ValueError(f"unknown candidate depth mode '{mode}'")
+        if value is None:
+            value = DEFAULT_CANDIDATE_DEPTHS[mode]
+        if value < 1:
+            raise ValueError("candidate depth must be at least 1")
+        self.mode = mode
+        self.value = value
+
+    def initial_depth(self, limit: int) -> int:
+        if self.mode == "fixed":
+            return max(self.value, limit)
+        return limit * self.value
+
 
 class HybridSearch:
-    def __init__(self, documents):
+    def __init__(
+        self,
+        documents,
+        mmap_mode: str | None = "r",
+        semantic_search: ChunkedSemanticSearch | None = None,
+    ):
         self.documents = documents
-        self.semantic_search = ChunkedSemanticSearch()
-        self.semantic_search.load_or_create_chunk_embeddings(documents)
-        self.TIMES_OVER_LIMIT = 500
-        
-
-        self.idx = InvertedIndex()
-        if not os.path.exists(self.idx.CACHE_INDEX_PATH):
-            self.idx.build()
-            self.idx.save()
+        if semantic_search is None:
+            semantic_search = ChunkedSemanticSearch(mmap_mode=mmap_mode)
+        self.semantic_search = semantic_search
+        self.idx = CompactIndex()
+        self._reload_lock = threading.Lock()
+        self.candidate_depth = CandidateDepth()
+        self.last_search_stats = {}
+        self.build_timings = {}
+
+        # The index stays resident for the lifetime of the instance and is only
+        # reloaded when the cache files on disk change
+        self._load_or_build_indexes(documents)
+        if self.build_timings:
+            print("Index build timings:")
+            for stage, seconds in self.build_timings.items():
+                print(f"  - {stage}: {seconds:.2f}s")
+
+    def _load_or_build_indexes(self, documents: list[dict]) -> None:
+        # BM25 tokenization and chunk embedding don't depend on each other, so
+        # they run side by side (model inference releases the GIL)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            bm25_future = executor.submit(self._load_or_build_bm25, documents)
+            chunks_future = executor.submit(self._load_or_build_chunks, documents)
+            bm25_future.result()
+            chunks_future.result()
+        if self.build_timings:
+            self.build_timings["total"] = time.perf_counter() - start
+
+    def _load_or_build_bm25(self, documents: list[dict]) -> None:
+        inverted_index = InvertedIndex()
+        if self.idx.exists() or os.path.exists(inverted_index.CACHE_INDEX_PATH):
+            idx = load_compact_index()
+            if not idx.matches(documents):
+                # Movies changed since the index was built: patched like the
+                # chunk embeddings are, so both sides search the same catalog
+                update_index(documents)
+                idx = load_compact_index()
+            self.idx = idx
+            return
+        start = time.perf_counter()
+        inverted_index.build(documents)
+        self.build_timings["bm25 tokenize"] = time.perf_counter() - start
+        start = time.perf_counter()
+        # Kept as the base the next update patches, see update_index
+        inverted_index.save()
+        self.idx.build(inverted_index)
+        self.idx.save()
+        self.idx.load()
+        self.build_timings["bm25 save"] = time.perf_counter() - start
+
+    def _load_or_build_chunks(self, documents: list[dict]) -> None:
+        if os.path.exists(self.semantic_search.CACHE_CHUNK_EMBEDDINGS):
+            self.semantic_search.load_or_create_chunk_embeddings(documents)
+            return
+        start = time.perf_counter()
+        self.semantic_search.build_chunk_embeddings(documents)
+        self.build_timings["chunk embeddings"] = time.perf_counter() - start
+
+    def bm25_search(self, query: str, limit: int) -> list[(dict, float)]:
+        return self._bm25_search(query, limit)
+
+    def _current_index(self) -> CompactIndex:
+        # A changed cache is loaded into a new CompactIndex and published with
+        # a single assignment, so a search (on any of the server's threads)
+        # never sees old and new arrays mixed. One thread reloads, the others
+        # keep searching the index they have meanwhile.
+        idx = self.idx
+        if idx.has_changed() and self._reload_lock.acquire(blocking=False):
+            try:
+                idx = self.idx
+                if idx.has_changed():
+                    reloaded = CompactIndex()
+                    reloaded.load()
+                    self.idx = idx = reloaded
+            finally:
+                self._reload_lock.release()
+        return idx
 
     def _bm25_search(
         self, query: str, limit: int, debug: bool = False
     ) -> list[(dict, float)]:
-        self.idx.load()
-        return self.idx.bm25_search(query, limit, debug)
+        return self._current_index().bm25_search(query, limit, debug)
+
+    def _bm25_search_many(
+        self, queries: list[str], limit: int
+    ) -> list[list[(dict, float)]]:
+        return self._current_index().bm25_search_many(queries, limit)
 
     def hybrid_score(
         self, bm25_score: float, semantic_score: float, alpha: float = 0.5
     ):
         return alpha * bm25_score + (1 - alpha) * semantic_score
 
-    def weighted_search(self, query: str, alpha: float, limit: int = 5) -> list[dict]:
-        bm25_results = self._bm25_search(query, limit * self.TIMES_OVER_LIMIT)
+    def weighted_search(
+        self,
+        query: str,
+        alpha: float,
+        limit: int = 5,
+        depth: CandidateDepth | None = None,
+    ) -> list[dict]:
+        depth = depth or self.candidate_depth
+        if depth.mode == "adaptive":
+            # Min-max normalized scores depend on the whole candidate list, so
+            # there is no rank beyond which the fused top results are final
+            raise ValueError("adaptive candidate depth is only supported by RRF")
+        candidate_depth = depth.initial_depth(limit)
+        bm25_results = self._bm25_search(query, candidate_depth)
         bm25_scores = [score for _, score in bm25_results]
         bm25_normalized = self.normalize(bm25_scores)
 
@@ -44,37 +163,45 @@ class HybridSearch:
             self._create_new_weighted_entry(
                 weighted_results, movie, keyword_score=bm25_normalized[i]
             )
-        semantic_results = self.semantic_search.search_chunks(
-            query, limit * self.TIMES_OVER_LIMIT
-        )
-        semantic_scores = [result["score"] for result in semantic_results]
-        semantic_normalized = self.normalize(semantic_scores)
-
-        for i, result in enumerate(semantic_results):
-            id = result["metadata"]["movie_idx"]
-            semantic_score = semantic_normalized[i]
-            weighted_entry = weighted_results.get(id)
-            if not weighted_entry:
-                self._create_new_weighted_entry(
-                    weighted_results,
-                    self.semantic_search.document_map[id],
-                    semantic_score,
+        semantic_results = self.semantic_search.search_chunks(query, candidate_depth)
+        count("weighted.candidates", len(bm25_results) + len(semantic_results))
+        with span("weighted.fuse"):
+            semantic_scores = [result["score"] for result in semantic_results]
+            semantic_normalized = self.normalize(semantic_scores)
+
+            for i, result in enumerate(semantic_results):
+                id = result["metadata"]["movie_idx"]
+                semantic_score = semantic_normalized[i]
+                weighted_entry = weighted_results.get(id)
+                if not weighted_entry:
+                    self._create_new_weighted_entry(
+                        weighted_results,
+                        self.semantic_search.document_map[id],
+                        semantic_score,
+                    )
+                else:
+                    weighted_entry["semantic_score"] = semantic_score
+
+            for entry in weighted_results.values():
+                keyword_score = entry["keyword_score"]
+                semantic_score = entry["semantic_score"]
+                entry["hybrid_score"] = self.hybrid_score(
+                    keyword_score, semantic_score, alpha
                 )
-            else:
-                weighted_entry["semantic_score"] = semantic_score
-
-        for entry in weighted_results.values():
-            keyword_score = entry["keyword_score"]
-            semantic_score = entry["semantic_score"]
-            entry["hybrid_score"] = self.hybrid_score(
-                keyword_score, semantic_score, alpha
-            )
 
-        return sorted(
-            weighted_results.values(),
-            key=lambda result: result["hybrid_score"],
-            reverse=True,
-        )[:limit]
+            ranked = sorted(
+                weighted_results.values(),
+                key=lambda result: result["hybrid_score"],
+                reverse=True,
+            )[:limit]
+
+        self.last_search_stats = {
+            "depth": candidate_depth,
+            "rounds": 1,
+            "bm25_candidates": len(bm25_results),
+            "semantic_candidates": len(semantic_results),
+        }
+        return ranked
 
     def _create_new_weighted_entry(
         self,
@@ -92,40 +219,169 @@ class HybridSearch:
         }
 
     def rrf_search(
-        self, query: str, k: int = DEFAULT_K, limit: int = 10, debug: bool = False
+        self,
+        query: str,
+        k: int = DEFAULT_K,
+        limit: int = 10,
+        debug: bool = False,
+        depth: CandidateDepth | None = None,
     ) -> list[(int, dict)]:
-        bm25_results = self._bm25_search(query, limit * self.TIMES_OVER_LIMIT, debug)
+        depth = depth or self.candidate_depth
+        query_embedding = self.semantic_search.generate_embedding(query)
+        sorted_rank, self.last_search_stats = self._rrf_rounds(
+            query, query_embedding, k, limit, debug, depth
+        )
+        return sorted_rank
+
+    def rrf_search_many(
+        self,
+        queries: list[str],
+        k: int = DEFAULT_K,
+        limit: int = 10,
+        depth: CandidateDepth | None = None,
+    ) -> list[list[(int, dict)]]:
+        depth = depth or self.candidate_depth
+        candidate_depth = depth.initial_depth(limit)
+        # The first round of every query runs as one batch: a single model
+        # batch and matrix product for the chunks, and one traversal of every
+        # posting list for BM25. Only further adaptive rounds run per query.
+        query_embeddings = self.semantic_search.generate_embeddings(queries)
+        bm25_batch = self._bm25_search_many(queries, candidate_depth)
+        semantic_batch = self.semantic_search.search_chunks_by_embeddings(
+            query_embeddings, candidate_depth
+        )
+        results = []
+        for query, query_embedding, bm25_results, semantic_results in zip(
+            queries, query_embeddings, bm25_batch, semantic_batch
+        ):
+            sorted_rank, _ = self._rrf_rounds(
+                query,
+                query_embedding,
+                k,
+                limit,
+                False,
+                depth,
+                (bm25_results, semantic_results),
+            )
+            results.append(sorted_rank)
+        return results
+
+    def _rrf_rounds(
+        self,
+        query: str,
+        query_embedding: np.ndarray,
+        k: int,
+        limit: int,
+        debug: bool,
+        depth: CandidateDepth,
+        first_round: tuple[list, list] | None = None,
+    ) -> tuple[list[(int, dict)], dict]:
+        candidate_depth = depth.initial_depth(limit)
+        rounds = 0
+        while True:
+            rounds += 1
+            if rounds == 1 and first_round is not None:
+                bm25_results, semantic_results = first_round
+            else:
+                bm25_results = self._bm25_search(
+                    query, candidate_depth, debug and rounds == 1
+                )
+                semantic_results = self.semantic_search.search_chunks_by_embedding(
+                    query_embedding, candidate_depth
+                )
+            with span("rrf.fuse"):
+                rrf_ranks = self._fuse_rrf(bm25_results, semantic_results, k)
+                sorted_rank = sorted(
+                    rrf_ranks.items(),
+                    key=lambda result: result[1]["rrf_score"],
+                    reverse=True,
+                )
+            count("rrf.rounds")
+            count("rrf.candidates", len(bm25_results) + len(semantic_results))
+            bm25_bound, semantic_bound = 0.0, 0.0
+            if len(bm25_results) >= candidate_depth:
+                bm25_bound = self._calculate_rrf(candidate_depth + 1, k)
+            if len(semantic_results) >= candidate_depth:
+                semantic_bound = self._calculate_rrf(candidate_depth + 1, k)
+            if (
+                depth.mode != "adaptive"
+                or (not bm25_bound and not semantic_bound)
+                or self._is_rrf_top_final(
+                    sorted_rank, limit, bm25_bound, semantic_bound
+                )
+            ):
+                break
+            candidate_depth *= 2
+
+        stats = {
+            "depth": candidate_depth,
+            "rounds": rounds,
+            "bm25_candidates": len(bm25_results),
+            "semantic_candidates": len(semantic_results),
+        }
+        if debug:
+            print("keyword results:")
+            titles = [movie["title"] for movie, _ in bm25_results]
+            print(titles)
+            print("semantic results:")
+            titles = [movie["title"] for movie in semantic_results]
+            print(titles)
+            print("RRF Score Sorted Rank")
+            titles = [doc["document"]["title"] for _, doc in sorted_rank]
+            print(titles)
+        return sorted_rank[:limit], stats
+
+    def _fuse_rrf(
+        self, bm25_results: list[(dict, float)], semantic_results: list[dict], k: int
+    ) -> dict:
         rrf_ranks = {}
         for i, (movie, _) in enumerate(bm25_results, 1):
             movie_id = movie["id"]
             self._create_rrf_entry(rrf_ranks, movie_id, movie)
             self._update_bm25_rank_and_score(rrf_ranks, movie_id, i, k)
-        if debug:
-            print("keyword results:")
-            titles = [movie["title"] for movie, _ in bm25_results]
-            print(titles)
-            
-        semantic_results = self.semantic_search.search_chunks(
-            query, limit * self.TIMES_OVER_LIMIT
-        )
+
         for i, sem_result in enumerate(semantic_results, 1):
             movie_id = sem_result["id"]
             if not rrf_ranks.get(movie_id):
-                movie = self.idx.docmap[movie_id]
+                movie = self.semantic_search.document_map[movie_id]
                 self._create_rrf_entry(rrf_ranks, movie_id, movie)
             self._update_semantic_rank_and_score(rrf_ranks, movie_id, i, k)
-        if debug:
-            print("semantic results:")
-            titles = [movie["title"] for movie in semantic_results]
-            print(titles)
-        sorted_rank = sorted(
-            rrf_ranks.items(), key=lambda result: result[1]["rrf_score"], reverse=True
+        return rrf_ranks
+
+    def _is_rrf_top_final(
+        self,
+        sorted_rank: list[(int, dict)],
+        limit: int,
+        bm25_bound: float,
+        semantic_bound: float,
+    ) -> bool:
+        # bm25_bound/semantic_bound are the largest RRF contributions a movie
+        # can still get from a rank deeper than the ones retrieved so far. The
+        # top results are final once every one of them scores at least the
+        # best score any movie ranked after it could still reach, and has its
+        # rank in both retrievers unless that retriever returned everything it
+        # matches (a zero bound). Otherwise its rrf_score is only a lower bound.
+        if len(sorted_rank) < limit:
+            return False
+        for _, entry in sorted_rank[:limit]:
+            if (bm25_bound and not entry["bm25_rank"]) or (
+                semantic_bound and not entry["semantic_rank"]
+            ):
+                return False
+        best_reachable = bm25_bound + semantic_bound
+        reachable_after = [0.0] * len(sorted_rank)
+        for i in range(len(sorted_rank) - 1, -1, -1):
+            reachable_after[i] = best_reachable
+            entry = sorted_rank[i][1]
+            upper_bound = entry["rrf_score"]
+            if not entry["bm25_rank"]:
+                upper_bound += bm25_bound
+            if not entry["semantic_rank"]:
+                upper_bound += semantic_bound
+            best_reachable = max(best_reachable, upper_bound)
+        return all(
+            sorted_rank[i][1]["rrf_score"] >= reachable_after[i] for i in range(limit)
         )
-        if debug:
-            print("RRF Score Sorted Rank")
-            titles = [doc["document"]["title"] for _, doc in sorted_rank]
-            print(titles)
-        return sorted_rank[:limit]
 
     def _create_rrf_entry(self, rrf_ranks: dict, movie_id: int, movie: dict) -> None:
         rrf_ranks[movie_id] = {
@@ -151,27 +407,42 @@ class HybridSearch:
         return 1 / (k + rank)
 
     def normalize(self, scores: list[float]) -> list[float]:
-        if not scores or len(scores) == 0:
-            return []
-        min_score = float(min(scores))
-        max_score = float(max(scores))
-        if min_score == max_score:
-            return [1.0] * len(scores)
+        return normalize(scores)
+
+
+def normalize(scores: list[float]) -> list[float]:
+    if not scores or len(scores) == 0:
+        return []
+    min_score = float(min(scores))
+    max_score = float(max(scores))
+    if min_score == max_score:
+        return [1.0] * len(scores)
 
-        normalized_scores = [(s - min_score) / (max_score - min_score) for s in scores]
-        return normalized_scores
+    normalized_scores = [(s - min_score) / (max_score - min_score) for s in scores]
+    return normalized_scores
 
 
 def normalize_command(scores: list[float]) -> list[float]:
-    movies = load_movies()
-    search_instance = HybridSearch(movies)
-    return search_instance.normalize(scores)
+    # Pure arithmetic, no movies, indexes or models are loaded
+    return normalize(scores)
 
 
-def weighted_search_command(query: str, alpha: float, limit: int) -> list[dict]:
+def weighted_search_command(
+    query: str, alpha: float, limit: int, depth: CandidateDepth | None = None
+) -> list[dict]:
     movies = load_movies()
     search_instance = HybridSearch(movies)
-    return search_instance.weighted_search(query, alpha, limit)
+    results = search_instance.weighted_search(query, alpha, limit, depth)
+    print_search_stats(search_instance.last_search_stats)
+    return results
+
+
+def print_search_stats(stats: dict) -> None:
+    print(
+        f"Candidates retrieved: {stats['bm25_candidates']} BM25, "
+        f"{stats['semantic_candidates']} semantic "
+        f"(depth {stats['depth']}, {stats['rounds']} round(s))\n"
+    )
 
 
 def rrf_search_command(
@@ -181,7 +452,13 @@ def rrf_search_command(
     enhance_method: str,
     rerank_method: str,
     debug: bool = False,
+    depth: CandidateDepth | None = None,
+    rerank_concurrency: int = DEFAULT_CONCURRENCY,
+    rerank_timeout: float = DEFAULT_TIMEOUT,
 ) -> list[dict]:
+    # Imported here so that importing this module doesn't load the LLM client
+    from .gemini_integration import GeminiClient
+
     match enhance_method:
         case "spell":
             gemini_client = GeminiClient()
@@ -212,65 +489,55 @@ def rrf_search_command(
         original_limit = limit
         limit *= 5
 
-    movies = load_movies()
-    search_instance = HybridSearch(movies)
-    results = search_instance.rrf_search(query, k, limit, debug)
+    with span("load"):
+        movies = load_movies()
+        search_instance = HybridSearch(movies)
+    results = search_instance.rrf_search(query, k, limit, debug, depth)
+    print_search_stats(search_instance.last_search_stats)
 
-    match rerank_method:
-        case "individual":
-            print(
-                f"Reranking top {original_limit} results using {rerank_method} method..."
-            )
-            print(f"Reciprocal Rank Fusion Results for '{query}' (k={k}):")
-            for _, result in results:
-                gemini_client = GeminiClient()
-                rerank_score = gemini_client.individual_rerank(
-                    query, result["document"]
+    with span("rerank"):
+        match rerank_method:
+            case "individual":
+                print(
+                    f"Reranking top {original_limit} results using {rerank_method} method..."
                 )
-                result["rerank_score"] = rerank_score
-
-            results.sort(key=lambda movie: movie[1]["rerank_score"], reverse=True)
-            results = results[:original_limit]
-        case "batch":
-            print(
-                f"Reranking top {original_limit} results using {rerank_method} method..."
-            )
-            print(f"Reciprocal Rank Fusion Results for '{query}' (k={k}):")
-            doc_list = [result["document"] for _, result in results]
-            gemini_client = GeminiClient()
-            reranked_ids = gemini_client.batch_rerank(query, doc_list)
-
-            look_up = {item[0]: item for item in results}
-            results = [
-                (id, look_up[id][1] | {"rerank_rank": i})
-                for i, id in enumerate(reranked_ids, 1)
-            ]
-            results = results[:original_limit]
-        case "cross_encoder":
-            cross_encoder = CrossEncoder(CROSS_ENCODER_MODEL)
-            pairs_with_ids = [
-                (doc_id, (query, f"{doc.get('title', '')} - {doc.get('document', '')}"))
-                for doc_id, doc in results
-            ]
-            if debug:
-                print("Results before cross_encoder:")
-                titles = [doc["document"]["title"] for _, doc in results]
-                print(titles)
-            pairs = [item[1] for item in pairs_with_ids]
-            # scores is a list of numbers, one for each pair
-            scores = cross_encoder.predict(pairs)
-            scored_pairs = list(zip(scores, pairs_with_ids))
-            scored_pairs.sort(key=lambda x: x[0], reverse=True)
-            look_up = {item[0]: item for item in results}
-            results = [
-                (doc_id, look_up[doc_id][1] | {"cross_encoder_score": score})
-                for score, (doc_id, (_, document)) in scored_pairs
-            ]
-            if debug:
-                print("Results after cross_encoder:")
-                titles = [doc["document"]["title"] for _, doc in results]
-                print(titles)
-            results = results[:original_limit]
+                print(f"Reciprocal Rank Fusion Results for '{query}' (k={k}):")
+                reranker = IndividualReranker(
+                    GeminiClient(), rerank_concurrency, rerank_timeout
+                )
+                results = reranker.rerank(query, results)[:original_limit]
+                stats = reranker.last_rerank_stats
+                if stats["failed"]:
+                    print(
+                        f"{stats['failed']}/{stats['calls']} rerank calls failed, "
+                        f"kept at their RRF position (last error: {stats['last_error']})"
+                    )
+            case "batch":
+                print(
+                    f"Reranking top {original_limit} results using {rerank_method} method..."
+                )
+                print(f"Reciprocal Rank Fusion Results for '{query}' (k={k}):")
+                doc_list = [result["document"] for _, result in results]
+                gemini_client = GeminiClient()
+                reranked_ids = gemini_client.batch_rerank(query, doc_list)
+
+                look_up = {item[0]: item for item in results}
+                results = [
+                    (id, look_up[id][1] | {"rerank_rank": i})
+                    for i, id in enumerate(reranked_ids, 1)
+                ]
+                results = results[:original_limit]
+            case "cross_encoder":
+                if debug:
+                    print("Results before cross_encoder:")
+                    titles = [doc["document"]["title"] for _, doc in results]
+                    print(titles)
+                results = get_cross_encoder_reranker().rerank(query, results)
+                if debug:
+                    print("Results after cross_encoder:")
+                    titles = [doc["document"]["title"] for _, doc in results]
+                    print(titles)
+                results = results[:original_limit]
 
     results = [result[1] for result in results]
     return results
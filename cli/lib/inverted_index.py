@@ -1,13 +1,45 @@
+import heapq
+import multiprocessing
 import pickle
 import os
 import math
+import sys
+from collections import deque
+from collections.abc import Iterable, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from itertools import batched, chain, islice
 
 from .text_processing import preprocess_text
-from .search_utils import PROJECT_ROOT
+from .search_utils import atomic_write, cache_path, diff_documents
 from collections import defaultdict, Counter
 
 BM25_K1 = 1.5
 BM25_B = 0.75
+# Movies tokenized per task of a sharded build. Starting a worker costs
+# about as much as tokenizing a shard (python, nltk and the stopwords are
+# loaded anew), so catalogs of a single shard are always built serially.
+BUILD_SHARD_SIZE = 5000
+DEFAULT_BUILD_WORKERS = os.cpu_count() or 1
+
+
+def _tokenize_shard(documents: list[tuple[int, str]]) -> tuple[dict, list]:
+    # Partial postings (token -> doc ids in document order) and the term
+    # frequencies and length of every document of one contiguous shard.
+    # Tokens are listed in order of first occurrence, never in set order, so
+    # the result doesn't depend on the hash seed of the process building it.
+    postings = defaultdict(list)
+    frequencies = []
+    for doc_id, text in documents:
+        tokens = preprocess_text(text)
+        counts = Counter(tokens)
+        for token in counts:
+            postings[token].append(doc_id)
+        frequencies.append((counts, len(tokens)))
+    return dict(postings), frequencies
+
+
+def _document_text(movie: dict) -> str:
+    return f"{movie['title']} {movie['description']}"
 
 
 class InvertedIndex:
@@ -16,46 +48,138 @@ class InvertedIndex:
         self.docmap = {}
         self.term_frequency = defaultdict(Counter)
         self.doc_lengths = {}
-        self.CACHE_DIR = os.path.join(PROJECT_ROOT, "cache")
+        self.CACHE_DIR = cache_path()
         self.CACHE_INDEX_PATH = os.path.join(self.CACHE_DIR, "index.pkl")
         self.CACHE_DOCMAP_PATH = os.path.join(self.CACHE_DIR, "docmap.pkl")
         self.CACHE_TERM_FREQ_PATH = os.path.join(self.CACHE_DIR, "term_frequencies.pkl")
         self.CACHE_DOC_LENGTHS_PATH = os.path.join(self.CACHE_DIR, "doc_lengths.pkl")
+        self._loaded_generation = None
+        self._reset_scoring_stats()
+
+    def _reset_scoring_stats(self) -> None:
+        # Corpus-level statistics are derived lazily and dropped whenever the
+        # index contents change (build/load)
+        self._avg_doc_length = None
+        self._bm25_idf_cache = {}
+        self._doc_positions = None
+
+    def __merge_shard(
+        self, movies: Sequence[dict], postings: dict, frequencies: list
+    ) -> None:
+        # Shards are merged in movie order, so every posting set and dict is
+        # filled in the same order as one pass over all movies would. Tokens
+        # are interned: equal tokens (of any shard) are one object, which is
+        # what makes the pickled caches byte-identical however many shards
+        # they were built from.
+        intern = sys.intern
+        for token, doc_ids in postings.items():
+            self.index[intern(token)].update(doc_ids)
+        for movie, (counts, length) in zip(movies, frequencies):
+            self.docmap[movie["id"]] = movie
+            self.term_frequency[movie["id"]].update(
+                {intern(token): count for token, count in counts.items()}
+            )
+            self.doc_lengths[movie["id"]] = length
 
-    def __add_document(self, doc_id: int, text: str) -> None:
-        tokenized_text = preprocess_text(text)
-        for token in set(tokenized_text):
-            self.index[token].add(doc_id)
-        self.term_frequency[doc_id].update(tokenized_text)
-        self.doc_lengths[doc_id] = len(tokenized_text)
+    def __add_documents(self, movies: Sequence[dict]) -> None:
+        documents = [(movie["id"], _document_text(movie)) for movie in movies]
+        self.__merge_shard(movies, *_tokenize_shard(documents))
+
+    def __remove_document(self, doc_id: int) -> None:
+        # The document's own term frequencies name every posting it is in
+        for token in self.term_frequency.pop(doc_id, ()):
+            postings = self.index.get(token)
+            if postings is None:
+                continue
+            postings.discard(doc_id)
+            if not postings:
+                del self.index[token]
+        self.doc_lengths.pop(doc_id, None)
 
     def __get_avg_doc_length(self) -> float:
-        if not self.doc_lengths or len(self.doc_lengths) == 0:
-            return 0.0
-        return sum(self.doc_lengths.values()) / len(self.doc_lengths)
+        if self._avg_doc_length is None:
+            if not self.doc_lengths or len(self.doc_lengths) == 0:
+                self._avg_doc_length = 0.0
+            else:
+                self._avg_doc_length = sum(self.doc_lengths.values()) / len(
+                    self.doc_lengths
+                )
+        return self._avg_doc_length
 
-    def build(self, movie_lib: list[dict]) -> None:
-        for movie in movie_lib:
-            movie_text = f"{movie['title']} {movie['description']}"
-            self.docmap[movie["id"]] = movie
-            self.__add_document(movie["id"], movie_text)
+    def __get_doc_positions(self) -> dict[int, int]:
+        if self._doc_positions is None:
+            self._doc_positions = {doc_id: i for i, doc_id in enumerate(self.docmap)}
+        return self._doc_positions
+
+    def build(self, movie_lib: Iterable[dict], workers: int = 1) -> None:
+        # The movies are read in contiguous shards, with more than one worker
+        # tokenized by a process pool, and merged back in order. The result is
+        # the same index whatever the number of workers. movie_lib may be a
+        # stream (see iter_movies): besides the docmap, at most two shards
+        # per worker are held at a time.
+        shards = batched(movie_lib, BUILD_SHARD_SIZE)
+        first_shards = list(islice(shards, 2))
+        shards = chain(first_shards, shards)
+        if workers <= 1 or len(first_shards) <= 1:
+            for shard in shards:
+                self.__add_documents(shard)
+        else:
+            # Spawned, a fork would copy the threads of a build running
+            # alongside (e.g. the chunk embeddings of HybridSearch) mid-state.
+            # Workers are started on demand, a short catalog only starts few.
+            with ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                pending = deque()
+                for shard in shards:
+                    # Only ids and texts are sent to the workers
+                    documents = [
+                        (movie["id"], _document_text(movie)) for movie in shard
+                    ]
+                    pending.append((shard, executor.submit(_tokenize_shard, documents)))
+                    if len(pending) >= 2 * workers:
+                        shard, future = pending.popleft()
+                        self.__merge_shard(shard, *future.result())
+                for shard, future in pending:
+                    self.__merge_shard(shard, *future.result())
+        self._reset_scoring_stats()
+
+    def update(self, movie_lib: list[dict]) -> dict[str, int]:
+        # Only added and changed movies are re-tokenized, the postings of
+        # changed and deleted ones are patched in place
+        incoming = {movie["id"]: movie for movie in movie_lib}
+        added, changed, deleted = diff_documents(self.docmap, incoming)
+        for doc_id in changed + deleted:
+            self.__remove_document(doc_id)
+        self.__add_documents([incoming[doc_id] for doc_id in changed + added])
+        # Everything follows movie_lib order again, so ties and the average
+        # document length come out exactly like a full build
+        self.docmap = incoming
+        self.doc_lengths = {doc_id: self.doc_lengths[doc_id] for doc_id in incoming}
+        self.term_frequency = defaultdict(
+            Counter, {doc_id: self.term_frequency[doc_id] for doc_id in incoming}
+        )
+        self._reset_scoring_stats()
+        return {"added": len(added), "updated": len(changed), "deleted": len(deleted)}
 
     def save(self) -> None:
         if not os.path.exists(self.CACHE_DIR):
             os.makedirs(self.CACHE_DIR, exist_ok=True)
 
-        with open(self.CACHE_INDEX_PATH, "wb") as file:
+        with atomic_write(self.CACHE_INDEX_PATH) as file:
             pickle.dump(self.index, file)
 
-        with open(self.CACHE_DOCMAP_PATH, "wb") as file:
+        with atomic_write(self.CACHE_DOCMAP_PATH) as file:
             pickle.dump(self.docmap, file)
 
-        with open(self.CACHE_TERM_FREQ_PATH, "wb") as file:
+        with atomic_write(self.CACHE_TERM_FREQ_PATH) as file:
             pickle.dump(self.term_frequency, file)
 
-        with open(self.CACHE_DOC_LENGTHS_PATH, "wb") as file:
+        with atomic_write(self.CACHE_DOC_LENGTHS_PATH) as file:
             pickle.dump(self.doc_lengths, file)
 
+        self._loaded_generation = self.get_cache_generation()
+
     def load(self) -> None:
         if not os.path.exists(self.CACHE_INDEX_PATH):
             raise FileNotFoundError(f"{self.CACHE_INDEX_PATH} not found")
@@ -69,6 +193,9 @@ class InvertedIndex:
         if not os.path.exists(self.CACHE_DOC_LENGTHS_PATH):
             raise FileNotFoundError(f"{self.CACHE_DOC_LENGTHS_PATH} not found")
 
+        # Taken before reading, so a concurrent rebuild triggers another reload
+        generation = self.get_cache_generation()
+
         with open(self.CACHE_INDEX_PATH, "rb") as file:
             self.index = pickle.load(file)
 
@@ -81,6 +208,33 @@ class InvertedIndex:
         with open(self.CACHE_DOC_LENGTHS_PATH, "rb") as file:
             self.doc_lengths = pickle.load(file)
 
+        self._loaded_generation = generation
+        self._reset_scoring_stats()
+
+    def _cache_paths(self) -> list[str]:
+        return [
+            self.CACHE_INDEX_PATH,
+            self.CACHE_DOCMAP_PATH,
+            self.CACHE_TERM_FREQ_PATH,
+            self.CACHE_DOC_LENGTHS_PATH,
+        ]
+
+    def get_cache_generation(self) -> tuple | None:
+        generation = []
+        for path in self._cache_paths():
+            if not os.path.exists(path):
+                return None
+            stat = os.stat(path)
+            generation.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(generation)
+
+    def reload_if_changed(self) -> bool:
+        generation = self.get_cache_generation()
+        if generation is None or generation == self._loaded_generation:
+            return False
+        self.load()
+        return True
+
     def get_documents(self, term: str) -> list[str]:
         query = term.lower()
         result = self.index.get(query, set())
@@ -113,13 +267,20 @@ class InvertedIndex:
         token = preprocess_text(term)
         if len(token) != 1:
             raise ValueError("term must be a single token")
-        total_doc_count = len(self.docmap)
-        term_match_doc_count = len(self.get_documents(token[0]))
-        return math.log(
-            (total_doc_count - term_match_doc_count + 0.5)
-            / (term_match_doc_count + 0.5)
-            + 1
-        )
+        return self._get_token_bm25_idf(token[0])
+
+    def _get_token_bm25_idf(self, token: str) -> float:
+        idf = self._bm25_idf_cache.get(token)
+        if idf is None:
+            total_doc_count = len(self.docmap)
+            term_match_doc_count = len(self.index.get(token, ()))
+            idf = math.log(
+                (total_doc_count - term_match_doc_count + 0.5)
+                / (term_match_doc_count + 0.5)
+                + 1
+            )
+            self._bm25_idf_cache[token] = idf
+        return idf
 
     def get_bm25_tf(
         self, doc_id: int, term: str, k1: float = BM25_K1, b: float = BM25_B
@@ -142,18 +303,103 @@ class InvertedIndex:
     def bm25(self, doc_id: int, term: str) -> float:
         return self.get_bm25_idf(term) * self.get_bm25_tf(doc_id, term)
 
-    def bm25_search(self, query: str, limit: int, debug: bool) -> list[(dict, float)]:
+    def bm25_search(
+        self,
+        query: str,
+        limit: int,
+        debug: bool = False,
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+    ) -> list[(dict, float)]:
         tokenized_query = preprocess_text(query)
         if debug:
             print(tokenized_query)
-        scores = defaultdict(int)
-        for doc in self.docmap:
-            for token in tokenized_query:
-                scores[doc] += self.bm25(doc, token)
-        top_sorted_scores = dict(
-            sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+        if not tokenized_query:
+            return []
+        scores = self._score_postings(tokenized_query, k1, b)
+        return [
+            (self.docmap[doc_id], score)
+            for doc_id, score in self._top_scores(scores, limit)
+        ]
+
+    def bm25_search_many(
+        self,
+        queries: list[str],
+        limit: int,
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+    ) -> list[list[(dict, float)]]:
+        tokenized_queries = [preprocess_text(query) for query in queries]
+        # The postings of a token are traversed and scored once for the whole
+        # batch, every query then only sums the contributions of its tokens
+        contributions = {
+            token: self._score_postings([token], k1, b)
+            for token in set().union(*tokenized_queries)
+        }
+        results = []
+        for tokens in tokenized_queries:
+            if not tokens:
+                results.append([])
+                continue
+            scores = defaultdict(float)
+            for token in tokens:
+                for doc_id, contribution in contributions[token].items():
+                    scores[doc_id] += contribution
+            results.append(
+                [
+                    (self.docmap[doc_id], score)
+                    for doc_id, score in self._top_scores(scores, limit)
+                ]
+            )
+        return results
+
+    def _score_postings(
+        self, tokens: list[str], k1: float = BM25_K1, b: float = BM25_B
+    ) -> dict[int, float]:
+        # Term-at-a-time: only documents in the posting list of a query token
+        # can get a non-zero BM25 contribution, so those are the only ones
+        # visited. Contributions are accumulated in query token order, which
+        # keeps the floating point sums identical to scoring doc by doc.
+        scores = defaultdict(float)
+        avg_doc_length = self.__get_avg_doc_length()
+        for token in tokens:
+            postings = self.index.get(token)
+            if not postings:
+                continue
+            idf = self._get_token_bm25_idf(token)
+            for doc_id in postings:
+                raw_tf = self.term_frequency[doc_id][token]
+                if avg_doc_length > 0:
+                    length_normalization = (
+                        1 - b + b * (self.doc_lengths[doc_id] / avg_doc_length)
+                    )
+                else:
+                    length_normalization = 1
+                saturated_tf = (raw_tf * (k1 + 1)) / (
+                    raw_tf + k1 * length_normalization
+                )
+                scores[doc_id] += idf * saturated_tf
+        return scores
+
+    def _top_scores(
+        self, scores: dict[int, float], limit: int
+    ) -> list[tuple[int, float]]:
+        if limit <= 0:
+            return []
+        # Ties are broken by docmap order, same as a stable sort over docmap
+        doc_positions = self.__get_doc_positions()
+        top = heapq.nlargest(
+            limit,
+            scores.items(),
+            key=lambda item: (item[1], -doc_positions[item[0]]),
         )
-        result = []
-        for id, score in top_sorted_scores.items():
-            result.append((self.docmap[id], score))
-        return result
+        if len(top) < limit:
+            # Documents without any matching token still rank (with a zero
+            # score) after every match, in docmap order
+            for doc_id in self.docmap:
+                if doc_id in scores:
+                    continue
+                top.append((doc_id, 0.0))
+                if len(top) >= limit:
+                    break
+        return top
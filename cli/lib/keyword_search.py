@@ -1,20 +1,52 @@
+import os
+from collections.abc import Iterable
+
 from .text_processing import preprocess_text
-from lib.search_utils import load_movies
-from .inverted_index import InvertedIndex, BM25_K1, BM25_B
+from lib.search_utils import iter_movies, load_movies
+from .inverted_index import InvertedIndex, BM25_K1, BM25_B, DEFAULT_BUILD_WORKERS
+from .compact_index import CompactIndex, load_compact_index
 
 DEFAULT_SEARCH_LIMIT = 5
 
 
-def build_command() -> None:
-    movies = load_movies()
+def build_command(
+    workers: int = DEFAULT_BUILD_WORKERS, movies: Iterable[dict] | None = None
+) -> None:
     inverted_index = InvertedIndex()
-    inverted_index.build(movies)
+    # Streamed from the catalog unless the movies are already loaded
+    inverted_index.build(iter_movies() if movies is None else movies, workers)
+    # Kept as the base update_command patches
     inverted_index.save()
+    compact_index = CompactIndex()
+    compact_index.build(inverted_index)
+    compact_index.save()
 
 
-def search_command(query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
+def update_command() -> dict[str, int]:
+    return update_index(load_movies())
+
+
+def update_index(movies: list[dict]) -> dict[str, int]:
+    # Patches the pickle base with the changes in movies and re-lays out the
+    # compact index from it, without a base everything is built
     inverted_index = InvertedIndex()
+    if not os.path.exists(inverted_index.CACHE_INDEX_PATH):
+        build_command(movies=movies)
+        return {"added": len(movies), "updated": 0, "deleted": 0}
     inverted_index.load()
+    stats = inverted_index.update(movies)
+    if any(stats.values()):
+        inverted_index.save()
+        # The compact index is re-laid out from the patched postings, nothing
+        # is tokenized again
+        compact_index = CompactIndex()
+        compact_index.build(inverted_index)
+        compact_index.save()
+    return stats
+
+
+def search_command(query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
+    inverted_index = load_compact_index()
     seen, results = set(), []
     query_tokens = preprocess_text(query)
 
@@ -32,38 +64,32 @@ def search_command(query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
 
 
 def tf_command(doc_id: int, term: str) -> int:
-    inverted_index = InvertedIndex()
-    inverted_index.load()
+    inverted_index = load_compact_index()
     return inverted_index.get_tf(doc_id, term)
 
 
 def idf_command(term: str) -> float:
-    inverted_index = InvertedIndex()
-    inverted_index.load()
+    inverted_index = load_compact_index()
     return inverted_index.get_idf(term)
 
 
 def tfidf_command(doc_id: int, term: str) -> float:
-    inverted_index = InvertedIndex()
-    inverted_index.load()
+    inverted_index = load_compact_index()
     return inverted_index.get_tfidf(doc_id, term)
 
 
 def bm25_idf_command(term: str) -> float:
-    inverted_index = InvertedIndex()
-    inverted_index.load()
+    inverted_index = load_compact_index()
     return inverted_index.get_bm25_idf(term)
 
 
 def bm25_tf_command(doc_id: int, term: str, k1: float = BM25_K1, b: float = BM25_B) -> float:
-    inverted_index = InvertedIndex()
-    inverted_index.load()
+    inverted_index = load_compact_index()
     return inverted_index.get_bm25_tf(doc_id, term, k1, b)
 
 
 def bm25_search_command(query: str, limit) -> list[dict, float]:
-    inverted_index = InvertedIndex()
-    inverted_index.load()
+    inverted_index = load_compact_index()
     return inverted_index.bm25_search(query, limit)
 
 
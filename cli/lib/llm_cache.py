@@ -0,0 +1,112 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from .search_utils import cache_path
+
+LLM_CACHE_FILE = "llm_responses.sqlite3"
+# Responses older than this are treated as missing and dropped
+DEFAULT_TTL_SECONDS = 30 * 24 * 60 * 60
+# Least recently used responses are evicted beyond this many entries
+DEFAULT_MAX_ENTRIES = 10000
+
+
+def prompt_key(model: str, method: str, prompt: str) -> str:
+    return hashlib.blake2b(
+        "\0".join([model, method, prompt]).encode("utf-8"), digest_size=16
+    ).hexdigest()
+
+
+class LLMResponseCache:
+    # Text responses of GeminiClient keyed by model, method and a hash of the
+    # prompt. One SQLite connection is shared by every thread using the
+    # client, behind a lock.
+    def __init__(
+        self,
+        path: str | None = None,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ) -> None:
+        # Resolved on construction, so set_cache_dir covers it like the
+        # index and embedding caches
+        if path is None:
+            path = cache_path(LLM_CACHE_FILE)
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    method TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )"""
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+            )
+
+    def get(self, model: str, method: str, prompt: str) -> str | None:
+        key = prompt_key(model, method, prompt)
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._connection.execute(
+                        "DELETE FROM responses WHERE key = ?", (key,)
+                    )
+                self.misses += 1
+                return None
+            self._connection.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+            return row[0]
+
+    def put(self, model: str, method: str, prompt: str, response: str) -> None:
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (prompt_key(model, method, prompt), model, method, response, now, now),
+            )
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        self._connection.execute(
+            "DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,)
+        )
+        self._connection.execute(
+            """DELETE FROM responses WHERE key IN (
+                SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?
+            )""",
+            (self.max_entries,),
+        )
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            size = self._connection.execute(
+                "SELECT COUNT(*) FROM responses"
+            ).fetchone()[0]
+            return {"size": size, "hits": self.hits, "misses": self.misses}
+
+    def clear(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM responses")
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
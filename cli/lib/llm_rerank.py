@@ -0,0 +1,95 @@
+import asyncio
+import random
+import time
+
+from .tracing import count
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_TIMEOUT = 20.0
+DEFAULT_RETRIES = 2
+# Seconds before the first retry, doubled (with jitter) on every further one
+DEFAULT_BACKOFF = 0.5
+
+
+class IndividualReranker:
+    # Scores every result with one LLM call through a single shared
+    # GeminiClient, at most concurrency calls in flight. A call is retried
+    # after a timeout or error; a result whose calls all fail keeps its RRF
+    # position instead of failing the whole rerank.
+    def __init__(
+        self,
+        gemini_client,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        timeout: float = DEFAULT_TIMEOUT,
+        retries: int = DEFAULT_RETRIES,
+        backoff: float = DEFAULT_BACKOFF,
+    ) -> None:
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        self.gemini_client = gemini_client
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.last_rerank_stats = None
+
+    async def _score(
+        self, semaphore: asyncio.Semaphore, query: str, movie: dict, stats: dict
+    ) -> float | None:
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                stats["retries"] += 1
+                # Slept outside the semaphore, so waiting doesn't hold a slot
+                delay = self.backoff * 2 ** (attempt - 1)
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+            try:
+                async with semaphore:
+                    return await asyncio.wait_for(
+                        self.gemini_client.individual_rerank_async(query, movie),
+                        self.timeout,
+                    )
+            except asyncio.TimeoutError:
+                stats["timeouts"] += 1
+            except Exception as error:
+                # API errors and unparsable scores alike
+                stats["errors"] += 1
+                stats["last_error"] = repr(error)
+        return None
+
+    async def score_all(self, query: str, movies: list[dict]) -> list[float | None]:
+        self.last_rerank_stats = stats = {
+            "calls": len(movies),
+            "failed": 0,
+            "retries": 0,
+            "timeouts": 0,
+            "errors": 0,
+            "last_error": None,
+        }
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        scores = await asyncio.gather(
+            *(self._score(semaphore, query, movie, stats) for movie in movies)
+        )
+        stats["failed"] = sum(score is None for score in scores)
+        stats["seconds"] = time.perf_counter() - start
+        count("llm_rerank.failed", stats["failed"])
+        count("llm_rerank.retries", stats["retries"])
+        return scores
+
+    def rerank(self, query: str, results: list[tuple[int, dict]]) -> list:
+        # results are (doc_id, hit) pairs in RRF order; every hit gets a
+        # rerank_score, None when it couldn't be scored
+        scores = asyncio.run(
+            self.score_all(query, [hit["document"] for _, hit in results])
+        )
+        for (_, hit), score in zip(results, scores):
+            hit["rerank_score"] = score
+        # Scored results are sorted into the positions of the scored ones,
+        # failed ones stay where RRF put them. Ties keep RRF order.
+        scored = [i for i, score in enumerate(scores) if score is not None]
+        reranked = list(results)
+        for position, i in zip(
+            scored, sorted(scored, key=lambda i: scores[i], reverse=True)
+        ):
+            reranked[position] = results[i]
+        return reranked
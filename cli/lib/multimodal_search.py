@@ -1,10 +1,13 @@
-from PIL import Image
-from sentence_transformers import SentenceTransformer
-
 class MultimodalSearch():
     def __init__(self, model_name="clip-ViT-B-32"):
+        # Imported on first use, only the commands embedding images pay for
+        # loading torch
+        from sentence_transformers import SentenceTransformer
+
         self.model = SentenceTransformer(model_name)
     def embed_image(self, image_path: str):
+        from PIL import Image
+
         loaded_image = Image.open(image_path)
         embed = self.model.encode([loaded_image])
         return embed[0]
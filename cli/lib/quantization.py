@@ -0,0 +1,92 @@
+import os
+
+import numpy as np
+
+from .search_utils import atomic_write
+
+QUANTIZATION_MODES = ["float16", "int8"]
+# Rows converted back to float32 at a time, bounds the temporary memory used
+# while scoring or quantizing
+BLOCK_ROWS = 16384
+
+
+class QuantizedEmbeddings:
+    # Compressed copy of an embedding matrix, used to score every row cheaply.
+    # float16 halves the memory, int8 quarters it, storing each row as int8
+    # values plus one float32 scale (row = values * scale).
+    def __init__(self, mode: str) -> None:
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"unknown quantization mode '{mode}'")
+        self.mode = mode
+        self.vectors = None
+        self.scales = None
+
+    def _paths(self, embeddings_path: str) -> tuple[str, str]:
+        base, _ = os.path.splitext(embeddings_path)
+        return f"{base}.{self.mode}.npy", f"{base}.{self.mode}.scales.npy"
+
+    def quantize(self, embeddings: np.ndarray) -> None:
+        if self.mode == "float16":
+            self.vectors = np.asarray(embeddings, dtype=np.float16)
+            self.scales = None
+            return
+
+        self.vectors = np.empty(embeddings.shape, dtype=np.int8)
+        self.scales = np.empty(len(embeddings), dtype=np.float32)
+        for start in range(0, len(embeddings), BLOCK_ROWS):
+            block = np.asarray(embeddings[start : start + BLOCK_ROWS], np.float32)
+            scales = np.abs(block).max(axis=1) / 127
+            scales[scales == 0] = 1.0
+            self.vectors[start : start + BLOCK_ROWS] = np.round(
+                block / scales[:, None]
+            )
+            self.scales[start : start + BLOCK_ROWS] = scales
+
+    def save(self, embeddings_path: str) -> None:
+        vectors_path, scales_path = self._paths(embeddings_path)
+        if self.scales is not None:
+            with atomic_write(scales_path) as file:
+                np.save(file, self.scales)
+        with atomic_write(vectors_path) as file:
+            np.save(file, self.vectors)
+
+    def load(self, embeddings_path: str) -> None:
+        vectors_path, scales_path = self._paths(embeddings_path)
+        if not os.path.exists(vectors_path):
+            raise FileNotFoundError(f"{vectors_path} not found")
+        self.vectors = np.load(vectors_path)
+        self.scales = None
+        if self.mode == "int8":
+            if not os.path.exists(scales_path):
+                raise FileNotFoundError(f"{scales_path} not found")
+            self.scales = np.load(scales_path)
+
+    def load_or_quantize(self, embeddings_path: str, embeddings: np.ndarray) -> None:
+        vectors_path, _ = self._paths(embeddings_path)
+        if (
+            os.path.exists(vectors_path)
+            and os.path.exists(embeddings_path)
+            and os.path.getmtime(vectors_path) >= os.path.getmtime(embeddings_path)
+        ):
+            self.load(embeddings_path)
+            if len(self.vectors) == len(embeddings):
+                return
+        self.quantize(embeddings)
+        self.save(embeddings_path)
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        # One query, or a (n_queries, dim) batch scored as (rows, n_queries)
+        query = np.asarray(query, dtype=np.float32)
+        scores = np.empty((len(self.vectors),) + query.shape[:-1], dtype=np.float32)
+        for start in range(0, len(self.vectors), BLOCK_ROWS):
+            block = self.vectors[start : start + BLOCK_ROWS].astype(np.float32)
+            scores[start : start + BLOCK_ROWS] = block @ query.T
+        if self.scales is not None:
+            scores *= self.scales.reshape((-1,) + (1,) * (query.ndim - 1))
+        return scores
+
+    def nbytes(self) -> int:
+        total = self.vectors.nbytes
+        if self.scales is not None:
+            total += self.scales.nbytes
+        return total
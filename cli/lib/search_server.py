@@ -0,0 +1,294 @@
+import json
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from .cross_encoder_rerank import get_cross_encoder_reranker
+from .embedding_store import QueryEmbeddingCache
+from .hybrid_search import DEFAULT_K, CandidateDepth, HybridSearch
+from .search_utils import load_movies
+from .text_processing import get_analyzer
+from .tracing import enable_tracing, metrics_registry, trace, tracing_enabled
+
+if TYPE_CHECKING:
+    from .gemini_integration import GeminiClient
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+DEFAULT_LIMIT = 5
+# RRF candidates reranked per returned result, as rrf_search_command does
+RERANK_FACTOR = 5
+RAG_MODES = ["rag", "summarize", "citations", "question"]
+
+
+class BadRequest(ValueError):
+    # A request the client has to fix, answered with 400. Any other error,
+    # ValueError included, is a server fault and answered with a logged 500.
+    pass
+
+
+class SearchService:
+    # Every model and index is loaded once and shared by all request threads.
+    # The Gemini client is only created by the first /rag request, so the
+    # server runs without an API key as long as /rag isn't used.
+    def __init__(self, persist_query_cache: bool = False) -> None:
+        start = time.perf_counter()
+        self.movies = load_movies()
+        self.hybrid_search = HybridSearch(self.movies)
+        self.semantic_search = self.hybrid_search.semantic_search
+        if persist_query_cache:
+            query_cache = self.semantic_search.query_cache
+            self.semantic_search.query_cache = QueryEmbeddingCache(
+                query_cache.model_name, query_cache.max_size, persist=True
+            )
+        # Movie level embeddings for /search/semantic, same model instance
+        self.semantic_search.load_or_create_embeddings(self.movies)
+        # The stemmer and stopwords are loaded on first use, not by a request
+        get_analyzer()
+        self._gemini_client = None
+        self._gemini_lock = threading.Lock()
+        self.warmup_seconds = time.perf_counter() - start
+
+    def gemini_client(self) -> "GeminiClient":
+        with self._gemini_lock:
+            if self._gemini_client is None:
+                from .gemini_integration import GeminiClient
+
+                self._gemini_client = GeminiClient()
+            return self._gemini_client
+
+    def metrics(self, params: dict) -> dict:
+        # Stage timings and counters summed over every traced request
+        return {"tracing": tracing_enabled()} | metrics_registry.snapshot()
+
+    def health(self, params: dict) -> dict:
+        return {
+            "status": "ok",
+            "movies": len(self.movies),
+            "warmup_seconds": round(self.warmup_seconds, 3),
+            "query_cache": self.semantic_search.query_cache.stats(),
+        }
+
+    def bm25(self, params: dict) -> dict:
+        query, limit = _get_query(params), _get_int(params, "limit", DEFAULT_LIMIT)
+        results = self.hybrid_search.bm25_search(query, limit)
+        return {
+            "query": query,
+            "results": [
+                _format_movie(movie) | {"score": score} for movie, score in results
+            ],
+        }
+
+    def semantic(self, params: dict) -> dict:
+        query, limit = _get_query(params), _get_int(params, "limit", DEFAULT_LIMIT)
+        hits = self.semantic_search.search(query, limit)
+        return {"query": query, "results": hits}
+
+    def rrf(self, params: dict) -> dict:
+        query, limit = _get_query(params), _get_int(params, "limit", DEFAULT_LIMIT)
+        k = _get_int(params, "k", DEFAULT_K)
+        depth = _get_depth(params)
+        rerank = params.get("rerank")
+        if rerank not in (None, "cross_encoder"):
+            raise BadRequest("rerank must be cross_encoder")
+        if rerank is None:
+            results = self.hybrid_search.rrf_search(query, k, limit, depth=depth)
+        else:
+            # The reranker is loaded by the first request using it, and then
+            # kept with its score cache
+            results = self.hybrid_search.rrf_search(
+                query, k, limit * RERANK_FACTOR, depth=depth
+            )
+            results = get_cross_encoder_reranker().rerank(query, results)[:limit]
+        return {
+            "query": query,
+            "results": [
+                _format_movie(result["document"])
+                | {
+                    "rrf_score": result["rrf_score"],
+                    "bm25_rank": result["bm25_rank"],
+                    "semantic_rank": result["semantic_rank"],
+                }
+                | (
+                    {"cross_encoder_score": result["cross_encoder_score"]}
+                    if "cross_encoder_score" in result
+                    else {}
+                )
+                for _, result in results
+            ],
+        }
+
+    def weighted(self, params: dict) -> dict:
+        query, limit = _get_query(params), _get_int(params, "limit", DEFAULT_LIMIT)
+        alpha = _get_float(params, "alpha", 0.5)
+        depth = _get_depth(params)
+        results = self.hybrid_search.weighted_search(query, alpha, limit, depth)
+        return {
+            "query": query,
+            "results": [
+                _format_movie(result["document"])
+                | {
+                    "hybrid_score": result["hybrid_score"],
+                    "keyword_score": result["keyword_score"],
+                    "semantic_score": result["semantic_score"],
+                }
+                for result in results
+            ],
+        }
+
+    def rag(self, params: dict) -> dict:
+        query, limit = _get_query(params), _get_int(params, "limit", DEFAULT_LIMIT)
+        mode = params.get("mode", "rag")
+        if mode not in RAG_MODES:
+            raise BadRequest(f"mode must be one of {', '.join(RAG_MODES)}")
+        results = [hit for _, hit in self.hybrid_search.rrf_search(query, limit=limit)]
+        generate = getattr(self.gemini_client(), mode)
+        return {
+            "query": query,
+            "mode": mode,
+            "results": [_format_movie(result["document"]) for result in results],
+            "response": generate(query, results),
+        }
+
+
+ROUTES = {
+    "/health": SearchService.health,
+    "/metrics": SearchService.metrics,
+    "/search/bm25": SearchService.bm25,
+    "/search/semantic": SearchService.semantic,
+    "/search/rrf": SearchService.rrf,
+    "/search/weighted": SearchService.weighted,
+    "/rag": SearchService.rag,
+}
+
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    # Parameters come from the query string, a POSTed JSON object overrides them
+    service: SearchService = None
+
+    def do_GET(self) -> None:
+        self._handle({})
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError as error:
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": f"invalid JSON: {error}"})
+            return
+        if not isinstance(body, dict):
+            self._send_json(
+                HTTPStatus.BAD_REQUEST, {"error": "body must be a JSON object"}
+            )
+            return
+        self._handle(body)
+
+    def _handle(self, body: dict) -> None:
+        url = urlparse(self.path)
+        route = ROUTES.get(url.path.rstrip("/") or "/")
+        if route is None:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": f"unknown path {url.path}"})
+            return
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        params.update(body)
+        try:
+            # With tracing on, every response carries its own stage timings
+            with trace(url.path) as current:
+                response = route(self.service, params)
+            if current is not None and route is not SearchService.metrics:
+                response["trace"] = current.to_dict()
+        except BadRequest as error:
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": str(error)})
+            return
+        except Exception as error:
+            self.log_error("%s failed: %r", url.path, error)
+            self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(error)})
+            return
+        self._send_json(HTTPStatus.OK, response)
+
+    def _send_json(self, status: HTTPStatus, payload: dict) -> None:
+        body = json.dumps(payload, default=_json_default).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _json_default(value: object) -> object:
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _format_movie(movie: dict) -> dict:
+    return {
+        "id": movie["id"],
+        "title": movie["title"],
+        "description": movie["description"],
+    }
+
+
+def _get_query(params: dict) -> str:
+    query = params.get("q") or params.get("query")
+    if not query or not str(query).strip():
+        raise BadRequest("missing query parameter 'q'")
+    return str(query)
+
+
+def _get_int(params: dict, name: str, default: int) -> int:
+    try:
+        value = int(params.get(name, default))
+    except (TypeError, ValueError):
+        raise BadRequest(f"'{name}' must be an integer")
+    if value < 1:
+        raise BadRequest(f"'{name}' must be at least 1")
+    return value
+
+
+def _get_float(params: dict, name: str, default: float) -> float:
+    try:
+        return float(params.get(name, default))
+    except (TypeError, ValueError):
+        raise BadRequest(f"'{name}' must be a number")
+
+
+def _get_depth(params: dict) -> CandidateDepth | None:
+    if "depth_mode" not in params and "depth" not in params:
+        return None
+    depth = params.get("depth")
+    depth = None if depth is None else _get_int(params, "depth", 1)
+    try:
+        return CandidateDepth(params.get("depth_mode", "proportional"), depth)
+    except ValueError as error:
+        raise BadRequest(str(error)) from error
+
+
+def serve_command(
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    persist_query_cache: bool = False,
+    tracing: bool = False,
+) -> None:
+    enable_tracing(tracing)
+    print("Loading models and indexes...")
+    service = SearchService(persist_query_cache)
+    print(f"Ready in {service.warmup_seconds:.2f}s")
+    handler = type("Handler", (SearchRequestHandler,), {"service": service})
+    # One thread per request: model inference and the numpy scoring release
+    # the GIL, so requests are served concurrently
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    print(f"Serving on http://{host}:{server.server_port}")
+    print(f"Endpoints: {', '.join(ROUTES)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
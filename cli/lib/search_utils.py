@@ -1,21 +1,164 @@
+import hashlib
 import json
 import os
+import re
+import tempfile
+from collections.abc import Iterator, Mapping
+from contextlib import contextmanager
+
+import numpy as np
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
 DATA_DIR = os.path.join(PROJECT_ROOT, "data")
 MOVIES_PATH = os.path.join(DATA_DIR, "movies.json")
+# One movie per line, read instead of MOVIES_PATH when it exists
+MOVIES_JSONL_PATH = os.path.join(DATA_DIR, "movies.jsonl")
 STOPWORDS_PATH = os.path.join(DATA_DIR, "stopwords.txt")
 GOLDEN_DATASET_PATH = os.path.join(DATA_DIR, "golden_dataset.json")
+CACHE_DIR = os.path.join(PROJECT_ROOT, "cache")
+
+# Per-row cache metadata: the id of the document a row was computed from and
+# the content_hash of its text. A row with an empty hash is a tombstone.
+ROW_METADATA_DTYPE = np.dtype([("id", np.int64), ("hash", "S32")])
+TOMBSTONE = b""
+# Characters read at a time by iter_movies from a JSON catalog
+READ_CHUNK_SIZE = 1 << 20
+
+
+def cache_path(*parts: str) -> str:
+    # CACHE_DIR is read on every call, so set_cache_dir redirects the index
+    # and embedding caches of every instance created afterwards
+    return os.path.join(CACHE_DIR, *parts)
+
+
+def set_cache_dir(path: str) -> None:
+    global CACHE_DIR
+    CACHE_DIR = path
+
+
+def iter_movies(path: str | None = None) -> Iterator[dict]:
+    # Yields the movies of a catalog one at a time, without ever parsing (or
+    # even reading) the whole file at once. JSON Lines files (*.jsonl) hold
+    # one movie per line; JSON ones an array of movies, either at the top
+    # level or as the "movies" key of an object, parsed incrementally.
+    if path is None:
+        path = MOVIES_JSONL_PATH if os.path.exists(MOVIES_JSONL_PATH) else MOVIES_PATH
+    # json.load shares the key strings of all the objects it parses, decoding
+    # movie by movie would give every movie its own copies
+    keys = {}
+    decoder = json.JSONDecoder(
+        object_pairs_hook=lambda pairs: {
+            keys.setdefault(key, key): value for key, value in pairs
+        }
+    )
+    with open(path, "r") as file:
+        if path.endswith(".jsonl"):
+            for line in file:
+                if line.strip():
+                    yield decoder.decode(line)
+        else:
+            yield from _JSONArrayReader(file, decoder).items("movies")
+
+
+class _JSONArrayReader:
+    # Reads the elements of a JSON array from a file chunk by chunk: every
+    # element is decoded with raw_decode as soon as it is complete in the
+    # buffer, so only one chunk (or one element, if bigger) is held at a time
+    _WHITESPACE = re.compile(r"[ \t\n\r]*")
+    # Characters that can continue a number: raw_decode stops a number cut
+    # short by the end of the buffer ("1." or "2.5e") before them
+    _NUMBER_CONTINUATION = frozenset("0123456789.eE+-")
+
+    def __init__(
+        self,
+        file,
+        decoder: json.JSONDecoder,
+        chunk_size: int = READ_CHUNK_SIZE,
+    ) -> None:
+        self.file = file
+        self.decoder = decoder
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+
+    def _read(self) -> bool:
+        chunk = "" if self.eof else self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # Consumed input is only dropped here, not after every element
+        self.buffer = self.buffer[self.position :] + chunk
+        self.position = 0
+        return True
+
+    def _peek(self) -> str:
+        # Next non-whitespace character, "" at the end of the file
+        while True:
+            self.position = self._WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._read():
+                return ""
+
+    def _expect(self, character: str) -> None:
+        if self._peek() != character:
+            raise json.JSONDecodeError(
+                f"Expecting '{character}'", self.buffer, self.position
+            )
+        self.position += 1
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                # A value ending at the end of the buffer, or followed by what
+                # could still be part of a number, may be cut short unless the
+                # file has been read whole. In valid JSON no complete value is
+                # ever followed by one of those characters.
+                if self.eof or (
+                    end < len(self.buffer)
+                    and self.buffer[end] not in self._NUMBER_CONTINUATION
+                ):
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._read()
+
+    def items(self, key: str) -> Iterator:
+        # Elements of the top-level array, or of the array under key when the
+        # top-level value is an object (its other values are skipped)
+        if self._peek() == "{":
+            self.position += 1
+            while True:
+                name = self._value()
+                self._expect(":")
+                if name == key:
+                    break
+                self._value()
+                self._expect(",")
+        self._expect("[")
+        if self._peek() == "]":
+            return
+        while True:
+            yield self._value()
+            if self._peek() == "]":
+                return
+            self._expect(",")
 
 
 def load_movies() -> list[dict]:
-    with open(MOVIES_PATH, "r") as file:
-        data = json.load(file)
-    return data["movies"]
+    return list(iter_movies())
 
 
 def load_stopwords() -> list[str]:
-    with open(STOPWORDS_PATH, "r") as file:
+    # SEARCH_STOPWORDS_PATH overrides the stopword list, also in the worker
+    # processes of a parallel index build, which inherit the environment
+    path = os.environ.get("SEARCH_STOPWORDS_PATH", STOPWORDS_PATH)
+    with open(path, "r") as file:
         data = file.read()
     return data.split("\n")
 
@@ -28,4 +171,66 @@ def load_golden_dataset() -> list[dict]:
 
 def load_image(path) -> str:
     with open(path, "rb") as file:
-        return file.read()
\ No newline at end of file
+        return file.read()
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = "wb"):
+    # Write to a temp file in the same directory and rename it over the target,
+    # so readers never see a partially written cache file
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory, prefix=".", suffix=f".{os.path.basename(path)}.tmp"
+    )
+    try:
+        with os.fdopen(fd, mode) as file:
+            yield file
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def top_k_indices(scores: np.ndarray, limit: int) -> np.ndarray:
+    if limit <= 0 or scores.size == 0:
+        return np.empty(0, dtype=np.intp)
+    if limit < scores.size:
+        # argpartition picks an arbitrary subset of the scores tied at the
+        # cut-off, so those are taken in position order instead
+        threshold = -np.partition(-scores, limit - 1)[limit - 1]
+        above = np.flatnonzero(scores > threshold)
+        tied = np.flatnonzero(scores == threshold)[: limit - len(above)]
+        candidates = np.concatenate((above, tied))
+    else:
+        candidates = np.arange(scores.size)
+    # Highest score first, ties broken by position like a stable sort
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order]
+
+
+def content_hash(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest().encode()
+
+
+def build_row_metadata(doc_ids: list[int], hashes: list[bytes]) -> np.ndarray:
+    metadata = np.empty(len(doc_ids), dtype=ROW_METADATA_DTYPE)
+    metadata["id"] = doc_ids
+    metadata["hash"] = hashes
+    return metadata
+
+
+def diff_documents(
+    indexed: Mapping, incoming: Mapping
+) -> tuple[list[int], list[int], list[int]]:
+    # Both map doc id -> content (or its hash). Returns the added, changed and
+    # deleted ids, the first two in incoming order.
+    added, changed = [], []
+    for doc_id, content in incoming.items():
+        if doc_id not in indexed:
+            added.append(doc_id)
+        elif indexed[doc_id] != content:
+            changed.append(doc_id)
+    deleted = [doc_id for doc_id in indexed if doc_id not in incoming]
+    return added, changed, deleted
@@ -1,76 +1,317 @@
 import numpy as np
 import os
+from collections.abc import Iterable, Iterator, Sequence
+from itertools import batched
 
+from .search_utils import (
+    TOMBSTONE,
+    atomic_write,
+    build_row_metadata,
+    cache_path,
+    content_hash,
+    diff_documents,
+    load_movies,
+    top_k_indices,
+)
+from .quantization import QuantizedEmbeddings
+from .embedding_store import QUERY_CACHE_SIZE, EmbeddingStore, QueryEmbeddingCache
+from .tracing import count, span
 
-from sentence_transformers import SentenceTransformer
-from .search_utils import PROJECT_ROOT, load_movies
+
+NORM_CHECK_ROWS = 64
+# With quantization, the quantized scores shortlist limit * RESCORE_FACTOR
+# rows, which are then re-scored against the float32 embeddings
+RESCORE_FACTOR = 4
+# An update compacts the embedding caches once more than this fraction of
+# their rows are tombstones
+COMPACTION_THRESHOLD = 0.2
+# Queries of a batch scored per matrix product, bounds the (queries x rows)
+# score matrix held at once
+QUERY_BLOCK_ROWS = 32
+# Documents read and embedded at a time by a build, bounds the texts held
+# at once when the documents are streamed
+BUILD_BATCH_SIZE = 1024
 
 
 class SemanticSearch:
-    def __init__(self, model_name="all-MiniLM-L6-v2") -> None:
-        self.model = SentenceTransformer(model_name)
+    def __init__(
+        self,
+        model_name="all-MiniLM-L6-v2",
+        mmap_mode: str | None = None,
+        quantization: str | None = None,
+        rescore_factor: int = RESCORE_FACTOR,
+        query_cache_size: int = QUERY_CACHE_SIZE,
+        persist_query_cache: bool = False,
+        model=None,
+    ) -> None:
+        # model replaces the SentenceTransformer loaded by model_name, anything
+        # with its encode and get_sentence_embedding_dimension works
+        if model is None:
+            # Imported on first use: sentence_transformers pulls in torch,
+            # which dominates the startup of every command importing this
+            # module
+            from sentence_transformers import SentenceTransformer
+
+            model = SentenceTransformer(model_name)
+        self.model = model
+        self.embedding_store = EmbeddingStore(model_name)
+        # Repeated queries skip the model, see generate_embedding
+        self.query_cache = QueryEmbeddingCache(
+            model_name, query_cache_size, persist_query_cache
+        )
+        # With mmap_mode="r" the embedding caches are memory mapped instead of
+        # read, so every process searching them shares one page cache copy
+        self.mmap_mode = mmap_mode
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
         self.embeddings = None
+        self.quantized_embeddings = None
+        # Movie id and text hash of every embedding row, see ROW_METADATA_DTYPE
+        self.row_metadata = None
+        self.deleted_rows = None
         self.documents = None
         self.document_map = {}
-        self.CACHE_DIR = os.path.join(PROJECT_ROOT, "cache")
+        self.CACHE_DIR = cache_path()
         self.CACHE_MOVIE_EMBEDDINGS = os.path.join(
             self.CACHE_DIR, "movie_embeddings.npy"
         )
+        self.CACHE_MOVIE_METADATA = os.path.join(self.CACHE_DIR, "movie_metadata.npy")
 
-    def _initialize_docs(self, documents: list[dict]) -> list[str]:
-        self.documents = documents
-        self.document_map = {doc["id"]: doc for doc in documents}
+    def _initialize_docs(self, documents: Sequence[dict]) -> list[str]:
+        self.documents = []
+        self.document_map = {}
+        return self._add_docs(documents)
+
+    def _add_docs(self, documents: Sequence[dict]) -> list[str]:
+        self.documents.extend(documents)
+        self.document_map.update((doc["id"], doc) for doc in documents)
         return [f"{d['title']}: {d['description']}" for d in documents]
 
+    def _initialize_rows(self, row_metadata: np.ndarray) -> None:
+        self.row_metadata = row_metadata
+        self.deleted_rows = np.flatnonzero(row_metadata["hash"] == TOMBSTONE)
+
     def _save(self) -> None:
         if not os.path.exists(self.CACHE_DIR):
             os.makedirs(self.CACHE_DIR, exist_ok=True)
 
-        with open(self.CACHE_MOVIE_EMBEDDINGS, "wb") as file:
+        with atomic_write(self.CACHE_MOVIE_METADATA) as file:
+            np.save(file, self.row_metadata)
+        with atomic_write(self.CACHE_MOVIE_EMBEDDINGS) as file:
             np.save(file, self.embeddings)
 
     def _load(self) -> None:
         if not os.path.exists(self.CACHE_MOVIE_EMBEDDINGS):
             raise FileNotFoundError(f"{self.CACHE_MOVIE_EMBEDDINGS} not found")
 
-        with open(self.CACHE_MOVIE_EMBEDDINGS, "rb") as file:
-            self.embeddings = np.load(file)
+        self.embeddings = load_normalized_embeddings(
+            self.CACHE_MOVIE_EMBEDDINGS, self._embeddings_mmap_mode()
+        )
+        self.row_metadata = None
+        if os.path.exists(self.CACHE_MOVIE_METADATA):
+            row_metadata = np.load(self.CACHE_MOVIE_METADATA)
+            # A metadata file not matching the embeddings is left over from an
+            # interrupted save
+            if len(row_metadata) == len(self.embeddings):
+                self._initialize_rows(row_metadata)
+        self.quantized_embeddings = self._load_or_quantize(
+            self.CACHE_MOVIE_EMBEDDINGS, self.embeddings
+        )
 
-    def build_embeddings(self, documents: list[dict]) -> np.ndarray:
-        doc_list = self._initialize_docs(documents)
-        self.embeddings = self.model.encode(doc_list, show_progress_bar=True)
+    def _embeddings_mmap_mode(self) -> str | None:
+        # With quantization the float32 matrix is only read to re-score a
+        # shortlist, so it is always left on disk
+        if self.quantization:
+            return self.mmap_mode or "r"
+        return self.mmap_mode
+
+    def _load_or_quantize(
+        self, embeddings_path: str, embeddings: np.ndarray
+    ) -> QuantizedEmbeddings | None:
+        if not self.quantization:
+            return None
+        quantized = QuantizedEmbeddings(self.quantization)
+        quantized.load_or_quantize(embeddings_path, embeddings)
+        return quantized
+
+    def build_embeddings(self, documents: Iterable[dict]) -> np.ndarray:
+        # documents may be a stream (see iter_movies), read and embedded
+        # BUILD_BATCH_SIZE at a time; only the documents themselves are kept
+        self._initialize_docs([])
+        doc_ids, hashes = [], []
+
+        def text_batches() -> Iterator[list[str]]:
+            for batch in batched(documents, BUILD_BATCH_SIZE):
+                texts = self._add_docs(batch)
+                doc_ids.extend(doc["id"] for doc in batch)
+                hashes.extend(content_hash(text) for text in texts)
+                yield texts
+
+        self.embeddings = self._encode_text_batches(text_batches())
+        self._initialize_rows(build_row_metadata(doc_ids, hashes))
         self._save()
+        self.embedding_store.retain("movies", self.row_metadata)
+        self.quantized_embeddings = self._load_or_quantize(
+            self.CACHE_MOVIE_EMBEDDINGS, self.embeddings
+        )
         return self.embeddings
 
-    def load_or_create_embeddings(self, documents: list[dict]) -> np.ndarray:
+    def load_or_create_embeddings(self, documents: Iterable[dict]) -> np.ndarray:
         if os.path.exists(self.CACHE_MOVIE_EMBEDDINGS):
+            # Diffed against the cache, a stream is read whole
+            documents = list(documents)
             self._load()
+            if self.row_metadata is not None:
+                self.update_embeddings(documents)
+                return self.embeddings
             if len(self.embeddings) == len(documents):
-                self._initialize_docs(documents)
+                # Cache written before row metadata existed, its rows follow
+                # the documents order
+                doc_list = self._initialize_docs(documents)
+                self._initialize_rows(
+                    build_row_metadata(
+                        [doc["id"] for doc in documents],
+                        [content_hash(text) for text in doc_list],
+                    )
+                )
                 return self.embeddings
 
         return self.build_embeddings(documents)
 
+    def update_embeddings(
+        self, documents: list[dict], compact: bool = False
+    ) -> dict[str, int]:
+        if self.embeddings is None and os.path.exists(self.CACHE_MOVIE_EMBEDDINGS):
+            self._load()
+        if self.row_metadata is None:
+            # Nothing to diff against: no cache, or one without row metadata
+            self.build_embeddings(documents)
+            return {"added": len(documents), "updated": 0, "deleted": 0, "compacted": 0}
+
+        doc_list = self._initialize_docs(documents)
+        incoming = {
+            doc["id"]: content_hash(text) for doc, text in zip(documents, doc_list)
+        }
+        live_rows = np.flatnonzero(self.row_metadata["hash"] != TOMBSTONE)
+        indexed_rows = {
+            int(doc_id): int(row)
+            for doc_id, row in zip(self.row_metadata["id"][live_rows], live_rows)
+        }
+        indexed = {
+            doc_id: bytes(self.row_metadata["hash"][row])
+            for doc_id, row in indexed_rows.items()
+        }
+        added, changed, deleted = diff_documents(indexed, incoming)
+        stats = {
+            "added": len(added),
+            "updated": len(changed),
+            "deleted": len(deleted),
+            "compacted": 0,
+        }
+        if not (added or changed or deleted or compact):
+            return stats
+
+        # Only new and changed texts are embedded. Changed rows are patched in
+        # place, new ones appended and deleted ones tombstoned.
+        positions = {doc["id"]: i for i, doc in enumerate(documents)}
+        new_embeddings = self._encode_texts(
+            [doc_list[positions[doc_id]] for doc_id in changed + added]
+        )
+        embeddings = np.array(self.embeddings, dtype=np.float32)
+        row_metadata = self.row_metadata.copy()
+        changed_rows = [indexed_rows[doc_id] for doc_id in changed]
+        embeddings[changed_rows] = new_embeddings[: len(changed)]
+        row_metadata["hash"][changed_rows] = [incoming[i] for i in changed]
+        row_metadata["hash"][[indexed_rows[i] for i in deleted]] = TOMBSTONE
+        embeddings = np.concatenate((embeddings, new_embeddings[len(changed) :]))
+        row_metadata = np.concatenate(
+            (row_metadata, build_row_metadata(added, [incoming[i] for i in added]))
+        )
+
+        live = row_metadata["hash"] != TOMBSTONE
+        if compact or np.count_nonzero(~live) > COMPACTION_THRESHOLD * len(live):
+            stats["compacted"] = int(np.sum(~live))
+            embeddings, row_metadata = embeddings[live], row_metadata[live]
+
+        self.embeddings = embeddings
+        self._initialize_rows(row_metadata)
+        self._save()
+        self.embedding_store.retain("movies", self.row_metadata, compact=compact)
+        self.quantized_embeddings = self._load_or_quantize(
+            self.CACHE_MOVIE_EMBEDDINGS, self.embeddings
+        )
+        return stats
+
+    def _encode_texts(self, texts: list[str]) -> np.ndarray:
+        return self._encode_text_batches([texts])
+
+    def _encode_text_batches(self, batches: Iterable[list[str]]) -> np.ndarray:
+        # Texts embedded before, by any cache of this model, are not encoded again
+        encoded = self.embedding_store.get_or_encode_batches(
+            batches,
+            lambda missing: l2_normalize(
+                self.model.encode(missing, show_progress_bar=True)
+            ),
+        )
+        if not encoded:
+            dimensions = self.model.get_sentence_embedding_dimension()
+            return np.empty((0, dimensions), dtype=np.float32)
+        return np.concatenate(encoded)
+
     def generate_embedding(self, text: str) -> np.ndarray:
         if not text or text.isspace():
             raise ValueError("text for embeding can't be empty")
-        embedding = self.model.encode([text])
-        return embedding[0]
+        embedding = self.query_cache.get(text)
+        if embedding is None:
+            count("query_cache.misses")
+            with span("embed.query"):
+                embedding = self.query_cache.put(text, self.model.encode([text])[0])
+        else:
+            count("query_cache.hits")
+        return embedding
+
+    def generate_embeddings(self, texts: list[str]) -> np.ndarray:
+        # Every text missing from the query cache goes in a single model batch
+        if any(not text or text.isspace() for text in texts):
+            raise ValueError("text for embeding can't be empty")
+        if not texts:
+            return np.empty(
+                (0, self.model.get_sentence_embedding_dimension()), dtype=np.float32
+            )
+        return np.stack(self.query_cache.get_or_encode(texts, self.model.encode))
 
     def search(self, query: str, limit: int) -> list[dict]:
+        self._check_embeddings_loaded()
+        emb_query = l2_normalize(self.generate_embedding(query))
+        return self._search_hits(self._rank_embeddings(emb_query, limit))
+
+    def search_many(self, queries: list[str], limit: int) -> list[list[dict]]:
+        self._check_embeddings_loaded()
+        query_embeddings = l2_normalize(self.generate_embeddings(queries))
+        hits = []
+        for start in range(0, len(query_embeddings), QUERY_BLOCK_ROWS):
+            block = query_embeddings[start : start + QUERY_BLOCK_ROWS]
+            # One matrix product scores the whole block of queries
+            if self.quantized_embeddings is None:
+                block_scores = block @ self.embeddings.T
+            else:
+                block_scores = self.quantized_embeddings.scores(block).T
+            block_scores[:, self.deleted_rows] = -np.inf
+            for query_embedding, scores in zip(block, block_scores):
+                ranked = self._rank_scores(query_embedding, scores, limit)
+                hits.append(self._search_hits(ranked))
+        return hits
+
+    def _check_embeddings_loaded(self) -> None:
         if self.embeddings is None or self.embeddings.size == 0:
             raise ValueError(
                 "No embeddings loaded. Call `load_or_create_embeddings` first."
             )
-        emb_query = self.generate_embedding(query)
-        similarity_scores = []
-        for i, doc_embedding in enumerate(self.embeddings):
-            sim_score = cosine_similarity(emb_query, doc_embedding)
-            doc = self.documents[i]
-            similarity_scores.append((sim_score, doc))
-        similarity_scores.sort(key=lambda x: x[0], reverse=True)
+
+    def _search_hits(self, ranked: list[tuple[int, float]]) -> list[dict]:
         search_hits = []
-        for score, document in similarity_scores[:limit]:
+        for i, score in ranked:
+            document = self.document_map[int(self.row_metadata["id"][i])]
             search_hits.append(
                 {
                     "score": score,
@@ -80,6 +321,35 @@ class SemanticSearch:
             )
         return search_hits
 
+    def _rank_embeddings(
+        self, query_embedding: np.ndarray, limit: int
+    ) -> list[tuple[int, float]]:
+        # Embeddings are unit length, so cosine similarity is a plain dot product
+        if self.quantized_embeddings is None:
+            scores = self.embeddings @ query_embedding
+        else:
+            scores = self.quantized_embeddings.scores(query_embedding)
+        # Tombstoned rows score -inf, so they rank last and are dropped
+        scores[self.deleted_rows] = -np.inf
+        return self._rank_scores(query_embedding, scores, limit)
+
+    def _rank_scores(
+        self, query_embedding: np.ndarray, scores: np.ndarray, limit: int
+    ) -> list[tuple[int, float]]:
+        # scores: exact scores of every row, or quantized ones to shortlist from
+        if self.quantized_embeddings is None:
+            candidates = np.arange(len(scores))
+        else:
+            # Re-score the shortlist exactly
+            candidates = np.sort(top_k_indices(scores, limit * self.rescore_factor))
+            scores = self.embeddings[candidates] @ query_embedding
+            scores[np.isin(candidates, self.deleted_rows)] = -np.inf
+        return [
+            (int(candidates[i]), float(scores[i]))
+            for i in top_k_indices(scores, limit)
+            if scores[i] != -np.inf
+        ]
+
 
 def verify_model() -> None:
     sem_search = SemanticSearch()
@@ -124,8 +394,29 @@ def cosine_similarity(vec1: np.ndarray, vec2: np.ndarray) -> float:
     return dot_product / (norm1 * norm2)
 
 
-def search_command(query: str, limit: int) -> None:
-    search_instance = SemanticSearch()
+def l2_normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    # Zero vectors stay zero, matching cosine_similarity returning 0.0 for them
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def load_normalized_embeddings(
+    path: str, mmap_mode: str | None = None
+) -> np.ndarray:
+    embeddings = np.load(path, mmap_mode=mmap_mode)
+    # Caches are saved L2-normalized, only caches written before that need to
+    # be normalized here (into a private copy, so they are no longer mapped)
+    sample = np.asarray(embeddings[:NORM_CHECK_ROWS], dtype=np.float32)
+    norms = np.linalg.norm(sample, axis=-1)
+    if np.all((np.abs(norms - 1) < 1e-3) | (norms == 0)):
+        return embeddings
+    return l2_normalize(embeddings)
+
+
+def search_command(query: str, limit: int, quantization: str | None = None) -> None:
+    search_instance = SemanticSearch(quantization=quantization)
     movies = load_movies()
     search_instance.load_or_create_embeddings(movies)
     hits = search_instance.search(query, limit)
@@ -0,0 +1,79 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+CLI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_REPEAT = 3
+# Packages that must not be imported by lightweight commands, each one costs
+# from a few hundred milliseconds (nltk, google.genai) to seconds (torch)
+HEAVY_MODULES = ["torch", "sentence_transformers", "google.genai", "nltk", "PIL"]
+# (script, arguments, budget in seconds) of every lightweight command. The
+# keyword commands read the compact index, run keyword_search_cli.py build
+# first.
+STARTUP_BUDGETS = [
+    ("keyword_search_cli.py", ["--help"], 0.5),
+    ("keyword_search_cli.py", ["tf", "1", "bear"], 1.0),
+    ("keyword_search_cli.py", ["idf", "bear"], 1.0),
+    ("keyword_search_cli.py", ["bm25idf", "bear"], 1.0),
+    ("keyword_search_cli.py", ["bm25search", "bear"], 1.0),
+    ("hybrid_search_cli.py", ["--help"], 0.5),
+    ("hybrid_search_cli.py", ["normalize", "0.5", "2.3", "1.2"], 0.5),
+    ("semantic_search_cli.py", ["--help"], 0.5),
+    ("semantic_search_cli.py", ["chunk", "A short text to chunk."], 0.5),
+    ("semantic_search_cli.py", ["semantic_chunk", "One. Two. Three."], 0.5),
+    ("augmented_generation_cli.py", ["--help"], 0.5),
+    ("evaluation_cli.py", ["--help"], 0.5),
+    ("search_server_cli.py", ["--help"], 0.5),
+]
+
+
+def _imported_heavy_modules(importtime_log: str) -> list[str]:
+    # -X importtime writes "import time: self | cumulative | name" per module
+    imported = set()
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        name = line.rsplit("|", 1)[-1].strip()
+        imported.add(name)
+    return [module for module in HEAVY_MODULES if module in imported]
+
+
+def time_command(script: str, args: list[str], repeat: int = DEFAULT_REPEAT) -> dict:
+    command = [sys.executable, "-X", "importtime", script, *args]
+    timings, heavy_modules, returncode = [], [], 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        completed = subprocess.run(
+            command, cwd=CLI_DIR, capture_output=True, text=True
+        )
+        timings.append(time.perf_counter() - start)
+        returncode = returncode or completed.returncode
+        heavy_modules = _imported_heavy_modules(completed.stderr)
+    return {
+        "median_seconds": statistics.median(timings),
+        "heavy_modules": heavy_modules,
+        "returncode": returncode,
+    }
+
+
+def startup_benchmark_command(repeat: int = DEFAULT_REPEAT) -> bool:
+    # Median wall time of every lightweight command, from interpreter start
+    # to exit. Returns False when any command fails or is over its budget.
+    ok = True
+    print(f"{'command':<58} {'median':>8} {'budget':>8}  heavy imports")
+    for script, args, budget in STARTUP_BUDGETS:
+        result = time_command(script, args, repeat)
+        name = " ".join([script, *args])
+        status = ""
+        if result["returncode"] != 0:
+            status = f"  FAILED (exit {result['returncode']})"
+        elif result["median_seconds"] > budget:
+            status = "  OVER BUDGET"
+        ok = ok and not status
+        print(
+            f"{name[:58]:<58} {result['median_seconds']:>7.3f}s {budget:>7.2f}s  "
+            f"{', '.join(result['heavy_modules']) or '-'}{status}"
+        )
+    return ok
@@ -1,29 +1,45 @@
 import string
+from functools import lru_cache
 
 from .search_utils import load_stopwords
-from nltk.stem import PorterStemmer
 
+STEM_CACHE_SIZE = 65536
+PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
 
-def preprocess_text(query: str) -> list[str]:
-    # Convert to lower text
-    preprocess_text = query.lower()
 
-    # Remove punctuation
-    preprocess_text = preprocess_text.translate(
-        str.maketrans("", "", string.punctuation)
-    )
+class TextAnalyzer:
+    def __init__(
+        self, stopwords: list[str] | None = None, stem_cache_size: int = STEM_CACHE_SIZE
+    ) -> None:
+        if stopwords is None:
+            stopwords = load_stopwords()
+        self.stopwords = frozenset(stopwords)
+        # Imported here, importing nltk alone takes a noticeable part of the
+        # startup of commands that never tokenize anything
+        from nltk.stem import PorterStemmer
+
+        self.stemmer = PorterStemmer()
+        self.stem = lru_cache(maxsize=stem_cache_size)(self.stemmer.stem)
+
+    def analyze(self, text: str) -> list[str]:
+        # Convert to lower text and remove punctuation
+        text = text.lower().translate(PUNCTUATION_TABLE)
+
+        # Split in tokens, remove stopwords and stem the remaining tokens
+        stopwords = self.stopwords
+        stem = self.stem
+        return [stem(t) for t in text.split() if t not in stopwords]
 
-    # Split query in tokens
-    tokens = preprocess_text.split()
-    tokenized_query = [t for t in tokens if t.strip()]
 
-    # Remove stopwords
-    stopwords = load_stopwords()
-    tokenized_query = [t for t in tokenized_query if t not in stopwords]
+_default_analyzer = None
 
-    # Stem tokens
-    stemmer = PorterStemmer()
-    tokenized_query = [stemmer.stem(t) for t in tokenized_query]
 
-    # Return preprocess_text
-    return tokenized_query
+def get_analyzer() -> TextAnalyzer:
+    global _default_analyzer
+    if _default_analyzer is None:
+        _default_analyzer = TextAnalyzer()
+    return _default_analyzer
+
+
+def preprocess_text(query: str) -> list[str]:
+    return get_analyzer().analyze(query)
@@ -0,0 +1,160 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+# Off by default: span() and count() then return after a single global
+# check, without touching the clock or allocating
+_enabled = False
+_current_trace = ContextVar("current_trace", default=None)
+_NO_SPAN = nullcontext()
+
+
+def enable_tracing(enabled: bool = True) -> None:
+    global _enabled
+    _enabled = enabled
+
+
+def tracing_enabled() -> bool:
+    return _enabled
+
+
+class Trace:
+    # Timeline of the spans of one traced operation and its counters. Spans
+    # are kept flat, with their offset from the start of the trace, so the
+    # concurrent LLM calls of a rerank are recorded side by side.
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.start = time.perf_counter()
+        self.seconds = None
+        self.spans = []
+        self.counters = defaultdict(int)
+        # asyncio tasks share the trace of the coroutine that started them
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, start: float, seconds: float) -> None:
+        with self._lock:
+            self.spans.append((name, start - self.start, seconds))
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += value
+
+    def finish(self) -> None:
+        self.seconds = time.perf_counter() - self.start
+
+    def stages(self) -> dict[str, dict]:
+        # Calls and total time of every span name, in order of first start
+        stages = {}
+        for name, _, seconds in self.spans:
+            stage = stages.setdefault(name, {"calls": 0, "ms": 0.0})
+            stage["calls"] += 1
+            stage["ms"] += seconds * 1000
+        return stages
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "ms": None if self.seconds is None else self.seconds * 1000,
+            "stages": self.stages(),
+            "counters": dict(self.counters),
+            "spans": [
+                {"name": name, "start_ms": offset * 1000, "ms": seconds * 1000}
+                for name, offset, seconds in self.spans
+            ],
+        }
+
+
+class _Span:
+    __slots__ = ("trace", "name", "start")
+
+    def __init__(self, trace: Trace, name: str) -> None:
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self) -> "_Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.trace.add_span(self.name, self.start, time.perf_counter() - self.start)
+
+
+class MetricsRegistry:
+    # Process-wide totals of every finished trace: span calls, total and max
+    # time per stage, and counter sums
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.traces = defaultdict(int)
+            self.stages = defaultdict(lambda: {"calls": 0, "ms": 0.0, "max_ms": 0.0})
+            self.counters = defaultdict(int)
+
+    def record(self, trace: Trace) -> None:
+        with self._lock:
+            self.traces[trace.name] += 1
+            for name, _, seconds in trace.spans:
+                stage = self.stages[name]
+                stage["calls"] += 1
+                stage["ms"] += seconds * 1000
+                stage["max_ms"] = max(stage["max_ms"], seconds * 1000)
+            for name, value in trace.counters.items():
+                self.counters[name] += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "traces": dict(self.traces),
+                "stages": {name: dict(stage) for name, stage in self.stages.items()},
+                "counters": dict(self.counters),
+            }
+
+
+metrics_registry = MetricsRegistry()
+
+
+@contextmanager
+def trace(name: str):
+    # Yields the Trace collecting every span and counter of the block (None
+    # while tracing is off); it is added to metrics_registry once finished
+    if not _enabled:
+        yield None
+        return
+    current = Trace(name)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+        current.finish()
+        metrics_registry.record(current)
+
+
+def span(name: str):
+    if not _enabled:
+        return _NO_SPAN
+    current = _current_trace.get()
+    if current is None:
+        return _NO_SPAN
+    return _Span(current, name)
+
+
+def count(name: str, value: int = 1) -> None:
+    if not _enabled:
+        return
+    current = _current_trace.get()
+    if current is not None:
+        current.count(name, value)
+
+
+def format_trace(current: Trace) -> str:
+    lines = [f"Trace of {current.name}: {current.seconds * 1000:.1f} ms"]
+    for name, stage in current.stages().items():
+        lines.append(f"  - {name}: {stage['ms']:.1f} ms ({stage['calls']} call(s))")
+    for name, value in current.counters.items():
+        lines.append(f"  - {name}: {value}")
+    return "\n".join(lines)
@@ -0,0 +1,28 @@
+import argparse
+
+from lib.llm_cache import LLMResponseCache
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="LLM Response Cache CLI")
+    subparsers = parser.add_subparsers(dest="command", help="Available commands")
+
+    subparsers.add_parser("stats", help="Print the number of cached LLM responses")
+    subparsers.add_parser("clear", help="Delete every cached LLM response")
+
+    args = parser.parse_args()
+
+    match args.command:
+        case "stats":
+            cache = LLMResponseCache()
+            print(f"Cached responses: {cache.stats()['size']} ({cache.path})")
+        case "clear":
+            cache = LLMResponseCache()
+            cache.clear()
+            print("LLM response cache cleared.")
+        case _:
+            parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
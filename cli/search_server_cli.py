@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+import argparse
+
+from lib.search_server import DEFAULT_HOST, DEFAULT_PORT, serve_command
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Resident search server: loads every model and index once and serves BM25, semantic, hybrid and RAG searches as JSON over HTTP"
+    )
+    parser.add_argument(
+        "--host",
+        type=str,
+        default=DEFAULT_HOST,
+        help=f"Interface to listen on. Default {DEFAULT_HOST}",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=DEFAULT_PORT,
+        help=f"Port to listen on. Default {DEFAULT_PORT}",
+    )
+    parser.add_argument(
+        "--persist-query-cache",
+        action="store_true",
+        help="Keep the query embedding cache on disk across restarts",
+    )
+
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Time the pipeline stages of every request, served in its response and summed at /metrics",
+    )
+
+    args = parser.parse_args()
+    serve_command(args.host, args.port, args.persist_query_cache, args.trace)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,8 +11,13 @@ from lib.chunked_semantic_search import (
     chunk_text,
     semantic_chunk_text,
     embed_command,
+    update_command,
     search_chunked_command,
+    quantization_benchmark_command,
+    ann_benchmark_command,
 )
+from lib.quantization import QUANTIZATION_MODES
+from lib.ann_index import ANN_BACKENDS, DEFAULT_PROBES
 
 import argparse
 
@@ -55,6 +60,12 @@ def main():
         default=5,
         help="Optional. Number of search hits to return",
     )
+    search_parser.add_argument(
+        "--quantization",
+        type=str,
+        choices=QUANTIZATION_MODES,
+        help="Optional. Search a quantized copy of the embeddings, re-scoring the best candidates in float32",
+    )
 
     chunk_parser = subparsers.add_parser(
         "chunk", help="Split a given text in chunks of [--chunk-size]"
@@ -113,6 +124,65 @@ def main():
         default=5,
         help="Number of results to return. Default 5",
     )
+    search_chunked_parser.add_argument(
+        "--quantization",
+        type=str,
+        choices=QUANTIZATION_MODES,
+        help="Optional. Search a quantized copy of the chunk embeddings, re-scoring the best candidates in float32",
+    )
+    search_chunked_parser.add_argument(
+        "--ann",
+        type=str,
+        choices=list(ANN_BACKENDS),
+        help="Optional. Search an approximate nearest neighbor index instead of scanning every chunk",
+    )
+    search_chunked_parser.add_argument(
+        "--ann-probes",
+        type=int,
+        default=DEFAULT_PROBES,
+        help=f"Number of IVF lists searched per query with --ann ivf. Default {DEFAULT_PROBES}",
+    )
+
+    update_parser = subparsers.add_parser(
+        "update",
+        help="Embed only the added and changed movies into the movie and chunk embedding caches",
+    )
+    update_parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Drop the rows of deleted and changed movies now instead of once they pile up",
+    )
+
+    quantization_benchmark_parser = subparsers.add_parser(
+        "quantization_benchmark",
+        help="Compare recall and latency of quantized chunk embeddings against float32 on the golden dataset",
+    )
+    quantization_benchmark_parser.add_argument(
+        "--limit",
+        type=int,
+        nargs="?",
+        default=5,
+        help="k for recall@k. Default 5",
+    )
+
+    ann_benchmark_parser = subparsers.add_parser(
+        "ann_benchmark",
+        help="Compare recall and latency of the IVF chunk index against exhaustive search on the golden dataset",
+    )
+    ann_benchmark_parser.add_argument(
+        "--limit",
+        type=int,
+        nargs="?",
+        default=5,
+        help="k for recall@k. Default 5",
+    )
+    ann_benchmark_parser.add_argument(
+        "--probes",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8, 16],
+        help="n_probe values to benchmark",
+    )
 
     args = parser.parse_args()
 
@@ -126,7 +196,7 @@ def main():
         case "embedquery":
             embed_query_text(args.query)
         case "search":
-            search_command(args.query, args.limit)
+            search_command(args.query, args.limit, args.quantization)
         case "chunk":
             print(f"Chunking {len(args.text)} characters")
             chunks = chunk_text(args.text, args.chunk_size, args.overlap)
@@ -140,7 +210,19 @@ def main():
         case "embed_chunks":
             embed_command()
         case "search_chunked":
-            search_chunked_command(args.query, args.limit)
+            search_chunked_command(
+                args.query, args.limit, args.quantization, args.ann, args.ann_probes
+            )
+        case "update":
+            for cache, stats in update_command(args.compact).items():
+                print(
+                    f"{cache}: added {stats['added']}, updated {stats['updated']}, "
+                    f"deleted {stats['deleted']} movies, compacted {stats['compacted']} rows"
+                )
+        case "quantization_benchmark":
+            quantization_benchmark_command(args.limit)
+        case "ann_benchmark":
+            ann_benchmark_command(args.limit, args.probes)
         case _:
             parser.print_help()
 
@@ -0,0 +1,24 @@
+import argparse
+import sys
+
+from lib.startup_benchmark import DEFAULT_REPEAT, startup_benchmark_command
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Time the startup of the lightweight CLI commands"
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=DEFAULT_REPEAT,
+        help="Runs per command, the median is reported",
+    )
+    args = parser.parse_args()
+
+    if not startup_benchmark_command(args.repeat):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import pytest
+
+from lib import search_utils, text_processing
+from lib.benchmark import HashingEmbeddingModel, synthetic_movies
+from lib.text_processing import TextAnalyzer
+
+# The tests don't depend on data/: synthetic movies, a fixed stopword list
+# and the hashing stand-in for the embedding model
+STOPWORDS = ["the", "a", "an", "and", "of", "in"]
+STUB_MODEL_NAME = "test-stub"
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    # Every index and embedding cache of a test lives in its own directory
+    path = tmp_path / "cache"
+    monkeypatch.setattr(search_utils, "CACHE_DIR", str(path))
+    return path
+
+
+@pytest.fixture(autouse=True)
+def analyzer(monkeypatch):
+    monkeypatch.setattr(text_processing, "_default_analyzer", TextAnalyzer(STOPWORDS))
+
+
+@pytest.fixture(scope="session")
+def model():
+    return HashingEmbeddingModel()
+
+
+@pytest.fixture(scope="session")
+def movies():
+    return synthetic_movies(300, seed=7)
+
+
+def updated_movies(movies: list[dict]) -> list[dict]:
+    # Every 10th movie deleted, every 7th remaining one changed and 20 new
+    # ones appended
+    updated = [dict(movie) for i, movie in enumerate(movies) if i % 10]
+    for movie in updated[::7]:
+        movie["description"] += " A bear hunts sharks in the harbour."
+    new_movies = synthetic_movies(len(movies) + 20, seed=8)[len(movies) :]
+    return updated + new_movies
@@ -0,0 +1,130 @@
+import os
+
+import numpy as np
+
+from lib.chunked_semantic_search import ChunkedSemanticSearch
+from lib.embedding_store import EmbeddingStore, QueryEmbeddingCache
+from lib.search_utils import build_row_metadata, content_hash
+
+from conftest import STUB_MODEL_NAME
+
+
+class CountingEncoder:
+    def __init__(self, model) -> None:
+        self.model = model
+        self.texts = []
+
+    def __call__(self, texts: list[str]) -> np.ndarray:
+        self.texts.extend(texts)
+        return self.model.encode(texts)
+
+
+def _references(texts: list[str]) -> np.ndarray:
+    return build_row_metadata(range(len(texts)), [content_hash(t) for t in texts])
+
+
+def test_store_encodes_each_text_once_across_instances(model):
+    texts = ["a bear", "a shark", "a bear", "a robot"]
+    encode = CountingEncoder(model)
+    vectors = EmbeddingStore(STUB_MODEL_NAME).get_or_encode(texts, encode)
+    assert encode.texts == ["a bear", "a shark", "a robot"]
+    np.testing.assert_array_equal(vectors, model.encode(texts))
+
+    reopened = EmbeddingStore(STUB_MODEL_NAME)
+    again = reopened.get_or_encode(texts[::-1], encode)
+    assert encode.texts == ["a bear", "a shark", "a robot"]
+    np.testing.assert_array_equal(again, model.encode(texts[::-1]))
+    assert reopened.hits == 4
+
+
+def test_new_entries_are_appended(model):
+    store = EmbeddingStore(STUB_MODEL_NAME)
+    store.get_or_encode(["a bear", "a shark"], model.encode)
+    with open(store.CACHE_PATH, "rb") as file:
+        before = file.read()
+    store.get_or_encode(["a bear", "a robot"], model.encode)
+    with open(store.CACHE_PATH, "rb") as file:
+        after = file.read()
+    assert after.startswith(before)
+    assert len(after) == len(before) * 3 // 2
+
+
+def test_record_cut_short_by_an_interrupted_append_is_dropped(model):
+    store = EmbeddingStore(STUB_MODEL_NAME)
+    store.get_or_encode(["a bear"], model.encode)
+    with open(store.CACHE_PATH, "ab") as file:
+        file.write(b"\0" * 7)
+    store.get_or_encode(["a shark"], model.encode)
+
+    reopened = EmbeddingStore(STUB_MODEL_NAME)
+    vectors = reopened.get_or_encode(["a bear", "a shark"], model.encode)
+    assert reopened.misses == 0
+    np.testing.assert_array_equal(vectors, model.encode(["a bear", "a shark"]))
+
+
+def test_compact_drops_entries_no_cache_holds(model):
+    store = EmbeddingStore(STUB_MODEL_NAME)
+    texts = [f"movie {i}" for i in range(10)]
+    store.get_or_encode(texts, model.encode)
+
+    # Up to 2 unreferenced entries of 10 stay below the threshold
+    assert store.retain("movies", _references(texts[:8])) == 0
+    assert store.retain("chunks", _references(texts[5:9])) == 0
+    assert len(store.keys) == 10
+    assert store.retain("chunks", _references(texts[5:9]), compact=True) == 1
+
+    # Releasing documents drops only their references
+    released = build_row_metadata([], [])
+    assert store.retain("movies", released, released_ids=range(5)) == 5
+    assert sorted(store.keys) == sorted(content_hash(t) for t in texts[5:9])
+    vectors = store.get_or_encode(texts[5:9], model.encode)
+    assert store.misses == 10
+    np.testing.assert_array_equal(vectors, model.encode(texts[5:9]))
+
+
+def test_updates_evict_the_embeddings_of_changed_and_deleted_movies(movies, model):
+    search = ChunkedSemanticSearch(STUB_MODEL_NAME, model=model)
+    search.build_embeddings(movies)
+    search.build_chunk_embeddings(movies)
+
+    updated = [dict(movie) for movie in movies[50:]]
+    for movie in updated[:20]:
+        movie["description"] += " Now with a bear."
+    search.update_embeddings(updated, compact=True)
+    search.update_chunk_embeddings(updated, compact=True)
+
+    expected = ChunkedSemanticSearch(STUB_MODEL_NAME, model=model)
+    texts = expected._initialize_docs(updated)
+    chunks, _, _ = expected._chunk_documents(updated)
+    live = {content_hash(text) for text in texts + chunks}
+    store = EmbeddingStore(STUB_MODEL_NAME)
+    store.load()
+    assert set(store.keys.tolist()) == live
+    assert os.path.getsize(store.CACHE_PATH) == len(live) * (32 + 4 * model.dimensions)
+
+
+def test_query_cache_evicts_the_least_recently_used_query(model):
+    cache = QueryEmbeddingCache(STUB_MODEL_NAME, max_size=2)
+    encode = CountingEncoder(model)
+    cache.get_or_encode(["a bear", "a  shark "], encode)
+    assert cache.get("a bear") is not None
+    cache.put("a robot", model.encode(["a robot"])[0])
+    # "a shark" was used least recently
+    assert cache.get("a shark") is None
+    embeddings = cache.get_or_encode(["a bear", "a robot", "a shark"], encode)
+    assert encode.texts == ["a bear", "a shark", "a shark"]
+    np.testing.assert_array_equal(
+        np.stack(embeddings), model.encode(["a bear", "a robot", "a shark"])
+    )
+    assert not embeddings[0].flags.writeable
+
+
+def test_query_cache_persists_its_newest_entries(model):
+    cache = QueryEmbeddingCache(STUB_MODEL_NAME, max_size=3)
+    cache.get_or_encode(["a bear", "a shark", "a robot"], model.encode)
+    cache.save()
+    reloaded = QueryEmbeddingCache(STUB_MODEL_NAME, max_size=2)
+    reloaded.load()
+    assert reloaded.stats()["size"] == 2
+    assert reloaded.get("a bear") is None
+    np.testing.assert_array_equal(reloaded.get("a robot"), model.encode(["a robot"])[0])
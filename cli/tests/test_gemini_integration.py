@@ -0,0 +1,79 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from lib.gemini_integration import GeminiClient
+from lib.llm_cache import LLMResponseCache
+
+
+class FakeModels:
+    # generate_content answers with the next of texts, None being a blocked
+    # or empty response
+    def __init__(self, texts: list[str | None]) -> None:
+        self.texts = list(texts)
+        self.calls = 0
+
+    def generate_content(self, **request) -> SimpleNamespace:
+        self.calls += 1
+        self.contents = request["contents"]
+        return SimpleNamespace(text=self.texts.pop(0))
+
+
+class FakeAsyncModels:
+    def __init__(self, models: FakeModels) -> None:
+        self.models = models
+
+    async def generate_content(self, **request) -> SimpleNamespace:
+        return self.models.generate_content(**request)
+
+
+def _client(tmp_path, texts: list[str | None]) -> tuple[GeminiClient, FakeModels]:
+    models = FakeModels(texts)
+    fake = SimpleNamespace(
+        models=models, aio=SimpleNamespace(models=FakeAsyncModels(models))
+    )
+    cache = LLMResponseCache(str(tmp_path / "llm.sqlite3"))
+    return GeminiClient(client=fake, response_cache=cache), models
+
+
+def test_responses_are_served_from_the_cache(tmp_path):
+    client, models = _client(tmp_path, ["bear movie"])
+    assert client.fix_spelling("baer movie") == "bear movie"
+    assert client.fix_spelling("baer movie") == "bear movie"
+    assert models.calls == 1
+
+
+def test_empty_text_response_is_returned_and_not_cached(tmp_path):
+    client, models = _client(tmp_path, [None, "bear movie"])
+    assert client.fix_spelling("baer movie") is None
+    assert client.response_cache.stats()["size"] == 0
+    assert client.fix_spelling("baer movie") == "bear movie"
+    assert models.calls == 2
+
+
+def test_empty_parsed_response_raises_and_is_not_cached(tmp_path):
+    client, models = _client(tmp_path, [None, None, "7.5"])
+    movie = {"id": 1, "title": "Paddington", "description": "A bear in London."}
+    with pytest.raises(ValueError):
+        client.individual_rerank("bear", movie)
+    with pytest.raises(ValueError):
+        asyncio.run(client.individual_rerank_async("bear", movie))
+    assert client.individual_rerank("bear", movie) == 7.5
+    assert client.response_cache.stats()["size"] == 1
+
+
+def test_unparsable_response_is_not_cached(tmp_path):
+    client, models = _client(tmp_path, ["great match", "8"])
+    movie = {"id": 1, "title": "Paddington", "description": "A bear in London."}
+    with pytest.raises(ValueError):
+        client.individual_rerank("bear", movie)
+    assert client.individual_rerank("bear", movie) == 8.0
+    assert models.calls == 2
+
+
+def test_individual_rerank_prompt_shows_the_description(tmp_path):
+    client, models = _client(tmp_path, ["9"])
+    movie = {"id": 1, "title": "Paddington", "description": "A bear in London."}
+    client.individual_rerank("bear", movie)
+    assert "Movie: Paddington - A bear in London." in models.contents
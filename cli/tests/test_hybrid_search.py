@@ -0,0 +1,139 @@
+import threading
+
+import pytest
+
+from lib.chunked_semantic_search import ChunkedSemanticSearch
+from lib.compact_index import CompactIndex
+from lib.hybrid_search import CandidateDepth, HybridSearch
+from lib.inverted_index import InvertedIndex
+from lib.keyword_search import update_index
+
+from conftest import STUB_MODEL_NAME, updated_movies
+
+
+def _hybrid_search(movies, model) -> HybridSearch:
+    semantic_search = ChunkedSemanticSearch(STUB_MODEL_NAME, model=model)
+    return HybridSearch(movies, "r", semantic_search)
+
+
+def _save_compact_index(movies) -> None:
+    inverted_index = InvertedIndex()
+    inverted_index.build(movies)
+    compact_index = CompactIndex()
+    compact_index.build(inverted_index)
+    compact_index.save()
+
+
+def _ranking(results) -> list:
+    return [(movie["id"], score) for movie, score in results]
+
+
+def test_concurrent_searches_during_reloads_see_one_whole_index(movies, model):
+    versions = [movies, movies[::2]]
+    queries = [movie["title"] for movie in movies[:20]]
+    search = _hybrid_search(movies, model)
+    # The rankings every version gives on its own
+    expected = []
+    for version in versions:
+        _save_compact_index(version)
+        reference = CompactIndex()
+        reference.load()
+        expected.append({q: _ranking(reference.bm25_search(q, 10)) for q in queries})
+
+    stop = threading.Event()
+    errors, reloads = [], []
+
+    def searcher() -> None:
+        while not stop.is_set():
+            for query in queries:
+                try:
+                    ranking = _ranking(search.bm25_search(query, 10))
+                except Exception as error:
+                    errors.append(error)
+                    return
+                if all(ranking != rankings[query] for rankings in expected):
+                    errors.append(AssertionError(f"mixed ranking for {query!r}"))
+                    return
+
+    threads = [threading.Thread(target=searcher) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    try:
+        for round_number in range(10):
+            before = search.idx
+            _save_compact_index(versions[round_number % 2])
+            # The next save only starts once the searchers picked this one up
+            while search.idx is before and not errors:
+                threading.Event().wait(0.001)
+            reloads.append(search.idx)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    assert not errors, errors[0]
+    # Each reload published exactly one new instance
+    assert len(set(map(id, reloads))) == len(reloads)
+
+
+def _rrf_entries(results) -> list:
+    return [
+        (movie_id, entry["bm25_rank"], entry["semantic_rank"], entry["rrf_score"])
+        for movie_id, entry in results
+    ]
+
+
+@pytest.mark.parametrize("k", [1, 60])
+def test_adaptive_rrf_matches_an_exhaustive_fixed_depth(movies, model, k):
+    search = _hybrid_search(movies, model)
+    exhaustive = CandidateDepth("fixed", len(movies))
+    adaptive = CandidateDepth("adaptive", 1)
+    queries = [movie["title"] for movie in movies[:15]]
+    queries += [" ".join(movie["description"].split()[:3]) for movie in movies[:15]]
+    for query in queries:
+        for limit in (1, 5, 10):
+            expected = search.rrf_search(query, k, limit, depth=exhaustive)
+            actual = search.rrf_search(query, k, limit, depth=adaptive)
+            assert _rrf_entries(actual) == _rrf_entries(expected)
+
+
+@pytest.mark.parametrize("mode", ["fixed", "proportional", "adaptive"])
+def test_rrf_search_many_matches_single_searches(movies, model, mode):
+    search = _hybrid_search(movies, model)
+    depth = CandidateDepth(mode, 1 if mode == "adaptive" else None)
+    queries = [movie["title"] for movie in movies[:15]] + ["a bear hunts sharks"]
+    batch = search.rrf_search_many(queries, limit=5, depth=depth)
+    assert [_rrf_entries(results) for results in batch] == [
+        _rrf_entries(search.rrf_search(query, limit=5, depth=depth))
+        for query in queries
+    ]
+
+
+def test_rebuilt_search_serves_no_deleted_or_stale_movie(movies, model):
+    _hybrid_search(movies, model)
+    updated = updated_movies(movies)
+    catalog = {movie["id"]: movie for movie in updated}
+    search = _hybrid_search(updated, model)
+    # Each query matches a deleted movie, or the old text of a changed one
+    queries = [movie["description"] for movie in movies[:30]]
+
+    def assert_current(movie: dict) -> None:
+        assert catalog[movie["id"]] == movie
+
+    for query in queries:
+        for movie, _ in search.bm25_search(query, 5):
+            assert_current(movie)
+        for hit in search.weighted_search(query, 0.7, 5):
+            assert_current(hit["document"])
+        for _, hit in search.rrf_search(query, limit=5):
+            assert_current(hit["document"])
+
+
+def test_cold_build_keeps_the_base_keyword_updates_patch(movies, model):
+    _hybrid_search(movies, model)
+    assert update_index(movies) == {"added": 0, "updated": 0, "deleted": 0}
+    assert update_index(updated_movies(movies)) == {
+        "added": 20,
+        "updated": 39,
+        "deleted": 30,
+    }
@@ -0,0 +1,91 @@
+import pickle
+
+import pytest
+
+from lib import inverted_index as inverted_index_module
+from lib.compact_index import CompactIndex
+from lib.inverted_index import InvertedIndex
+
+from conftest import STOPWORDS, updated_movies
+
+
+def _queries(movies) -> list[str]:
+    return [movie["title"] for movie in movies[:20]] + ["", "the", "zzz unknown"]
+
+
+def _ranking(results) -> list:
+    return [(movie["id"], score) for movie, score in results]
+
+
+def _compact(inverted_index: InvertedIndex) -> CompactIndex:
+    compact_index = CompactIndex()
+    compact_index.build(inverted_index)
+    return compact_index
+
+
+def test_update_matches_a_full_build(movies):
+    updated = updated_movies(movies)
+    inverted_index = InvertedIndex()
+    inverted_index.build(movies)
+    stats = inverted_index.update(updated)
+    rebuilt = InvertedIndex()
+    rebuilt.build(updated)
+
+    assert stats == {"added": 20, "updated": 39, "deleted": 30}
+    assert inverted_index.index == rebuilt.index
+    assert list(inverted_index.docmap) == list(rebuilt.docmap)
+    assert inverted_index.term_frequency == rebuilt.term_frequency
+    assert list(inverted_index.doc_lengths.items()) == list(
+        rebuilt.doc_lengths.items()
+    )
+    for query in _queries(updated):
+        assert _ranking(inverted_index.bm25_search(query, 10)) == _ranking(
+            rebuilt.bm25_search(query, 10)
+        )
+
+
+def test_parallel_build_matches_a_serial_build(movies, tmp_path, monkeypatch):
+    # The spawned workers don't see the test analyzer, they load the same
+    # stopwords from the file named by the environment
+    stopwords_path = tmp_path / "stopwords.txt"
+    stopwords_path.write_text("\n".join(STOPWORDS))
+    monkeypatch.setenv("SEARCH_STOPWORDS_PATH", str(stopwords_path))
+    monkeypatch.setattr(inverted_index_module, "BUILD_SHARD_SIZE", 40)
+    serial = InvertedIndex()
+    serial.build(movies, workers=1)
+    parallel = InvertedIndex()
+    parallel.build(iter(movies), workers=2)
+
+    for name in ["index", "docmap", "term_frequency", "doc_lengths"]:
+        assert pickle.dumps(getattr(parallel, name)) == pickle.dumps(
+            getattr(serial, name)
+        )
+
+
+def test_update_of_the_same_movies_changes_nothing(movies):
+    inverted_index = InvertedIndex()
+    inverted_index.build(movies)
+    assert inverted_index.update(movies) == {"added": 0, "updated": 0, "deleted": 0}
+
+
+@pytest.mark.parametrize("limit", [1, 10, 1000])
+def test_compact_index_matches_the_inverted_index(movies, limit):
+    inverted_index = InvertedIndex()
+    inverted_index.build(movies)
+    compact_index = _compact(inverted_index)
+    for query in _queries(movies):
+        assert _ranking(compact_index.bm25_search(query, limit)) == _ranking(
+            inverted_index.bm25_search(query, limit)
+        )
+
+
+def test_search_many_matches_single_searches(movies):
+    inverted_index = InvertedIndex()
+    inverted_index.build(movies)
+    compact_index = _compact(inverted_index)
+    queries = _queries(movies)
+    for index in (inverted_index, compact_index):
+        batch = index.bm25_search_many(queries, 10)
+        assert [_ranking(results) for results in batch] == [
+            _ranking(index.bm25_search(query, 10)) for query in queries
+        ]
@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+import pytest
+
+from lib import llm_cache
+from lib.llm_cache import LLMResponseCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Seconds returned by llm_cache's time.time(), set by the test
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(llm_cache, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def test_cache_lives_in_the_cache_dir(cache_dir):
+    cache = LLMResponseCache()
+    cache.put("model", "method", "prompt", "response")
+    assert cache.path == str(cache_dir / llm_cache.LLM_CACHE_FILE)
+    assert LLMResponseCache().get("model", "method", "prompt") == "response"
+
+
+def test_responses_expire_after_the_ttl(clock):
+    cache = LLMResponseCache(ttl_seconds=60)
+    cache.put("model", "fix_spelling", "baer", "bear")
+    clock.now += 60
+    assert cache.get("model", "fix_spelling", "baer") == "bear"
+    clock.now += 1
+    assert cache.get("model", "fix_spelling", "baer") is None
+    assert cache.stats() == {"size": 0, "hits": 1, "misses": 1}
+
+
+def test_expired_responses_are_dropped_by_a_put(clock):
+    cache = LLMResponseCache(ttl_seconds=60)
+    cache.put("model", "method", "old", "old response")
+    clock.now += 61
+    cache.put("model", "method", "new", "new response")
+    assert cache.stats()["size"] == 1
+    assert cache.get("model", "method", "new") == "new response"
+
+
+def test_least_recently_used_responses_are_evicted(clock):
+    cache = LLMResponseCache(max_entries=2)
+    cache.put("model", "method", "a", "A")
+    clock.now += 1
+    cache.put("model", "method", "b", "B")
+    clock.now += 1
+    # Reading "a" makes "b" the least recently used response
+    assert cache.get("model", "method", "a") == "A"
+    clock.now += 1
+    cache.put("model", "method", "c", "C")
+    assert cache.stats()["size"] == 2
+    assert cache.get("model", "method", "b") is None
+    assert cache.get("model", "method", "a") == "A"
+    assert cache.get("model", "method", "c") == "C"
+
+
+def test_keys_separate_models_and_methods():
+    cache = LLMResponseCache()
+    cache.put("model", "fix_spelling", "prompt", "spelling")
+    cache.put("model", "rewrite", "prompt", "rewrite")
+    cache.put("other", "fix_spelling", "prompt", "other model")
+    assert cache.get("model", "fix_spelling", "prompt") == "spelling"
+    assert cache.get("model", "rewrite", "prompt") == "rewrite"
+    assert cache.get("other", "fix_spelling", "prompt") == "other model"
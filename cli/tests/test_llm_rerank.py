@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from lib.llm_rerank import IndividualReranker
+
+
+class FakeGeminiClient:
+    # individual_rerank_async per movie id: a score, "error" (always raises),
+    # "hang" (never answers) or ("flaky", failures, score)
+    def __init__(self, behaviors: dict) -> None:
+        self.behaviors = behaviors
+        self.calls = {movie_id: 0 for movie_id in behaviors}
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def individual_rerank_async(self, query: str, movie: dict) -> float:
+        behavior = self.behaviors[movie["id"]]
+        self.calls[movie["id"]] += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.001)
+            if behavior == "error":
+                raise RuntimeError(f"API error for {movie['id']}")
+            if behavior == "hang":
+                await asyncio.sleep(3600)
+            if isinstance(behavior, tuple):
+                _, failures, score = behavior
+                if self.calls[movie["id"]] <= failures:
+                    raise ValueError("unparsable score")
+                return score
+            return behavior
+        finally:
+            self.in_flight -= 1
+
+
+def _results(movie_ids: list[int]) -> list[tuple[int, dict]]:
+    return [
+        (movie_id, {"document": {"id": movie_id, "title": f"Movie {movie_id}"}})
+        for movie_id in movie_ids
+    ]
+
+
+def _reranker(client: FakeGeminiClient, **options) -> IndividualReranker:
+    options = {"timeout": 0.05, "retries": 2, "backoff": 0.0} | options
+    return IndividualReranker(client, **options)
+
+
+def test_failed_results_keep_their_rrf_position():
+    client = FakeGeminiClient(
+        {1: 2.0, 2: "error", 3: 9.0, 4: "hang", 5: ("flaky", 1, 7.0), 6: 5.0}
+    )
+    reranker = _reranker(client)
+    reranked = reranker.rerank("bear", _results([1, 2, 3, 4, 5, 6]))
+
+    # Scored results take the scored positions best first, 2 and 4 stay put
+    assert [movie_id for movie_id, _ in reranked] == [3, 2, 5, 4, 6, 1]
+    scores = [hit["rerank_score"] for _, hit in reranked]
+    assert scores == [9.0, None, 7.0, None, 5.0, 2.0]
+    assert client.calls == {1: 1, 2: 3, 3: 1, 4: 3, 5: 2, 6: 1}
+    stats = reranker.last_rerank_stats
+    assert {key: stats[key] for key in ["calls", "failed", "retries"]} == {
+        "calls": 6,
+        "failed": 2,
+        "retries": 5,
+    }
+    assert (stats["timeouts"], stats["errors"]) == (3, 4)
+    assert "API error for 2" in stats["last_error"]
+
+
+def test_ties_keep_rrf_order():
+    client = FakeGeminiClient({1: 5.0, 2: 8.0, 3: 5.0, 4: 8.0})
+    reranked = _reranker(client).rerank("bear", _results([1, 2, 3, 4]))
+    assert [movie_id for movie_id, _ in reranked] == [2, 4, 1, 3]
+
+
+def test_every_call_failing_leaves_the_rrf_order():
+    client = FakeGeminiClient({1: "error", 2: "hang", 3: "error"})
+    reranker = _reranker(client, retries=0)
+    reranked = reranker.rerank("bear", _results([1, 2, 3]))
+    assert [movie_id for movie_id, _ in reranked] == [1, 2, 3]
+    assert all(hit["rerank_score"] is None for _, hit in reranked)
+    assert reranker.last_rerank_stats["failed"] == 3
+    assert reranker.last_rerank_stats["retries"] == 0
+
+
+def test_calls_in_flight_are_bounded_by_the_concurrency():
+    client = FakeGeminiClient({movie_id: float(movie_id) for movie_id in range(20)})
+    reranker = _reranker(client, concurrency=3)
+    reranked = reranker.rerank("bear", _results(list(range(20))))
+    assert client.max_in_flight == 3
+    assert [movie_id for movie_id, _ in reranked] == list(range(19, -1, -1))
+
+
+def test_concurrency_must_be_positive():
+    with pytest.raises(ValueError):
+        IndividualReranker(FakeGeminiClient({}), concurrency=0)
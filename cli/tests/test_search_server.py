@@ -0,0 +1,105 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+from lib.search_server import (
+    BadRequest,
+    SearchRequestHandler,
+    _get_depth,
+    _get_float,
+    _get_int,
+    _get_query,
+)
+
+
+class FakeHybridSearch:
+    # bm25_search raises the given error, rrf_search answers with no results
+    def __init__(self, error: Exception) -> None:
+        self.error = error
+
+    def bm25_search(self, query: str, limit: int) -> list:
+        raise self.error
+
+    def rrf_search(self, query: str, k: int, limit: int, depth=None) -> list:
+        return []
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def serve(error: Exception) -> tuple[str, list]:
+        logged = []
+        service = SimpleNamespace(hybrid_search=FakeHybridSearch(error))
+
+        class Handler(SearchRequestHandler):
+            def log_error(self, format: str, *args) -> None:
+                logged.append(format % args)
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        Handler.service = service
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}", logged
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def _get(url: str) -> tuple[int, dict]:
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as error:
+        return error.code, json.load(error)
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {},
+        {"q": "  "},
+        {"q": "bear", "limit": "many"},
+        {"q": "bear", "limit": "0"},
+        {"q": "bear", "depth": "x"},
+        {"q": "bear", "depth_mode": "bogus"},
+    ],
+)
+def test_invalid_parameters_are_bad_requests(params):
+    with pytest.raises(BadRequest):
+        _get_query(params)
+        _get_int(params, "limit", 5)
+        _get_depth(params)
+
+
+def test_invalid_float_is_a_bad_request():
+    with pytest.raises(BadRequest):
+        _get_float({"alpha": "half"}, "alpha", 0.5)
+
+
+def test_bad_requests_are_answered_with_400(serve):
+    base, logged = serve(RuntimeError("unused"))
+    status, payload = _get(f"{base}/search/rrf?q=bear&rerank=llm")
+    assert (status, payload) == (400, {"error": "rerank must be cross_encoder"})
+    status, _ = _get(f"{base}/search/rrf?q=bear&depth_mode=bogus")
+    assert status == 400
+    assert _get(f"{base}/search/rrf?q=bear") == (200, {"query": "bear", "results": []})
+    assert logged == []
+
+
+@pytest.mark.parametrize("error", [ValueError("engine bug"), RuntimeError("down")])
+def test_engine_errors_are_logged_server_errors(serve, error):
+    base, logged = serve(error)
+    status, payload = _get(f"{base}/search/bm25?q=bear")
+    assert (status, payload) == (500, {"error": str(error)})
+    assert len(logged) == 1 and repr(error) in logged[0]
@@ -0,0 +1,127 @@
+import io
+import json
+import random
+
+import numpy as np
+import pytest
+
+from lib.search_utils import (
+    _JSONArrayReader,
+    diff_documents,
+    iter_movies,
+    top_k_indices,
+)
+
+CHUNK_SIZES = list(range(1, 17)) + [64, 1 << 20]
+
+
+def _read_array(text: str, chunk_size: int, key: str = "movies") -> list:
+    reader = _JSONArrayReader(io.StringIO(text), json.JSONDecoder(), chunk_size)
+    return list(reader.items(key))
+
+
+def _random_value(rng: random.Random, depth: int = 0):
+    kinds = ["int", "float", "exponent", "string", "literal"]
+    if depth < 2:
+        kinds += ["list", "object"]
+    match rng.choice(kinds):
+        case "int":
+            return rng.randint(-(10**12), 10**12)
+        case "float":
+            return round(rng.uniform(-1000, 1000), rng.randint(1, 8))
+        case "exponent":
+            return rng.uniform(-10, 10) * 10.0 ** rng.randint(-30, 30)
+        case "string":
+            characters = 'ab]},"\\é 1.e'
+            return "".join(rng.choice(characters) for _ in range(rng.randint(0, 6)))
+        case "literal":
+            return rng.choice([True, False, None])
+        case "list":
+            return [_random_value(rng, depth + 1) for _ in range(rng.randint(0, 3))]
+        case "object":
+            return {
+                f"k{i}": _random_value(rng, depth + 1) for i in range(rng.randint(0, 3))
+            }
+
+
+def _random_whitespace(rng: random.Random) -> str:
+    return rng.choice(["", "", " ", "\n", " \t\r\n "])
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_array_reader_matches_json_loads(seed):
+    rng = random.Random(seed)
+    values = [_random_value(rng) for _ in range(rng.randint(0, 8))]
+    separator = "," + _random_whitespace(rng)
+    elements = separator.join(
+        json.dumps(value) + _random_whitespace(rng) for value in values
+    )
+    text = "[" + _random_whitespace(rng) + elements + "]"
+    wrapped = '{"meta": {"n": 1.5e3}, "movies": ' + text + ', "tail": [2]}'
+    for chunk_size in CHUNK_SIZES:
+        assert _read_array(text, chunk_size) == json.loads(text)
+        assert _read_array(wrapped, chunk_size) == json.loads(wrapped)["movies"]
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+@pytest.mark.parametrize(
+    "text",
+    ["[1.5]", "[2.5e3, -0.25E-2, 10]", "[1.5,22,-3e+7,4.0]", "[123456789]", "[-1]"],
+)
+def test_array_reader_numbers_split_across_reads(text, chunk_size):
+    assert _read_array(text, chunk_size) == json.loads(text)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 64])
+@pytest.mark.parametrize("text", ['[{"a": 1} {"b": 2}]', "[1, 2", "[1,]", "[1.]", "{}"])
+def test_array_reader_rejects_malformed_json(text, chunk_size):
+    with pytest.raises(json.JSONDecodeError):
+        _read_array(text, chunk_size)
+
+
+def test_iter_movies_reads_json_and_jsonl(tmp_path):
+    movies = [
+        {"id": i, "title": f"Movie {i}", "description": "A bear. " * i}
+        for i in range(5)
+    ]
+    json_path = tmp_path / "movies.json"
+    json_path.write_text(json.dumps({"movies": movies}, indent=2))
+    jsonl_path = tmp_path / "movies.jsonl"
+    jsonl_path.write_text("".join(json.dumps(movie) + "\n\n" for movie in movies))
+
+    assert list(iter_movies(str(json_path))) == movies
+    assert list(iter_movies(str(jsonl_path))) == movies
+
+
+def test_iter_movies_shares_keys_between_movies(tmp_path):
+    path = tmp_path / "movies.json"
+    path.write_text(json.dumps({"movies": [{"id": 1}, {"id": 2}]}))
+    first, second = iter_movies(str(path))
+    # Same key objects as json.load gives, so streamed movies pickle the same
+    assert next(iter(first)) is next(iter(second))
+
+
+def test_diff_documents():
+    indexed = {1: b"a", 2: b"b", 3: b"c", 4: b"d"}
+    incoming = {6: b"f", 4: b"D", 1: b"a", 5: b"e", 2: b"B"}
+    assert diff_documents(indexed, incoming) == ([6, 5], [4, 2], [3])
+    assert diff_documents({}, {}) == ([], [], [])
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_top_k_indices_matches_a_stable_sort(seed):
+    rng = np.random.default_rng(seed)
+    # Few distinct values, so many scores tie at every cut-off
+    scores = rng.integers(-3, 4, rng.integers(0, 50)).astype(np.float32)
+    expected = np.argsort(-scores, kind="stable")
+    for limit in range(len(scores) + 2):
+        np.testing.assert_array_equal(
+            top_k_indices(scores, limit), expected[:limit]
+        )
+
+
+def test_top_k_indices_ranks_infinite_scores_last():
+    scores = np.array([0.5, -np.inf, 0.9, -np.inf, 0.1])
+    np.testing.assert_array_equal(top_k_indices(scores, 5), [2, 0, 4, 1, 3])
+    assert len(top_k_indices(np.array([]), 3)) == 0
+    assert len(top_k_indices(scores, 0)) == 0
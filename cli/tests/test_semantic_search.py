@@ -0,0 +1,125 @@
+import pytest
+
+from lib.chunked_semantic_search import ChunkedSemanticSearch
+from lib.quantization import QUANTIZATION_MODES
+from lib.semantic_search import SemanticSearch
+
+from conftest import STUB_MODEL_NAME, updated_movies
+
+
+def _queries(movies) -> list[str]:
+    return [movie["title"] for movie in movies[:20]] + ["a bear hunts sharks"]
+
+
+def _assert_same_hits(actual: list[dict], expected: list[dict]) -> None:
+    key = "id" if expected and "id" in expected[0] else "title"
+    assert [hit[key] for hit in actual] == [hit[key] for hit in expected]
+    assert [hit["score"] for hit in actual] == pytest.approx(
+        [hit["score"] for hit in expected], abs=1e-6
+    )
+
+
+def _movie_search(movies, model, **options) -> SemanticSearch:
+    search = SemanticSearch(STUB_MODEL_NAME, model=model, **options)
+    search.build_embeddings(movies)
+    return search
+
+
+def _chunk_search(movies, model, **options) -> ChunkedSemanticSearch:
+    search = ChunkedSemanticSearch(STUB_MODEL_NAME, model=model, **options)
+    search.build_chunk_embeddings(movies)
+    return search
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_movie_embeddings_update_matches_a_full_build(movies, model, compact):
+    updated = updated_movies(movies)
+    search = _movie_search(movies, model)
+    stats = search.update_embeddings(updated, compact)
+    queries = _queries(updated) + _queries(movies[::10])
+    results = [search.search(query, 10) for query in queries]
+    rebuilt = _movie_search(updated, model)
+
+    assert stats == {
+        "added": 20,
+        "updated": 39,
+        "deleted": 30,
+        "compacted": 30 if compact else 0,
+    }
+    assert len(search.deleted_rows) == (0 if compact else 30)
+    for query, hits in zip(queries, results):
+        _assert_same_hits(hits, rebuilt.search(query, 10))
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_chunk_embeddings_update_matches_a_full_build(movies, model, compact):
+    updated = updated_movies(movies)
+    search = _chunk_search(movies, model)
+    stats = search.update_chunk_embeddings(updated, compact)
+    queries = _queries(updated) + _queries(movies[::10])
+    results = [search.search_chunks(query, 10) for query in queries]
+    rebuilt = _chunk_search(updated, model)
+
+    assert (stats["added"], stats["updated"], stats["deleted"]) == (20, 39, 30)
+    assert (stats["compacted"] > 0) == compact
+    for query, hits in zip(queries, results):
+        _assert_same_hits(hits, rebuilt.search_chunks(query, 10))
+
+
+def test_unchanged_documents_are_not_reembedded(movies, model):
+    search = _chunk_search(movies, model)
+    search.build_embeddings(movies)
+    store = search.embedding_store
+    misses = store.misses
+    assert search.update_embeddings(movies)["updated"] == 0
+    assert search.update_chunk_embeddings(movies)["updated"] == 0
+    assert store.misses == misses
+
+
+@pytest.mark.parametrize("quantization", [None] + QUANTIZATION_MODES)
+def test_search_many_matches_single_searches(movies, model, quantization):
+    queries = _queries(movies)
+    search = _movie_search(movies, model, quantization=quantization)
+    for hits, query in zip(search.search_many(queries, 10), queries):
+        _assert_same_hits(hits, search.search(query, 10))
+
+    search = _chunk_search(movies, model, quantization=quantization)
+    for hits, query in zip(search.search_chunks_many(queries, 10), queries):
+        _assert_same_hits(hits, search.search_chunks(query, 10))
+
+
+@pytest.mark.parametrize("quantization", QUANTIZATION_MODES)
+def test_quantized_search_rescores_with_exact_scores(movies, model, quantization):
+    exact = _movie_search(movies, model)
+    quantized = _movie_search(movies, model, quantization=quantization)
+    exact_chunks = _chunk_search(movies, model)
+    quantized_chunks = _chunk_search(movies, model, quantization=quantization)
+    for query in _queries(movies):
+        # The shortlist holds limit * RESCORE_FACTOR results, enough to find
+        # the exact top results again
+        _assert_same_hits(quantized.search(query, 5), exact.search(query, 5))
+        _assert_same_hits(
+            quantized_chunks.search_chunks(query, 5),
+            exact_chunks.search_chunks(query, 5),
+        )
+
+
+def test_ann_search_probing_every_list_is_exact(movies, model):
+    exact = _chunk_search(movies, model)
+    ann = _chunk_search(movies, model, ann="ivf", ann_probes=len(movies))
+    for query in _queries(movies):
+        _assert_same_hits(ann.search_chunks(query, 10), exact.search_chunks(query, 10))
+
+
+def test_ann_search_scores_are_bounded_by_the_exact_ones(movies, model):
+    exact = _chunk_search(movies, model)
+    ann = _chunk_search(movies, model, ann="ivf", ann_probes=2)
+    for query in _queries(movies):
+        exact_scores = {
+            hit["id"]: hit["score"] for hit in exact.search_chunks(query, len(movies))
+        }
+        hits = ann.search_chunks(query, 10)
+        assert len(hits) == 10
+        # Only the probed chunks of a movie are scored, exactly
+        for hit in hits:
+            assert hit["score"] <= exact_scores[hit["id"]] + 1e-6